@@ -0,0 +1,44 @@
+"""
+Times the AllowedIPs audit over a large number of prefixes, with a sprinkling of
+duplicated and nested prefixes among them
+
+Usage: python benchmarks/allowed_ips_audit.py [count]
+"""
+
+import sys
+import time
+
+from subnet import ip_network
+
+from wireguard.utils import audit_networks
+
+
+def assignments(count):
+    for idx in range(count):
+        network = ip_network(
+            f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}/32"
+        )
+        yield network, f"peer{idx}"
+
+        # Every thousandth peer also claims a range that other peers are in
+        if idx % 1000 == 0:
+            yield ip_network(
+                f"10.{idx // 65536 % 256}.{idx // 256 % 256}.0/24"
+            ), f"peer{idx}"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    networks = list(assignments(count))
+
+    start = time.perf_counter()
+    conflicts = audit_networks(networks)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(networks)} prefixes audited in {elapsed:.3f}s")
+    print(f"{len(conflicts)} conflicts found")
+
+
+if __name__ == "__main__":
+    main()
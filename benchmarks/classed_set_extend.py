@@ -0,0 +1,57 @@
+"""
+Compares the batched `ClassedSet.extend()` with adding the same values one at a time,
+which is what `extend()` used to do
+
+Usage: python benchmarks/classed_set_extend.py [count]
+"""
+
+import sys
+import time
+
+from wireguard.utils import IPAddressSet, IPNetworkSet
+
+
+def values(count):
+    # Mostly distinct networks, with the usual shared ones repeated in between
+    for idx in range(count):
+        if idx % 10 == 0:
+            yield "0.0.0.0/0"
+        else:
+            yield f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}/32"
+
+
+def one_at_a_time(set_cls, items):
+    collection = set_cls()
+    for item in items:
+        collection.add(item)
+    return collection
+
+
+def batched(set_cls, items):
+    collection = set_cls()
+    collection.extend(items)
+    return collection
+
+
+def timed(label, func, set_cls, items):
+    start = time.perf_counter()
+    collection = func(set_cls, items)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:.3f}s ({len(collection)} unique)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    networks = list(values(count))
+    addresses = [value.split("/")[0] for value in networks]
+
+    print(f"{count} entries")
+    timed("IPNetworkSet one at a time", one_at_a_time, IPNetworkSet, networks)
+    timed("IPNetworkSet.extend()", batched, IPNetworkSet, networks)
+    timed("IPAddressSet one at a time", one_at_a_time, IPAddressSet, addresses)
+    timed("IPAddressSet.extend()", batched, IPAddressSet, addresses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares the memory retained by IPNetworkSet/IPAddressSet with that of their compact,
+integer backed variants
+
+The parse caches are cleared around each measurement, so neither the values they hold
+nor a cache warmed by a previous run count towards (or against) a collection.
+
+Usage: python benchmarks/compact_ip_sets.py [count]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+from wireguard.utils import (
+    CompactIPAddressSet,
+    CompactIPNetworkSet,
+    IPAddressSet,
+    IPNetworkSet,
+    clear_parse_cache,
+)
+
+
+def measure(set_cls, values):
+    clear_parse_cache()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    collection = set_cls()
+    collection.extend(values)
+
+    clear_parse_cache()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Keep the collection alive until it has been measured
+    assert len(collection) == len(values)
+    return after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    addresses = [
+        f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}"
+        for idx in range(count)
+    ]
+    networks = [f"{address}/32" for address in addresses]
+
+    print(f"{count} values, bytes retained per value:")
+    for set_cls, compact_cls, values in (
+        (IPNetworkSet, CompactIPNetworkSet, networks),
+        (IPAddressSet, CompactIPAddressSet, addresses),
+    ):
+        size = measure(set_cls, values) / count
+        compact_size = measure(compact_cls, values) / count
+        print(f"  {set_cls.__name__:<22} {size:8.1f}")
+        print(
+            f"  {compact_cls.__name__:<22} {compact_size:8.1f}"
+            f"  ({size / compact_size:.1f}x smaller)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares the memory used by InterfacePeer objects with that of the previous
+implementation, which used class level defaults, a per-instance `__dict__`, and decoded
+every field eagerly.
+
+Usage: python benchmarks/interface_peer_memory.py [count]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timezone
+
+from subnet import ip_interface
+
+from wireguard.service import InterfacePeer
+from wireguard.utils.sets import NonStrictIPNetworkSet
+
+
+class LegacyInterfacePeer:
+    """
+    InterfacePeer, as it was before it was slotted
+    """
+
+    interface = None
+    peer = None
+
+    ip_address = None
+    preshared_key = None
+    endpoint = None
+    allowed_ips = []
+    latest_handshake = None
+    rx = 0
+    tx = 0
+    persistent_keepalive = False
+
+    def __init__(self, interface, peer, **data):
+        self.interface = interface
+        self.peer = peer
+
+        if data:
+            self.load(data)
+
+    def load(self, data):
+        for key, value in data.items():
+            if key == "latest_handshake":
+                if not isinstance(value, datetime):
+                    value = datetime.fromtimestamp(int(value)).replace(
+                        tzinfo=timezone.utc
+                    )
+
+            elif key == "allowed_ips":
+                if value is None:
+                    continue
+
+                subnets = value.split(",")
+                value = NonStrictIPNetworkSet()
+                value.extend(subnets)
+
+                if "ip_address" not in data and len(subnets) == 1:
+                    self.ip_address = ip_interface(subnets[0]).ip
+
+            setattr(self, key, value)
+
+
+def rows(count):
+    for idx in range(count):
+        yield {
+            "preshared_key": None,
+            "endpoint": f"203.0.{idx // 250 % 250}.{idx % 250 + 1}:51820",
+            "allowed_ips": f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}/32",
+            "latest_handshake": "1700000000",
+            "rx": "123456",
+            "tx": "654321",
+            "persistent_keepalive": False,
+        }
+
+
+def measure(cls, count):
+    data = list(rows(count))
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    peers = [cls("wg0", f"peer{idx}", **row) for idx, row in enumerate(data)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del peers
+    return current, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{count} peers")
+    for name, cls in (
+        ("legacy", LegacyInterfacePeer),
+        ("slotted", InterfacePeer),
+    ):
+        current, elapsed = measure(cls, count)
+        print(
+            f"{name:>8}: {current / count:8.0f} bytes/peer"
+            f"  {elapsed * 1000:8.1f} ms to load"
+        )
+
+
+if __name__ == "__main__":
+    main()
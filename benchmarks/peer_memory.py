@@ -0,0 +1,62 @@
+"""
+Measures the memory used per peer attached to a Server, including the sets, lists and
+keys allocated for each of them, for full Peers and for RemotePeer records
+
+Usage: python benchmarks/peer_memory.py [count]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+from wireguard import Peer, RemotePeer, Server
+from wireguard.utils import generate_key, public_key
+
+
+def measure(count, make_peer):
+    server = Server("bench-server", "10.0.0.0/8", address="10.0.0.1")
+
+    # Generate the keys and addresses up front, so only the peers themselves are measured
+    keys = [generate_key() for _ in range(count)]
+    addresses = [
+        f"10.{(idx + 2) // 65536 % 256}.{(idx + 2) // 256 % 256}.{(idx + 2) % 256}"
+        for idx in range(count)
+    ]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    peers = []
+    for idx in range(count):
+        peer = make_peer(server, f"peer{idx}", addresses[idx], keys[idx])
+        server.peers.add(peer)
+        peers.append(peer)
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / count
+
+
+def full_peer(server, description, address, key):
+    peer = Peer(description, address=address, private_key=key)
+    peer.peers.add(server)
+    return peer
+
+
+def remote_peer(server, description, address, key):  # pylint: disable=unused-argument
+    return RemotePeer(description, public_key(key), address)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    print(f"{count} peers, bytes per peer:")
+    print(f"  Peer        {measure(count, full_peer):8.1f}")
+    print(f"  RemotePeer  {measure(count, remote_peer):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Measures the cyclic garbage collection left behind by discarding a Server, with the
+peers' back-links to the server held weakly (current) or strongly (previously)
+
+Usage: python benchmarks/server_gc.py [count]
+"""
+
+import gc
+import sys
+import time
+
+from wireguard import Server
+
+
+def build(count, strong):
+    server = Server("bench-server", "10.0.0.0/8", address="10.0.0.1")
+    for idx in range(count):
+        peer = server.peer(f"peer{idx}")
+        if strong:
+            # What `Server.add_peer()` used to do
+            peer.peers.add(server)
+    return server
+
+
+def measure(count, strong):
+    gc.collect()
+    gc.disable()
+    try:
+        server = build(count, strong)
+
+        start = time.perf_counter()
+        del server
+        released = time.perf_counter() - start
+
+        start = time.perf_counter()
+        collected = gc.collect()
+        pause = time.perf_counter() - start
+    finally:
+        gc.enable()
+
+    label = "strong" if strong else "weak"
+    print(
+        f"  {label:<8} freed on del: {released * 1000:7.1f}ms, "
+        f"left for gc: {collected:6d} objects, gc pause: {pause * 1000:7.1f}ms"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print(f"{count} peers:")
+    measure(count, strong=True)
+    measure(count, strong=False)
+
+
+if __name__ == "__main__":
+    main()
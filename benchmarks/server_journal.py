@@ -0,0 +1,79 @@
+"""
+Measures the cost of persisting each peer change of a Server, by rewriting a full JSON
+snapshot (previously) or appending to a Journal (current), and the time to restore it,
+which should grow linearly with the number of peers
+
+Usage: python benchmarks/server_journal.py [count]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from wireguard import Peer, Server
+from wireguard.journal import JournaledServer
+
+KEYS = []
+
+
+def public_keys(count):
+    while len(KEYS) < count:
+        KEYS.append(Peer("key", address="10.0.0.1").public_key)
+    return KEYS[:count]
+
+
+def snapshot(directory, count):
+    server = Server("bench-server", "10.0.0.0/8", address="10.0.0.1")
+    path = os.path.join(directory, "wg0.json")
+
+    start = time.perf_counter()
+    for idx, key in enumerate(public_keys(count)):
+        server.remote_peer(f"peer{idx}", key)
+        with open(path, mode="w", encoding="utf-8") as snapshot_fh:
+            snapshot_fh.write(server.json())
+            snapshot_fh.flush()
+            os.fsync(snapshot_fh.fileno())
+    return time.perf_counter() - start
+
+
+def journal(directory, count):
+    path = os.path.join(directory, f"wg{count}")
+    server = JournaledServer.restore(path, "bench-server", "10.0.0.0/8")
+
+    start = time.perf_counter()
+    for idx, key in enumerate(public_keys(count)):
+        server.remote_peer(f"peer{idx}", key)
+    server.journal.close()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    JournaledServer.restore(path).journal.close()
+    return elapsed, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    public_keys(count * 2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        rewrite = snapshot(directory, count)
+        append, restore = journal(directory, count)
+        restore_double = journal(directory, count * 2)[1]
+
+    print(f"{count} peers added:")
+    print(
+        f"  snapshot rewrite: {rewrite * 1000:8.1f}ms ({rewrite / count * 1e6:7.1f}us/peer)"
+    )
+    print(
+        f"  journal append:   {append * 1000:8.1f}ms ({append / count * 1e6:7.1f}us/peer)"
+    )
+    print(f"  journal restore:  {restore * 1000:8.1f}ms")
+    print(
+        f"  restore 2x peers: {restore_double * 1000:8.1f}ms "
+        f"({restore_double / restore:.1f}x the time)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import pytest
+
+from wireguard import Interface
+from wireguard.service import PeerRow
+
+
+class ScriptedInterface(Interface):
+    """
+    An interface whose dump rows are provided by the test, instead of by `wg`
+
+    `fail` makes every poll raise: the given exception, or an OSError when it is True.
+    """
+
+    def __init__(self, interface='wg0', counters=None, fail=False):
+        super().__init__(interface)
+        self.rows = []
+        self.fail = fail
+        self.polls = 0
+        if counters:
+            self.set_counters(**counters)
+
+    def set_counters(self, **counters):
+        self.rows = [
+            PeerRow(self.interface, key, '(none)', '(none)', '(none)', '1700000000', rx, tx, 'off')
+            for key, (rx, tx) in counters.items()
+        ]
+
+    def set_peers(self, **peers):
+        self.rows = [
+            PeerRow(self.interface, key, '(none)', endpoint, allowed_ips, str(handshake), 0, 0, 'off')
+            for key, (endpoint, allowed_ips, handshake) in peers.items()
+        ]
+
+    def iter_stats(self):
+        self.polls += 1
+        if self.fail:
+            raise self.fail if isinstance(self.fail, Exception) else OSError('wg is not available')
+
+        yield from self.rows
+
+
+@pytest.fixture
+def scripted_interface():
+    """
+    Returns the ScriptedInterface class, to create as many interfaces as a test needs
+    """
+
+    return ScriptedInterface
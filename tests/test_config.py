@@ -194,3 +194,27 @@ def test_write_peer_config(interface, path, full_path):
         mo.assert_has_calls([
             call(full_path, mode='w', encoding='utf-8'),
         ], any_order=True)
+
+
+def test_collapse_allowed_ips():
+
+    class CollapsingConfig(Config):
+        collapse_allowed_ips = True
+
+    peer = Peer(
+        'test-peer',
+        address='10.8.0.2',
+        allowed_ips=[f'172.16.{idx}.0/24' for idx in range(4)],
+    )
+
+    # Without opting in, the networks are rendered exactly as added
+    assert len(peer.config.allowed_ips.split(',')) == 5
+
+    peer.config_cls = CollapsingConfig
+    config = CollapsingConfig(peer)
+    assert config.allowed_ips.startswith('AllowedIPs = ')
+    assert sorted(config.allowed_ips[len('AllowedIPs = '):].split(',')) == ['10.8.0.2/32', '172.16.0.0/22']
+    assert 'AllowedIPs = ' in config.remote_config
+
+    # The peer's own networks are left alone
+    assert len(peer.allowed_ips) == 5
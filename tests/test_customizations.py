@@ -87,3 +87,70 @@ def test_peer_invalid_custom_service_cls(cls):
             dns=ip_address(dns),
             service_cls=cls,
         )
+
+
+def test_slotted_peer_subclasses():
+    from wireguard import Server
+
+    class TaggedPeer(Peer):
+        pass
+
+    class SlottedPeer(Peer):
+        __slots__ = ('tag',)
+
+        def __init__(self, description, *, tag=None, **kwargs):
+            super().__init__(description, **kwargs)
+            self.tag = tag
+
+    peer = Peer('test-peer', address='192.168.0.2')
+    assert not hasattr(peer, '__dict__')
+    with pytest.raises(AttributeError):
+        peer.tag = 'nope'
+
+    # Subclasses that don't declare __slots__ can still have extra attributes
+    tagged = TaggedPeer('test-peer', address='192.168.0.3', config_cls=MyCustomConfig)
+    tagged.tag = 'office'
+    assert isinstance(tagged.config, MyCustomConfig)
+
+    slotted = SlottedPeer('test-peer', address='192.168.0.4', tag='home', service_cls=MyCustomInterface)
+    assert slotted.tag == 'home'
+    assert isinstance(slotted.service, MyCustomInterface)
+
+    server = Server('test-server', '192.168.0.0/24', address='192.168.0.1')
+    assert not hasattr(server, '__dict__')
+    remote = server.peer('remote', peer_cls=SlottedPeer, tag='remote')
+    assert remote.tag == 'remote'
+    assert server.route_lookup(remote.ipv4) is remote
+
+    # Hooks and DNS servers are only allocated when they are used
+    from wireguard.peer import _UNALLOCATED
+    assert peer._pre_up is _UNALLOCATED
+    assert peer.pre_up == []
+    assert peer._pre_up == []
+    peer.post_down = None
+    assert peer.config.post_down is None
+
+
+def test_render_leaves_collections_unallocated():
+
+    from wireguard import Server
+    from wireguard.peer import _UNALLOCATED
+
+    hooks = ('_dns', '_pre_up', '_post_up', '_pre_down', '_post_down')
+
+    server = Server('test-server', '192.168.0.0/24', address='192.168.0.1')
+    config = server.config.local_config
+    assert 'DNS' not in config
+    assert 'PreUp' not in config
+    assert '"pre_up": []' in server.json()
+
+    peer = Peer('test-peer', address='192.168.0.2')
+    assert 'DNS' not in peer.config.local_config
+    assert '"dns": []' in peer.json()
+
+    for item in (server, peer):
+        for name in hooks:
+            assert getattr(item, name) is _UNALLOCATED
+
+    peer.dns = ['8.8.8.8']
+    assert 'DNS = 8.8.8.8' in peer.config.local_config
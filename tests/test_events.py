@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import pytest
+
+from wireguard.events import PeerEventMonitor
+
+
+def types_of(events):
+    return sorted((event.type, event.peer) for event in events)
+
+
+def test_peer_events(scripted_interface):
+    iface = scripted_interface()
+    monitor = PeerEventMonitor(iface, handshake_timeout=100, disconnect_timeout=150)
+
+    received = []
+    monitor.subscribe(received.append)
+    roaming = []
+    monitor.subscribe(roaming.append, types=['endpoint_changed'])
+
+    iface.set_peers(
+        peer1=('1.2.3.4:51820', '10.8.0.2/32', 1000),
+        peer2=('(none)', '10.8.0.3/32', 0),
+    )
+    # The first poll only records the state of the interface
+    assert monitor.poll(now=1050) == []
+
+    iface.set_peers(
+        peer1=('5.6.7.8:51820', '10.8.0.2/32', 1000),
+        peer2=('(none)', '10.8.0.3/32,10.9.0.0/24', 1060),
+        peer3=('(none)', '10.8.0.4/32', 0),
+    )
+    events = monitor.poll(now=1070)
+    assert types_of(events) == [
+        ('allowed_ips_changed', 'peer2'),
+        ('connected', 'peer2'),
+        ('endpoint_changed', 'peer1'),
+        ('handshake', 'peer2'),
+    ]
+    endpoint = [event for event in events if event.type == 'endpoint_changed'][0]
+    assert str(endpoint.previous) == '1.2.3.4:51820'
+    assert str(endpoint.current) == '5.6.7.8:51820'
+    allowed = [event for event in events if event.type == 'allowed_ips_changed'][0]
+    assert sorted(str(ip) for ip in allowed.current) == ['10.8.0.3/32', '10.9.0.0/24']
+
+    assert received == events
+    assert roaming == [endpoint]
+
+    # Past handshake_timeout, but still within disconnect_timeout
+    assert monitor.poll(now=1120) == []
+
+    events = monitor.poll(now=1151)
+    assert types_of(events) == [('disconnected', 'peer1')]
+
+    # Removing a connected peer disconnects it
+    iface.set_peers(peer1=('5.6.7.8:51820', '10.8.0.2/32', 1000))
+    assert types_of(monitor.poll(now=1160)) == [('disconnected', 'peer2')]
+
+    monitor.unsubscribe(received.append)
+    iface.set_peers(peer1=('5.6.7.8:51820', '10.8.0.2/32', 1200))
+    assert types_of(monitor.poll(now=1200)) == [('connected', 'peer1'), ('handshake', 'peer1')]
+    assert len(received) == 6
+
+
+def test_peer_events_invalid(scripted_interface):
+    with pytest.raises(ValueError):
+        PeerEventMonitor(scripted_interface(), handshake_timeout=100, disconnect_timeout=50)
+
+    with pytest.raises(ValueError):
+        PeerEventMonitor(scripted_interface()).subscribe(print, types=['roaming'])
+
+
+def test_peer_events_async_iterator(scripted_interface):
+    iface = scripted_interface()
+    monitor = PeerEventMonitor(iface, interval=0)
+    received = []
+    monitor.subscribe(received.append)
+
+    iface.set_peers(peer1=('(none)', '10.8.0.2/32', 0))
+
+    async def first_event():
+        async for event in monitor:
+            return event
+
+    async def run():
+        task = asyncio.ensure_future(first_event())
+        await asyncio.sleep(0.05)
+        iface.set_peers(peer1=('1.2.3.4:51820', '10.8.0.2/32', 0))
+        return await asyncio.wait_for(task, 5)
+
+    event = asyncio.new_event_loop().run_until_complete(run())
+    assert event.type == 'endpoint_changed'
+    assert event.peer == 'peer1'
+
+    # The events are yielded, rather than also dispatched to the callbacks
+    assert received == []
+
+
+def test_peer_events_isolate_errors(scripted_interface):
+    iface = scripted_interface()
+    monitor = PeerEventMonitor(iface, interval=0.01)
+
+    def broken(event):
+        raise RuntimeError('broken subscriber')
+
+    received = []
+    monitor.subscribe(broken)
+    monitor.subscribe(received.append)
+
+    iface.set_peers(peer1=('(none)', '10.8.0.2/32', 0))
+    monitor.poll()
+    iface.set_peers(peer1=('1.2.3.4:51820', '10.8.0.2/32', 0))
+    monitor.poll()
+
+    # A failing callback does not keep the other ones from being called
+    assert [event.type for event in received] == ['endpoint_changed']
+    assert isinstance(monitor.last_callback_error, RuntimeError)
+
+    # Nor does a dump that cannot be read stop the polling
+    iface.fail = ValueError('malformed dump')
+    monitor.start()
+    try:
+        time.sleep(0.05)
+        assert isinstance(monitor.last_error, ValueError)
+
+        iface.fail = False
+        iface.set_peers(peer1=('5.6.7.8:51820', '10.8.0.2/32', 0))
+        deadline = time.monotonic() + 5
+        while len(received) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        monitor.stop()
+
+    assert [event.type for event in received] == ['endpoint_changed'] * 2
+    assert monitor.last_error is None
@@ -0,0 +1,85 @@
+
+import struct
+import urllib.error
+import urllib.request
+
+import pytest
+
+from wireguard.exporter import MetricsExporter
+
+
+def test_exporter_render(scripted_interface):
+
+    exporter = MetricsExporter(
+        [
+            scripted_interface('wg0', {'peer+1=': (100, 200), 'peer2': (1, 2)}),
+            scripted_interface('wg1', {}, fail=True),
+        ]
+    )
+    exporter.poll()
+
+    lines = exporter.metrics.decode('utf-8').splitlines()
+
+    assert '# TYPE wireguard_peer_receive_bytes_total counter' in lines
+    assert 'wireguard_peer_receive_bytes_total{interface="wg0",public_key="peer+1="} 100' in lines
+    assert 'wireguard_peer_transmit_bytes_total{interface="wg0",public_key="peer2"} 2' in lines
+    assert 'wireguard_peer_latest_handshake_seconds{interface="wg0",public_key="peer2"} 1700000000' in lines
+    assert 'wireguard_interface_peers{interface="wg0"} 2' in lines
+    assert 'wireguard_interface_receive_bytes_total{interface="wg0"} 101' in lines
+    assert 'wireguard_interface_transmit_bytes_total{interface="wg0"} 202' in lines
+    assert 'wireguard_interface_poll_errors_total{interface="wg1"} 1' in lines
+    assert 'wireguard_interface_peers{interface="wg1"} 0' in lines
+    assert 'wireguard_interface_last_poll_success{interface="wg0"} 1' in lines
+    assert 'wireguard_interface_last_poll_success{interface="wg1"} 0' in lines
+
+
+def test_exporter_serves_from_shared_poll(scripted_interface):
+
+    iface = scripted_interface('wg0', {'peer1': (100, 200)})
+    exporter = MetricsExporter(iface, interval=60, port=0)
+    exporter.start()
+    try:
+        url = f'http://{exporter.host}:{exporter.port}/metrics'
+        for _ in range(5):
+            with urllib.request.urlopen(url) as resp:
+                assert resp.status == 200
+                assert resp.headers['Content-Type'].startswith('text/plain')
+                body = resp.read().decode('utf-8')
+            assert 'wireguard_interface_peers{interface="wg0"} 1' in body
+
+        # Scrapes never poll the interface themselves, and the polling thread only
+        # polls once the first interval has passed
+        assert iface.polls == 1
+
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            urllib.request.urlopen(f'http://{exporter.host}:{exporter.port}/')
+        assert exc.value.code == 404
+
+    finally:
+        exporter.stop()
+
+
+def test_exporter_requires_interfaces():
+
+    with pytest.raises(ValueError):
+        MetricsExporter([])
+
+
+def test_exporter_counts_malformed_dumps(scripted_interface):
+
+    iface = scripted_interface('wg0', {}, fail=ValueError('malformed dump'))
+    exporter = MetricsExporter(iface, interval=0.01)
+    exporter.poll()
+    # Any other error, eg. from decoding netlink messages, is counted the same way
+    iface.fail = struct.error('unpack requires a buffer of 4 bytes')
+    exporter.poll()
+
+    assert isinstance(exporter.last_error, struct.error)
+    lines = exporter.metrics.decode('utf-8').splitlines()
+    assert 'wireguard_interface_poll_errors_total{interface="wg0"} 2' in lines
+    assert 'wireguard_interface_last_poll_success{interface="wg0"} 0' in lines
+
+    iface.fail = False
+    exporter.poll()
+    lines = exporter.metrics.decode('utf-8').splitlines()
+    assert 'wireguard_interface_last_poll_success{interface="wg0"} 1' in lines
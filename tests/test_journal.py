@@ -0,0 +1,162 @@
+
+
+import os
+import time
+
+import pytest
+
+from wireguard import (
+    Peer,
+    RemotePeer,
+)
+from wireguard.journal import (
+    Journal,
+    JournaledServer,
+)
+
+
+def remote_key():
+    return Peer('key', address='10.0.0.1').public_key
+
+
+def test_journaled_server_restore(tmp_path):
+
+    path = str(tmp_path / 'wg0')
+    server = JournaledServer.restore(path, 'server1', '192.168.0.0/24')
+
+    peer = server.peer('peer1')
+    remote = server.remote_peer('remote1', remote_key(), allowed_ips='10.0.0.0/8')
+    other = server.remote_peer('remote2', remote_key())
+    server.remove_peer(other)
+    server.keepalive = 25
+    server.dns = ['8.8.8.8']
+    server.journal.close()
+
+    restored = JournaledServer.restore(path)
+
+    assert restored.private_key == server.private_key
+    assert restored.address == server.address
+    assert restored.ipv4_subnet == server.ipv4_subnet
+    assert restored.keepalive == 25
+    assert [str(ip) for ip in restored.dns] == ['8.8.8.8']
+
+    assert len(restored.peers) == 2
+    assert peer.public_key in restored.peers
+    assert isinstance(restored.peers.get(peer.public_key), RemotePeer)
+    assert restored.route_lookup('10.1.2.3').public_key == remote.public_key
+    assert other.public_key not in restored.peers
+    assert remote.config.remote_config in restored.config.peers
+
+    # Changes after a restore are recorded too
+    restored.remove_peer(restored.peers.get(peer.public_key))
+    restored.journal.close()
+
+    assert len(JournaledServer.restore(path).peers) == 1
+
+
+def test_journal_compaction(tmp_path):
+
+    path = str(tmp_path / 'wg0')
+    journal = Journal(path, compact_every=3)
+    server = JournaledServer.restore(journal, 'server1', '192.168.0.0/24')
+
+    for index in range(10):
+        server.remote_peer(f'peer{index}', remote_key())
+    journal.compact(wait=True)
+    server.remote_peer('peer10', remote_key())
+    journal.close()
+
+    # Only the journal file started by the last compaction is left next to the snapshot
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 2
+    assert files[0].startswith('wg0.journal.')
+    assert files[1] == 'wg0.snapshot'
+
+    restored = JournaledServer.restore(path)
+    assert sorted(peer.public_key for peer in restored.peers) == sorted(
+        peer.public_key for peer in server.peers
+    )
+
+
+def test_journal_torn_record(tmp_path):
+
+    path = str(tmp_path / 'wg0')
+    server = JournaledServer.restore(path, 'server1', '192.168.0.0/24')
+    server.remote_peer('peer1', remote_key())
+    server.journal.close()
+
+    # A crash in the middle of writing a record only loses that record
+    segment = server.journal.segment_path(0)
+    with open(segment, 'a', encoding='utf-8') as segment_fh:
+        segment_fh.write('["r","abc')
+
+    restored = JournaledServer.restore(path)
+    assert len(restored.peers) == 1
+
+    restored.remote_peer('peer2', remote_key())
+    restored.journal.close()
+    assert len(JournaledServer.restore(path).peers) == 2
+
+    # Anything unreadable before the last record is an error
+    with open(segment, 'r+', encoding='utf-8') as segment_fh:
+        segment_fh.write('garbage')
+
+    with pytest.raises(ValueError):
+        JournaledServer.restore(path)
+
+
+def test_journal_syncs_after_interval(tmp_path, monkeypatch):
+
+    synced = []
+    monkeypatch.setattr('wireguard.journal.os.fsync', synced.append)
+
+    journal = Journal(str(tmp_path / 'wg0'), sync_every=100, sync_interval=0.05)
+    journal.load()
+
+    # Creating the first journal file syncs the directory it was created in
+    assert len(synced) == 1
+    synced.clear()
+
+    # A single record is synced once the interval is up, without another append
+    journal.append(['s', 'mtu', 1420])
+    assert not synced
+    deadline = time.monotonic() + 5
+    while not synced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(synced) == 1
+
+    # The timer is stopped by syncing and closing
+    journal.append(['s', 'mtu', 1280])
+    journal.close()
+    assert len(synced) == 2
+    time.sleep(0.1)
+    assert len(synced) == 2
+
+
+def test_journal_compaction_errors(tmp_path, monkeypatch):
+
+    path = str(tmp_path / 'wg0')
+    journal = Journal(path, compact_every=0)
+    server = JournaledServer.restore(journal, 'server1', '192.168.0.0/24')
+    server.remote_peer('peer1', remote_key())
+
+    def broken(state, record):
+        raise OSError('No space left on device')
+
+    # A failed compaction is raised by waiting on it, and leaves the files in place
+    monkeypatch.setattr('wireguard.journal.apply_record', broken)
+    with pytest.raises(OSError):
+        journal.compact(wait=True)
+    assert not os.path.exists(journal.snapshot_path)
+
+    # Or by closing the journal, when it was not waited on
+    journal.compact()
+    with pytest.raises(OSError):
+        journal.close()
+
+    monkeypatch.undo()
+    restored = JournaledServer.restore(path)
+    assert len(restored.peers) == 1
+    restored.journal.compact(wait=True)
+    restored.journal.close()
+    assert os.path.exists(journal.snapshot_path)
@@ -0,0 +1,321 @@
+
+import errno
+import struct
+
+import pytest
+
+from wireguard import Peer
+from wireguard.service import PeerRow
+from wireguard.netlink import (
+    CTRL_ATTR_FAMILY_ID,
+    GENL_ID_CTRL,
+    NLM_F_MULTI,
+    NLMSG_DONE,
+    NLMSG_ERROR,
+    WG_CMD_GET_DEVICE,
+    WG_CMD_SET_DEVICE,
+    WGDEVICE_A_FLAGS,
+    WGDEVICE_A_PEERS,
+    WGDEVICE_A_PRIVATE_KEY,
+    NetlinkError,
+    NetlinkInterface,
+    decode_attrs,
+    decode_device,
+    decode_endpoint,
+    decode_genl,
+    decode_messages,
+    encode_attr,
+    encode_endpoint,
+    encode_genl,
+    encode_message,
+    encode_set_device,
+    parse_config,
+)
+
+
+PRIVATE_KEY = 'AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8='
+PUBLIC_KEY = 'ICEiIyQlJicoKSorLC0uLzAxMjM0NTY3ODk6Ozw9Pj8='
+PEER1_KEY = 'QEFCQ0RFRkdISUpLTE1OT1BRUlNUVVZXWFlaW1xdXl8='
+PEER2_KEY = 'YGFiY2RlZmdoaWprbG1ub3BxcnN0dXZ3eHl6e3x9fn8='
+PRESHARED_KEY = 'ERERERERERERERERERERERERERERERERERERERERERE='
+
+# A WG_CMD_GET_DEVICE reply for `wg0` (ifindex 7, port 51820), with 2 peers:
+# - PEER1: preshared key, endpoint 203.0.113.5:51820, keepalive 25, handshake at
+#   1700000000, rx 1024, tx 2048, allowed IPs 10.8.0.2/32 + fd00::2/128
+# - PEER2: never connected, no endpoint nor allowed IPs
+GET_DEVICE_PAYLOAD = bytes.fromhex(
+    '00010000060006006cca00000800070000000000080001000700000008000200'
+    '7767300024000300000102030405060708090a0b0c0d0e0f1011121314151617'
+    '18191a1b1c1d1e1f24000400202122232425262728292a2b2c2d2e2f30313233'
+    '3435363738393a3b3c3d3e3f70010880e4000080240001004041424344454647'
+    '48494a4b4c4d4e4f505152535455565758595a5b5c5d5e5f2400020011111111'
+    '1111111111111111111111111111111111111111111111111111111114000400'
+    '0200ca6ccb007105000000000000000006000500190000001400060000f15365'
+    '0000000005000000000000000c00070000040000000000000c00080000080000'
+    '00000000480009801c0000800600010002000000080002000a08000205000300'
+    '2000000028000080060001000a00000014000200fd0000000000000000000000'
+    '00000002050003008000000008000a0001000000880000802400010060616263'
+    '6465666768696a6b6c6d6e6f707172737475767778797a7b7c7d7e7f24000200'
+    '0000000000000000000000000000000000000000000000000000000000000000'
+    '060005000000000014000600000000000000000000000000000000000c000700'
+    '00000000000000000c000800000000000000000008000a0001000000'
+)
+
+WG_FAMILY_ID = 0x1b
+
+
+class FakeNetlinkSocket:
+    """
+    Answers generic netlink requests like the kernel would, without the kernel
+    """
+
+    def __init__(self, device_payloads=None, error=0):
+        self.device_payloads = device_payloads or [GET_DEVICE_PAYLOAD]
+        self.error = error
+        self.requests = []
+        self.set_payloads = []
+        self._pending = []
+
+    def _reply(self, msg_type, seq, payload, flags=0):
+        self._pending.append(encode_message(msg_type, flags, seq, payload))
+
+    def _ack(self, seq, error=0):
+        self._reply(NLMSG_ERROR, seq, struct.pack('=i', error) + b'\0' * 16)
+
+    def send(self, data):
+        for msg_type, flags, seq, payload in decode_messages(data):
+            self.requests.append((msg_type, payload))
+            cmd, _ = decode_genl(payload)
+
+            if msg_type == GENL_ID_CTRL:
+                self._reply(
+                    GENL_ID_CTRL,
+                    seq,
+                    encode_genl(1, [encode_attr(CTRL_ATTR_FAMILY_ID, struct.pack('=H', WG_FAMILY_ID))]),
+                )
+                self._ack(seq)
+
+            elif self.error:
+                self._ack(seq, -self.error)
+
+            elif cmd == WG_CMD_GET_DEVICE:
+                for device_payload in self.device_payloads:
+                    self._reply(WG_FAMILY_ID, seq, device_payload, flags=NLM_F_MULTI)
+                self._reply(NLMSG_DONE, seq, struct.pack('=i', 0), flags=NLM_F_MULTI)
+
+            elif cmd == WG_CMD_SET_DEVICE:
+                self.set_payloads.append(payload)
+                self._ack(seq)
+
+        return len(data)
+
+    def recv(self, bufsize):
+        return self._pending.pop(0)
+
+
+def peers_of(payload):
+    _, data = decode_genl(payload)
+    for attr_type, value in decode_attrs(data):
+        if attr_type == WGDEVICE_A_PEERS:
+            return decode_device([encode_genl(0, [encode_attr(WGDEVICE_A_PEERS | 0x8000, value)])])['peers']
+    return []
+
+
+def test_decode_captured_device():
+
+    device = decode_device([GET_DEVICE_PAYLOAD])
+
+    assert device['ifindex'] == 7
+    assert device['ifname'] == 'wg0'
+    assert device['listen_port'] == 51820
+    assert device['private_key'] == PRIVATE_KEY
+    assert device['public_key'] == PUBLIC_KEY
+    assert len(device['peers']) == 2
+
+    peer1, peer2 = device['peers']
+    assert peer1 == {
+        'public_key': PEER1_KEY,
+        'preshared_key': PRESHARED_KEY,
+        'endpoint': '203.0.113.5:51820',
+        'allowed_ips': ['10.8.0.2/32', 'fd00::2/128'],
+        'latest_handshake': 1700000000,
+        'rx': 1024,
+        'tx': 2048,
+        'persistent_keepalive': 25,
+    }
+    assert peer2['public_key'] == PEER2_KEY
+    assert peer2['preshared_key'] is None
+    assert peer2['endpoint'] is None
+    assert peer2['allowed_ips'] == []
+    assert peer2['persistent_keepalive'] is False
+
+
+def test_decode_device_merges_split_peers():
+
+    def payload(*allowed_ips):
+        return encode_set_device(
+            'wg0',
+            peers=[{'public_key': PEER1_KEY, 'allowed_ips': list(allowed_ips)}],
+        )[0]
+
+    device = decode_device([payload('10.0.0.1/32'), payload('10.0.0.2/32')])
+
+    assert len(device['peers']) == 1
+    assert device['peers'][0]['allowed_ips'] == ['10.0.0.1/32', '10.0.0.2/32']
+
+
+@pytest.mark.parametrize(
+    ('endpoint',),
+    [
+        ('203.0.113.5:51820',),
+        ('[2001:db8::1]:443',),
+    ],
+)
+def test_endpoint_round_trip(endpoint):
+    assert decode_endpoint(encode_endpoint(endpoint)) == endpoint
+
+
+def test_encode_endpoint_defaults_and_errors():
+    # Without a port the default WireGuard port is used, even for bare IPv6 addresses
+    assert decode_endpoint(encode_endpoint('203.0.113.5')) == '203.0.113.5:51820'
+    assert decode_endpoint(encode_endpoint('fd00::1')) == '[fd00::1]:51820'
+    assert decode_endpoint(encode_endpoint('[fd00::1]')) == '[fd00::1]:51820'
+
+    for endpoint in (':51820', '[]:51820', '203.0.113.5:70000', 'no-such-host.invalid:51820'):
+        with pytest.raises(ValueError):
+            encode_endpoint(endpoint)
+
+
+def test_encode_set_device_splits_large_peers():
+
+    allowed_ips = [f'10.{idx // 256}.{idx % 256}.0/24' for idx in range(1000)]
+    peers = [
+        {'public_key': PEER1_KEY, 'allowed_ips': allowed_ips, 'replace_allowed_ips': True},
+        {'public_key': PEER2_KEY, 'remove': True},
+    ]
+
+    payloads = encode_set_device(
+        'wg0', private_key=PRIVATE_KEY, replace_peers=True, peers=peers
+    )
+
+    assert len(payloads) > 1
+    for idx, payload in enumerate(payloads):
+        assert len(payload) < 4096
+        attr_types = [attr_type for attr_type, _ in decode_attrs(decode_genl(payload)[1])]
+        assert (WGDEVICE_A_PRIVATE_KEY in attr_types) == (idx == 0)
+        assert (WGDEVICE_A_FLAGS in attr_types) == (idx == 0)
+
+    device = decode_device(payloads)
+    assert [peer['public_key'] for peer in device['peers']] == [PEER1_KEY, PEER2_KEY]
+    assert device['peers'][0]['allowed_ips'] == allowed_ips
+
+
+def test_netlink_interface_stats():
+
+    sock = FakeNetlinkSocket()
+    iface = NetlinkInterface('wg0', sock=sock)
+
+    stats = iface.stats()
+    assert set(stats) == {PEER1_KEY, PEER2_KEY}
+    assert stats[PEER1_KEY].rx == 1024
+    assert stats[PEER1_KEY].tx == 2048
+    assert stats[PEER1_KEY].endpoint == '203.0.113.5:51820'
+    assert stats[PEER1_KEY].persistent_keepalive == 25
+    assert stats[PEER2_KEY].handshake_age() is None
+
+    assert iface.public_key() == PUBLIC_KEY
+
+    # The family ID is only resolved once per socket
+    assert [msg_type for msg_type, _ in sock.requests].count(GENL_ID_CTRL) == 1
+
+    lines = iface.dump().stdout.splitlines()
+    assert lines[0].split('\t') == [PRIVATE_KEY, PUBLIC_KEY, '51820', 'off']
+    assert lines[1].split('\t') == [
+        PEER1_KEY,
+        PRESHARED_KEY,
+        '203.0.113.5:51820',
+        '10.8.0.2/32,fd00::2/128',
+        '1700000000',
+        '1024',
+        '2048',
+        '25',
+    ]
+    assert lines[2].split('\t')[1:4] == ['(none)', '(none)', '(none)']
+
+    # The rows are built from the decoded peers, just as they would be parsed
+    assert list(iface.iter_stats()) == [
+        PeerRow.from_fields('wg0', line.split('\t')) for line in lines[1:]
+    ]
+
+
+def test_netlink_interface_error():
+
+    iface = NetlinkInterface('wg0', sock=FakeNetlinkSocket(error=errno.ENODEV))
+
+    with pytest.raises(NetlinkError) as exc:
+        iface.stats()
+    assert exc.value.errno == errno.ENODEV
+
+
+def test_netlink_interface_sync(tmp_path):
+
+    config_file = tmp_path / 'wg0.conf'
+    config_file.write_text(
+        '[Interface]\n'
+        f'PrivateKey = {PRIVATE_KEY}\n'
+        'ListenPort = 51820\n'
+        'Address = 10.8.0.1/24\n'
+        '\n'
+        '[Peer]\n'
+        '# peer1\n'
+        f'PublicKey = {PEER1_KEY}\n'
+        'AllowedIPs = 10.8.0.2/32, 10.9.0.0/24\n'
+        'AllowedIPs = fd00::2/128\n'
+    )
+
+    sock = FakeNetlinkSocket()
+    NetlinkInterface('wg0', sock=sock).sync(str(config_file))
+
+    assert len(sock.set_payloads) == 1
+    peers = peers_of(sock.set_payloads[0])
+    assert [peer['public_key'] for peer in peers] == [PEER1_KEY, PEER2_KEY]
+    assert peers[0]['allowed_ips'] == ['10.8.0.2/32', '10.9.0.0/24', 'fd00::2/128']
+
+
+def test_parse_config_invalid():
+
+    with pytest.raises(ValueError):
+        parse_config('[Interface]\nBogus = 1\n')
+
+    with pytest.raises(ValueError):
+        parse_config('[Peer]\nAllowedIPs = 10.0.0.1/32\n')
+
+
+def test_netlink_service_cls():
+
+    peer = Peer('test-peer', address='192.168.0.2', service_cls=NetlinkInterface)
+
+    assert isinstance(peer.service, NetlinkInterface)
+
+
+def test_netlink_interface_apply():
+    from wireguard import Server
+
+    server = Server('server', '10.8.0.0/24', address='10.8.0.1')
+    server.add_peer(Peer('peer1', address='10.8.0.2', public_key=PEER1_KEY))
+
+    sock = FakeNetlinkSocket()
+    report = NetlinkInterface('wg0', sock=sock).apply(server)
+
+    assert report.added == []
+    assert report.removed == [PEER2_KEY]
+    assert report.updated == {
+        PEER1_KEY: ['allowed_ips', 'persistent_keepalive', 'preshared_key'],
+    }
+    assert report.invocations == len(sock.set_payloads) == 1
+
+    peers = peers_of(sock.set_payloads[0])
+    assert peers[0]['allowed_ips'] == ['10.8.0.2/32']
+    assert peers[0]['preshared_key'] is None
+    assert peers[0]['persistent_keepalive'] is False
+    assert peers[1]['public_key'] == PEER2_KEY
@@ -151,3 +151,111 @@ def test_peer_bidirectional_removal():
     peer1.remove_peer(server, bidirectional=False)
     assert len(peer1.peers) == 0
     assert len(server.peers) == 2
+
+
+def test_peer_set_keyed_by_public_key():
+    from wireguard.utils import generate_key
+
+    key = generate_key()
+    peer = Peer('peer', address='192.168.0.2', private_key=key)
+    same_key = Peer('same-key', address='192.168.0.3', private_key=key)
+    other = Peer('other', address='192.168.0.4')
+
+    peers = PeerSet()
+    peers.add(peer)
+    peers.add(peer)
+    assert len(peers) == 1
+
+    # Membership by Peer, or by public key, regardless of the object
+    assert peer in peers
+    assert peer.public_key in peers
+    assert same_key in peers
+    assert other not in peers
+    assert peers.get(peer.public_key) is peer
+    assert peers.get(other.public_key) is None
+
+    with pytest.raises(ValueError) as exc:
+        peers.add(same_key)
+    assert 'already present' in str(exc.value)
+
+    # Every duplicate is reported, and nothing is added
+    with pytest.raises(ValueError) as exc:
+        peers.extend([other, same_key, Peer('copy', address='192.168.0.5', public_key=other.public_key)])
+    assert str(exc.value).count('duplicate public key') == 2
+    assert len(peers) == 1
+
+    peers.extend([other])
+    assert len(peers) == 2
+
+    peers.discard(peer.public_key)
+    assert peer not in peers
+    peers.remove_by_public_key(other.public_key)
+    assert not peers
+
+
+def test_server_rejects_duplicate_public_keys():
+    server = Server('server1', subnet='192.168.0.1/24')
+    peer = server.peer('peer1')
+
+    with pytest.raises(ValueError):
+        server.peers.add(Peer('copy', address='192.168.0.99', public_key=peer.public_key))
+
+    assert server.pubkey_exists(peer.public_key)
+    assert len(server.peers) == 1
+
+
+def test_peer_set_mutators_keep_keys():
+
+    peers = [Peer(f'peer{index}', address=f'10.0.0.{index + 1}') for index in range(4)]
+
+    peer_set = PeerSet(peers[:2])
+    popped = peer_set.pop()
+    assert popped not in peer_set
+    assert popped.public_key not in peer_set
+    assert len(peer_set) == 1
+
+    peer_set = PeerSet()
+    peer_set.update([peers[0]], {peers[1]})
+    assert peers[0] in peer_set
+    assert peers[1].public_key in peer_set
+    assert len(peer_set) == 2
+
+    peer_set |= {peers[2]}
+    assert peers[2] in peer_set
+    assert len(peer_set) == 3
+
+    peer_set -= {peers[0]}
+    assert peers[0] not in peer_set
+    assert len(peer_set) == 2
+
+    peer_set.difference_update([peers[1].public_key])
+    assert peers[1] not in peer_set
+    assert list(peer_set) == [peers[2]]
+
+    peer_set = PeerSet(peers[:3])
+    peer_set &= {peers[0], peers[1]}
+    assert sorted(peer.description for peer in peer_set) == ['peer0', 'peer1']
+    assert peers[2] not in peer_set
+
+    peer_set.intersection_update([peers[0].public_key])
+    assert list(peer_set) == [peers[0]]
+
+    peer_set ^= {peers[0], peers[3]}
+    assert peers[0] not in peer_set
+    assert list(peer_set) == [peers[3]]
+
+    peer_set.symmetric_difference_update([peers[1]])
+    assert sorted(peer.description for peer in peer_set) == ['peer1', 'peer3']
+
+    copied = peer_set.copy()
+    assert isinstance(copied, PeerSet)
+    assert peers[1].public_key in copied
+    copied.discard(peers[1])
+    assert peers[1] in peer_set
+
+    with pytest.raises(ValueError):
+        peer_set.update([Peer('dupe', address='10.0.0.9', private_key=peers[3].private_key)])
+
+    empty = PeerSet()
+    with pytest.raises(KeyError):
+        empty.pop()
@@ -0,0 +1,154 @@
+
+
+import pytest
+
+from wireguard import (
+    Peer,
+    RemotePeer,
+    Server,
+)
+from wireguard.registry import (
+    PeerRegistry,
+    RegistryServer,
+)
+
+
+def test_registry_server_peers(tmp_path):
+
+    path = str(tmp_path / 'peers.db')
+    server = RegistryServer(
+        'server1',
+        '192.168.0.1/24',
+        registry=path,
+    )
+
+    peer = server.peer('peer1')
+    remote = server.remote_peer(
+        'remote1',
+        Peer('key', address='10.0.0.1').public_key,
+        allowed_ips='10.0.0.0/8',
+    )
+
+    assert len(server.peers) == 2
+    assert peer in server.peers
+    assert remote.public_key in server.peers
+    assert server.peers.get(peer.public_key) is peer
+    assert server.route_lookup('10.1.2.3') is remote
+    assert sorted(server.peers_addresses_ipv4) == sorted([peer.ipv4, remote.ipv4])
+
+    # The same key or address cannot be stored twice
+    with pytest.raises(ValueError):
+        server.add_peer(RemotePeer('dupe', peer.public_key, '192.168.0.200'))
+    with pytest.raises(ValueError):
+        server.remote_peer(
+            'dupe',
+            Peer('key', address='10.0.0.1').public_key,
+            address=remote.ipv4,
+        )
+    assert len(server.peers) == 2
+
+    # The peers are loaded lazily from the database by another server
+    other = RegistryServer(
+        'server1',
+        '192.168.0.0/24',
+        address=server.ipv4,
+        registry=path,
+    )
+    loaded = other.peers.get(peer.public_key)
+    assert isinstance(loaded, RemotePeer)
+    assert loaded.ipv4 == peer.ipv4
+    assert other.route_lookup('10.1.2.3').public_key == remote.public_key
+
+    # Changes by the other server are seen by this one
+    other.remove_peer(other.peers.get(remote.public_key))
+    assert len(server.peers) == 1
+    assert server.route_lookup('10.1.2.3') is None
+
+    server.peers.remove_by_ip(peer.ipv4)
+    assert not server.peers
+
+
+def test_registry_server_config():
+
+    server = Server('server1', '192.168.0.0/24', address='192.168.0.1')
+    registry_server = RegistryServer(
+        'server1',
+        '192.168.0.0/24',
+        address='192.168.0.1',
+        private_key=server.private_key,
+    )
+
+    for index in range(5):
+        public_key = Peer(f'key{index}', address='10.0.0.1').public_key
+        server.remote_peer(f'peer{index}', public_key, address=f'192.168.0.{index + 10}')
+        registry_server.remote_peer(
+            f'peer{index}', public_key, address=f'192.168.0.{index + 10}'
+        )
+
+    # The registry streams the peers in the order they were added
+    sections = list(registry_server.config.iter_peers())
+    assert [section.split('\n')[2] for section in sections] == [
+        f'# peer{index}' for index in range(5)
+    ]
+    assert sorted(sections) == sorted(server.config.iter_peers())
+    assert registry_server.config.interface == server.config.interface
+
+
+def test_registry_extend_is_transactional():
+
+    registry = PeerRegistry()
+    server = RegistryServer('server1', '192.168.0.1/24', registry=registry)
+    peer = server.remote_peer('peer1', Peer('key', address='10.0.0.1').public_key)
+
+    new_peer = RemotePeer(
+        'peer2',
+        Peer('key', address='10.0.0.1').public_key,
+        '192.168.0.201',
+    )
+    with pytest.raises(ValueError):
+        server.peers.extend([
+            new_peer,
+            RemotePeer('peer3', peer.public_key, '192.168.0.202'),
+        ])
+
+    assert registry.count() == 1
+    assert new_peer not in server.peers
+
+
+def test_registry_nested_transactions_and_rollback():
+
+    registry = PeerRegistry()
+    server = RegistryServer('server1', '192.168.0.1/24', registry=registry)
+    kept = RemotePeer('kept', Peer('key', address='10.0.0.1').public_key, '192.168.0.10')
+
+    # A failed nested transaction only undoes its own changes
+    with registry.transaction():
+        server.peers.add(kept)
+        with pytest.raises(ValueError):
+            server.peers.add(RemotePeer('other', Peer('key', address='10.0.0.1').public_key, '192.168.0.10'))
+    assert registry.count() == 1
+    assert server.peers.get(kept.public_key) is kept
+
+    # Once rolled back, the added peers are forgotten, so they can be added again
+    added = RemotePeer('added', Peer('key', address='10.0.0.1').public_key, '192.168.0.12')
+    with pytest.raises(ValueError):
+        with registry.transaction():
+            server.peers.extend([added])
+            server.peers.discard(kept)
+            raise ValueError('rolled back')
+    assert added not in server.peers
+    assert server.peers.get(kept.public_key) is kept
+    server.peers.extend([added])
+    assert registry.count() == 2
+
+    # Only writes change the revision
+    revision = registry.revision
+    server.peers.get(kept.public_key)
+    list(server.peers)
+    with registry.transaction():
+        registry.count()
+    server.peers.discard('no-such-key')
+    assert registry.revision == revision
+
+    server.peers.discard(added)
+    assert registry.revision != revision
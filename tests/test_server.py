@@ -1,4 +1,7 @@
 
+import json
+import warnings
+
 import pytest
 
 from subnet import (
@@ -687,3 +690,244 @@ def test_server_invalid_subnet(subnet, address, exception_message):
         )
 
     assert exception_message in str(exc.value)
+
+
+def test_server_route_lookup():
+    server = Server('test-server', ['10.8.0.0/16', 'fd00::/64'], address=['10.8.0.1', 'fd00::1'])
+
+    peer1 = server.peer('peer1', address=['10.8.0.2', 'fd00::2'], allowed_ips=['10.9.0.0/16'])
+    peer2 = server.peer('peer2', address='10.8.0.3', allowed_ips=['10.9.3.0/24'])
+
+    assert server.route_lookup('10.8.0.2') is peer1
+    assert server.route_lookup('fd00::2') is peer1
+    assert server.route_lookup('10.9.3.77') is peer2
+    assert server.route_lookup('10.9.4.1') is peer1
+    # The server's own subnets are not routes to a peer
+    assert server.route_lookup('10.8.0.99') is None
+
+    server.remove_peer(peer2)
+    assert server.route_lookup('10.9.3.77') is peer1
+
+    # Allowed IPs changed after the peer was added need the routes to be updated
+    peer1.allowed_ips.add('10.10.0.0/16')
+    server.update_routes(peer1)
+    assert server.route_lookup('10.10.1.1') is peer1
+
+    # Peers added or removed from the peer set directly are picked up on lookup
+    server.peers.discard(peer1)
+    assert server.route_lookup('10.9.4.1') is None
+    server.peers.add(peer2)
+    assert server.route_lookup('10.9.3.77') is peer2
+
+
+def test_server_route_lookup_tracks_peer_changes():
+    server = Server('test-server', '10.8.0.0/16', address='10.8.0.1')
+
+    peer1 = server.peer('peer1', address='10.8.0.2', allowed_ips=['10.9.0.0/16'])
+    peer2 = server.peer('peer2', address='10.8.0.3')
+
+    # A peer without any routes does not leave the index looking out of date
+    peer2.allowed_ips.clear()
+    server.update_routes(peer2)
+    assert server.route_lookup('10.9.0.1') is peer1
+    assert server._routed_revision == server.peers.revision
+
+    # Swapping peers directly, without changing how many there are, is picked up too
+    peer3 = Peer('peer3', address='10.8.0.4', allowed_ips=['10.9.0.0/16'])
+    server.peers.discard(peer1)
+    server.peers.add(peer3)
+    assert server.route_lookup('10.9.0.1') is peer3
+    assert server.route_lookup('10.8.0.2') is None
+
+
+def test_server_audit_allowed_ips():
+    server = Server('test-server', '10.8.0.0/16', address='10.8.0.1')
+
+    peer1 = server.peer('peer1', address='10.8.0.2', allowed_ips=['10.9.0.0/16'])
+    peer2 = server.peer('peer2', address='10.8.0.3', allowed_ips=['10.9.3.0/24'])
+    server.peer('peer3', address='10.8.0.4')
+
+    conflicts = server.audit_allowed_ips()
+    assert len(conflicts) == 1
+    assert conflicts[0].kind == 'overlap'
+    assert conflicts[0].owner is peer2
+    assert conflicts[0].other_owner is peer1
+    assert str(conflicts[0].other_network) == '10.9.0.0/16'
+
+
+def test_server_peer_allowed_ips_exclude():
+    server = Server('test-server', '10.8.0.0/24', address='10.8.0.1')
+
+    peer = server.peer(
+        'test-peer',
+        address='10.8.0.2',
+        allowed_ips='0.0.0.0/0',
+        allowed_ips_exclude=['0.0.0.0/1', '192.168.0.0/16'],
+    )
+
+    networks = sorted(str(net) for net in peer.allowed_ips)
+    assert '10.8.0.2/32' in networks
+    assert '128.0.0.0/2' in networks
+    assert '192.168.0.0/16' not in networks
+    assert not peer.allowed_ips.collapse().exclude('10.8.0.2/32').exclude('128.0.0.0/1')
+    assert len(networks) == 16
+
+    with pytest.raises(ValueError) as exc:
+        server.peer('test-peer', allowed_ips_exclude='192.168.0.0/16')
+    assert 'allowed_ips' in str(exc.value)
+
+
+def test_server_remote_peers():
+    from wireguard import RemotePeer
+
+    server = Server('test-server', '10.8.0.0/24', address='10.8.0.1', preshared_key='psk')
+    full = server.peer('full-peer', address='10.8.0.2')
+
+    remote_key = public_key(generate_key())
+    remote = server.remote_peer(
+        'remote-peer', remote_key, address='10.8.0.3', allowed_ips='10.9.0.0/16',
+        endpoint='vpn.example.com:12345',
+    )
+
+    assert isinstance(remote, RemotePeer)
+    assert remote in server.peers
+    assert server.pubkey_exists(remote_key)
+    assert server.route_lookup('10.9.1.1') is remote
+    assert sorted(str(net) for net in remote.allowed_ips) == ['10.8.0.3/32', '10.9.0.0/16']
+
+    with pytest.raises(AttributeError):
+        remote.endpoint = 'elsewhere'
+
+    # Not unique, and it cannot be changed to be
+    with pytest.raises(ValueError):
+        server.add_peer(RemotePeer('clash', public_key(generate_key()), '10.8.0.2'))
+    with pytest.raises(ValueError):
+        server.add_peer(RemotePeer('clash', remote_key, '10.8.0.99'))
+
+    # Rendered into the server's config like a full peer
+    config = server.config.local_config
+    assert '# remote-peer' in config
+    assert f'PublicKey = {remote_key}' in config
+    assert 'Endpoint = vpn.example.com:12345' in config
+    assert config.count('PresharedKey = psk') == 2
+
+    assert json.loads(server.json())['peers']
+
+    upgraded = server.upgrade_peer(remote)
+    assert isinstance(upgraded, Peer)
+    # Peers are identified by their public key
+    assert remote in server.peers
+    assert server.peers.get(remote_key) is upgraded
+    assert server in upgraded.peers
+    assert upgraded.public_key == remote_key
+    assert upgraded.endpoint == 'vpn.example.com:12345'
+    assert server.route_lookup('10.9.1.1') is upgraded
+
+    record = RemotePeer.from_peer(full)
+    assert record.public_key == full.public_key
+    assert record.address == full.address
+
+    server.remove_peer(upgraded)
+    assert server.route_lookup('10.9.1.1') is None
+
+    with pytest.raises(KeyError):
+        server.upgrade_peer(record)
+
+
+def test_server_freed_without_gc():
+    import gc
+    import weakref
+
+    gc.collect()
+    gc.disable()
+    try:
+        server = Server('test-server', '10.8.0.0/24', address='10.8.0.1')
+        peers = [server.peer(f'peer{idx}') for idx in range(5)]
+
+        # The peers still see the server as one of their peers
+        assert all(server in peer.peers for peer in peers)
+        assert all(len(peer.peers) == 1 for peer in peers)
+        assert '[Peer]' in peers[0].config.local_config
+        assert server.config.local_config.count('[Peer]') == 5
+
+        server_ref = weakref.ref(server)
+        peer_refs = [weakref.ref(peer) for peer in peers]
+        del server, peers
+
+        # Freed by reference counting alone, without the cyclic garbage collector
+        assert server_ref() is None
+        assert all(ref() is None for ref in peer_refs)
+    finally:
+        gc.enable()
+
+
+def test_remote_peer_endpoints_and_config_cls():
+    from wireguard import Config, RemotePeer
+
+    class RemoteConfig(Config):
+        pass
+
+    server = Server('test-server', '10.8.0.0/24', address='10.8.0.1')
+
+    # An endpoint without a port keeps the default port once upgraded
+    remote = server.remote_peer(
+        'no-port', public_key(generate_key()), endpoint='vpn.example.com',
+    )
+    upgraded = server.upgrade_peer(remote)
+    assert upgraded.port == 51820
+    assert upgraded.endpoint == 'vpn.example.com:51820'
+
+    remote = server.remote_peer(
+        'ipv6', public_key(generate_key()), endpoint='[fd00::1]:12345',
+        config_cls=RemoteConfig,
+    )
+    assert isinstance(remote.config, RemoteConfig)
+
+    upgraded = server.upgrade_peer(remote)
+    assert upgraded.port == 12345
+    assert upgraded.endpoint == '[fd00::1]:12345'
+    assert isinstance(upgraded.config, RemoteConfig)
+    assert isinstance(RemotePeer.from_peer(upgraded).config, RemoteConfig)
+
+
+def test_remote_peer_requires_address():
+    from wireguard import RemotePeer
+    from wireguard.registry import row_peer
+
+    key = public_key(generate_key())
+    for address in (None, [], [None]):
+        with pytest.raises(ValueError) as exc:
+            RemotePeer('remote', key, address)
+        assert str(exc.value) == 'A remote peer must have an address'
+
+    # Nor can one be restored from a row without any address
+    with pytest.raises(ValueError) as exc:
+        row_peer((key, 'remote', None, None, None, None, None))
+    assert str(exc.value) == 'A remote peer must have an address'
+
+
+def test_freed_server_warns_on_peer_config():
+    import gc
+
+    server = Server('test-server', '10.8.0.0/24', address='10.8.0.1')
+    peer = server.peer('peer')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert '[Peer]' in peer.config.local_config
+
+    server_key = server.public_key
+    del server
+    gc.collect()
+
+    assert peer.peers.collected() == [server_key]
+    with pytest.warns(RuntimeWarning) as record:
+        config = peer.config.local_config
+    assert '[Peer]' not in config
+    assert server_key in str(record[0].message)
+
+    # Explicitly removing the server means the peer is meant to be without it
+    peer.peers.discard(server_key)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        peer.config.local_config
@@ -0,0 +1,674 @@
+
+import time
+
+import pytest
+
+from wireguard import Interface
+from wireguard import service
+from wireguard.service import InterfacePeer, PeerRow
+
+
+def make_peers(count, interface='wg0'):
+    peers = []
+    for idx in range(count):
+        peers.append(
+            InterfacePeer(
+                interface,
+                f'peer{idx}',
+                allowed_ips=f'10.0.{idx // 250}.{idx % 250 + 1}/32',
+            )
+        )
+    return peers
+
+
+def test_verify_connected_runs_probes_concurrently(monkeypatch):
+
+    def slow_ping(host):
+        time.sleep(0.2)
+        return True
+
+    monkeypatch.setattr(service, 'ping', slow_ping)
+
+    peers = make_peers(20)
+    start = time.monotonic()
+    states = Interface('wg0').verify_connected(peers, concurrency=20)
+    elapsed = time.monotonic() - start
+
+    assert len(states) == 20
+    assert all(states.values())
+    assert elapsed < 2
+
+
+def test_verify_connected_failed_probes(monkeypatch):
+
+    def flaky_ping(host):
+        if host.endswith('.1'):
+            return True
+        raise service.subprocess.CalledProcessError(1, ['ping'])
+
+    monkeypatch.setattr(service, 'ping', flaky_ping)
+
+    peers = make_peers(3)
+    peers.append(InterfacePeer('wg0', 'no-address'))
+
+    states = Interface('wg0').verify_connected(peers, concurrency=2)
+
+    assert states == {
+        'peer0': True,
+        'peer1': False,
+        'peer2': False,
+        'no-address': False,
+    }
+
+
+def test_verify_connected_deadline(monkeypatch):
+
+    def hung_ping(host):
+        time.sleep(0.5)
+        return True
+
+    monkeypatch.setattr(service, 'ping', hung_ping)
+
+    peers = make_peers(10)
+    start = time.monotonic()
+    states = Interface('wg0').verify_connected(peers, concurrency=2, deadline=0.1)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.5
+    assert not any(states.values())
+    assert len(states) == 10
+
+
+def test_verify_connected_invalid_concurrency():
+
+    with pytest.raises(ValueError):
+        Interface('wg0').verify_connected([], concurrency=0)
+
+
+def test_connection_state_from_handshake(monkeypatch):
+
+    def fail_ping(host):
+        raise AssertionError('Should not have pinged')
+
+    monkeypatch.setattr(service, 'ping', fail_ping)
+
+    now = int(time.time())
+    recent = InterfacePeer('wg0', 'recent', allowed_ips='10.0.0.2/32', latest_handshake=now - 30)
+    never = InterfacePeer('wg0', 'never', allowed_ips='10.0.0.3/32', latest_handshake=0)
+
+    assert recent.handshake_age() < 60
+    assert never.handshake_age() is None
+
+    assert recent.connection_state() == (True, 'handshake')
+    assert never.connection_state() == (False, 'handshake')
+
+
+def test_connection_state_from_traffic(monkeypatch):
+
+    def fail_ping(host):
+        raise AssertionError('Should not have pinged')
+
+    monkeypatch.setattr(service, 'ping', fail_ping)
+
+    stale = int(time.time()) - 600
+    previous = InterfacePeer('wg0', 'peer', latest_handshake=stale, rx='100', tx='100')
+    current = InterfacePeer('wg0', 'peer', latest_handshake=stale, rx='200', tx='100')
+
+    assert current.connection_state(previous) == (True, 'traffic')
+
+
+def test_connection_state_falls_back_to_ping(monkeypatch):
+
+    pinged = []
+
+    def fake_ping(host):
+        pinged.append(host)
+        return True
+
+    monkeypatch.setattr(service, 'ping', fake_ping)
+
+    now = int(time.time())
+    peers = {
+        'recent': InterfacePeer('wg0', 'recent', allowed_ips='10.0.0.2/32', latest_handshake=now),
+        'stale': InterfacePeer('wg0', 'stale', allowed_ips='10.0.0.3/32', latest_handshake=now - 600),
+    }
+
+    states = Interface('wg0').connection_states(peers)
+    assert states['recent'] == (True, 'handshake')
+    assert states['stale'] == (True, 'ping')
+    assert pinged == ['10.0.0.3']
+
+    # Peers that were not pinged are not reported as if they had been
+    states = Interface('wg0').connection_states(peers, probe=False)
+    assert states['stale'] == (False, 'unknown')
+    assert len(pinged) == 1
+
+    def hung_ping(host):
+        time.sleep(0.5)
+        return True
+
+    monkeypatch.setattr(service, 'ping', hung_ping)
+    states = Interface('wg0').connection_states(peers, deadline=0.01)
+    assert states['recent'] == (True, 'handshake')
+    assert states['stale'] == (False, 'unknown')
+
+
+SERVER_PUBKEY = 'ICEiIyQlJicoKSorLC0uLzAxMjM0NTY3ODk6Ozw9Pj8='
+
+
+class FakeWg:
+    """
+    Stands in for the `wg` command of an interface with the given dump rows
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.commands = []
+
+    def __call__(self, cmd):
+        self.commands.append(cmd)
+        stdout = ''
+        if cmd[:2] == ['wg', 'show'] and cmd[-1] == 'public-key':
+            stdout = SERVER_PUBKEY + '\n'
+        elif cmd[:2] == ['wg', 'show'] and cmd[-1] == 'dump':
+            lines = [f'privkey\t{SERVER_PUBKEY}\t51820\toff']
+            lines.extend('\t'.join(row) for row in self.rows)
+            stdout = '\n'.join(lines) + '\n'
+        return service.subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr='')
+
+    def stream(self, cmd):
+        yield from self(cmd).stdout.splitlines(keepends=True)
+
+    @property
+    def set_commands(self):
+        return [cmd for cmd in self.commands if cmd[:2] == ['wg', 'set']]
+
+
+def test_apply_server_changes(monkeypatch):
+    from wireguard import Server
+
+    server = Server('server', '10.8.0.0/24', address='10.8.0.1')
+    same = server.peer('same', address='10.8.0.2')
+    moved = server.peer('moved', address='10.8.0.3')
+    added = server.peer('added', address='10.8.0.4')
+
+    fake = FakeWg([
+        (same.public_key, '(none)', '203.0.113.5:51820', '10.8.0.2/32', '0', '0', '0', 'off'),
+        (moved.public_key, '(none)', '(none)', '10.8.0.30/32', '0', '0', '0', 'off'),
+        ('gone', '(none)', '(none)', '10.8.0.5/32', '0', '0', '0', 'off'),
+    ])
+    monkeypatch.setattr(service, '_run', fake)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    iface = Interface('wg0')
+    report = iface.apply(server, dry_run=True)
+    assert report.added == [added.public_key]
+    assert report.removed == ['gone']
+    assert report.updated == {moved.public_key: ['allowed_ips']}
+    assert report.unchanged == [same.public_key]
+    assert report.invocations == 0
+    assert not fake.set_commands
+
+    report = iface.apply(server)
+    assert report.invocations == 1
+    assert len(fake.set_commands) == 1
+
+    cmd = fake.set_commands[0]
+    assert cmd[:3] == ['wg', 'set', 'wg0']
+    assert same.public_key not in cmd
+    assert cmd[cmd.index(moved.public_key) + 1:cmd.index(moved.public_key) + 3] == [
+        'allowed-ips',
+        '10.8.0.3/32',
+    ]
+    assert cmd[cmd.index('gone') + 1] == 'remove'
+    added_args = cmd[cmd.index(added.public_key) + 1:]
+    if 'peer' in added_args:
+        added_args = added_args[:added_args.index('peer')]
+    assert added_args == ['allowed-ips', '10.8.0.4/32']
+
+
+def test_apply_batches_invocations(monkeypatch):
+    from wireguard import Server
+
+    server = Server('server', '10.8.0.0/16', address='10.8.0.1')
+    for idx in range(100):
+        server.peer(f'peer{idx}')
+
+    fake = FakeWg([])
+    monkeypatch.setattr(service, '_run', fake)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+    monkeypatch.setattr(service, 'MAX_COMMAND_LENGTH', 1024)
+
+    report = Interface('wg0').apply(server)
+    assert len(report.added) == 100
+    assert report.invocations == len(fake.set_commands) > 1
+    for cmd in fake.set_commands:
+        assert sum(len(arg) + 1 for arg in cmd) <= 1024
+
+
+def test_stats_collector_rates(scripted_interface):
+    from wireguard.service import StatsCollector
+
+    iface = scripted_interface()
+    collector = StatsCollector(iface, size=4)
+
+    for second in range(10):
+        iface.set_counters(peer1=(second * 100, second * 10), peer2=(second * 1000, 0))
+        collector.poll(timestamp=1000 + second)
+
+    assert sorted(collector.peers()) == ['peer1', 'peer2']
+
+    # The ring buffer only holds the most recent samples
+    samples = collector.samples('peer1')
+    assert len(samples) == 4
+    assert [sample[0] for sample in samples] == [1006, 1007, 1008, 1009]
+    assert samples[-1] == (1009, 900, 90, 1700000000)
+
+    assert collector.throughput('peer1') == (100, 10)
+    assert collector.throughput('peer2', window=1) == (1000, 0)
+    assert collector.percentiles('peer1', (50, 99)) == {
+        'rx': {50: 100, 99: 100},
+        'tx': {50: 10, 99: 10},
+    }
+
+    totals = collector.totals()
+    assert totals['rx'] == 900 + 9000
+    assert totals['rx_rate'] == 1100
+
+    # Peers that are gone from the interface are no longer tracked
+    iface.set_counters(peer1=(0, 0))
+    collector.poll(timestamp=1010)
+    assert collector.peers() == ['peer1']
+
+    # The counter reset is not reported as negative throughput
+    assert collector.throughput('peer1') == (100, 10)
+
+
+def test_stats_collector_thread(scripted_interface):
+    from wireguard.service import StatsCollector
+
+    iface = scripted_interface()
+    iface.set_counters(peer1=(0, 0))
+    collector = StatsCollector(iface, interval=0.01)
+
+    collector.start()
+    time.sleep(0.1)
+    collector.stop()
+
+    polls = iface.polls
+    assert polls > 2
+    assert len(collector.samples('peer1')) == polls
+
+    time.sleep(0.05)
+    assert iface.polls == polls
+
+
+def test_stats_collector_thread_survives_errors(scripted_interface):
+    from wireguard.service import StatsCollector
+
+    iface = scripted_interface(fail=ValueError('malformed dump'))
+    collector = StatsCollector(iface, interval=0.01)
+
+    collector.start()
+    try:
+        time.sleep(0.05)
+        assert isinstance(collector.last_error, ValueError)
+
+        # The polling carries on, and picks up again once the dumps can be read
+        iface.fail = False
+        iface.set_counters(peer1=(0, 0))
+        deadline = time.monotonic() + 5
+        while not collector.peers() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        collector.stop()
+
+    assert collector.peers() == ['peer1']
+    assert collector.last_error is None
+
+
+def test_iter_stats_rows(monkeypatch):
+    from wireguard.service import PeerRow
+
+    def fake_stream(cmd):
+        assert cmd == ['wg', 'show', 'wg0', 'dump']
+        yield f'privkey\t{SERVER_PUBKEY}\t51820\toff\n'
+        yield 'peer1\t(none)\t203.0.113.5:51820\t10.8.0.2/32,fd00::2/128\t1700000000\t10\t20\t25\n'
+        yield 'peer2\tpsk\t(none)\t(none)\t0\t0\t0\toff\n'
+        raise AssertionError('Rows should be yielded before the output is exhausted')
+
+    monkeypatch.setattr(service, '_stream', fake_stream)
+
+    rows = Interface('wg0').iter_stats()
+    row1 = next(rows)
+    row2 = next(rows)
+
+    assert isinstance(row1, PeerRow)
+    assert row1.peer == 'peer1'
+    assert row1.rx == 10
+    assert row1.tx == 20
+    assert row1.preshared_key is None
+    assert row1.endpoint == '203.0.113.5:51820'
+    assert sorted(str(net) for net in row1.allowed_ips) == ['10.8.0.2/32', 'fd00::2/128']
+    assert row1.latest_handshake.timestamp() == 1700000000
+    assert row1.persistent_keepalive == 25
+
+    assert row2.preshared_key == 'psk'
+    assert row2.allowed_ips is None
+    assert row2.latest_handshake is None
+    assert row2.persistent_keepalive is False
+
+    peer = row1.to_interface_peer()
+    assert peer.rx == 10
+    assert peer.endpoint == '203.0.113.5:51820'
+    assert row2.to_interface_peer().handshake_age() is None
+
+
+def test_stream_command():
+    import sys
+
+    lines = list(service._stream([sys.executable, '-c', 'print("a"); print("b")']))
+    assert lines == ['a\n', 'b\n']
+
+    with pytest.raises(service.subprocess.CalledProcessError):
+        list(service._stream([sys.executable, '-c', 'import sys; sys.exit(3)']))
+
+
+def test_interface_peer_lazy_fields():
+
+    peer = InterfacePeer(
+        'wg0',
+        'peer1',
+        allowed_ips='10.8.0.2/32',
+        latest_handshake='1700000000',
+        rx='10',
+        tx='20',
+        persistent_keepalive='25',
+    )
+
+    assert not hasattr(peer, '__dict__')
+    assert peer.rx == 10
+    assert peer.tx == 20
+    assert peer.persistent_keepalive == 25
+    assert peer.handshake_timestamp == 1700000000
+
+    # Nothing is decoded until accessed
+    assert peer._allowed_ips is None
+    assert peer._latest_handshake is None
+
+    assert str(peer.ip_address) == '10.8.0.2'
+    assert [str(net) for net in peer.allowed_ips] == ['10.8.0.2/32']
+    assert peer.allowed_ips is peer.allowed_ips
+    assert peer.latest_handshake.timestamp() == 1700000000
+
+    peer.allowed_ips = '10.8.0.3/32,10.9.0.0/24'
+    assert len(peer.allowed_ips) == 2
+
+
+def test_interface_peer_defaults():
+
+    peer = InterfacePeer('wg0', 'peer1')
+
+    assert not peer.allowed_ips
+    assert peer.ip_address is None
+    assert peer.latest_handshake is None
+    assert peer.persistent_keepalive is False
+    assert peer.is_connected is False
+
+    with pytest.raises(ValueError):
+        peer.load({'bogus': 1})
+
+
+class CountingWg(FakeWg):
+
+    def __init__(self, rows, delay=0):
+        super().__init__(rows)
+        self.delay = delay
+        self.dumps = 0
+
+    def stream(self, cmd):
+        if cmd[-1] == 'dump':
+            self.dumps += 1
+            time.sleep(self.delay)
+        yield from super().stream(cmd)
+
+
+def test_snapshot_cache_ttl(monkeypatch):
+
+    fake = CountingWg([('peer1', '(none)', '(none)', '10.8.0.2/32', '0', '1', '2', 'off')])
+    monkeypatch.setattr(service, '_run', fake)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    uncached = Interface('wg-ttl')
+    uncached.stats()
+    uncached.stats()
+    assert fake.dumps == 2
+
+    first = Interface('wg-ttl', cache_ttl=60)
+    second = Interface('wg-ttl', cache_ttl=60)
+    assert first.stats()['peer1'].rx == 1
+    assert [peer.peer for peer in second.peers()] == ['peer1']
+    assert list(second.iter_stats())[0].tx == 2
+    assert fake.dumps == 3
+
+    # Changes to the interface discard the snapshot
+    first.sync('/tmp/wg-ttl.conf')
+    second.stats()
+    assert fake.dumps == 4
+
+    expiring = Interface('wg-ttl', cache_ttl=0.01)
+    time.sleep(0.02)
+    expiring.stats()
+    assert fake.dumps == 5
+
+
+def test_snapshot_cache_single_flight(monkeypatch):
+    import threading
+
+    fake = CountingWg([('peer1', '(none)', '(none)', '10.8.0.2/32', '0', '1', '2', 'off')], delay=0.1)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    results = []
+
+    def worker():
+        results.append(Interface('wg-flight', cache_ttl=60).stats())
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 10
+    assert fake.dumps == 1
+    Interface('wg-flight').invalidate()
+
+
+def test_all_stats_single_dump(monkeypatch):
+
+    commands = []
+
+    def fake_stream(cmd):
+        commands.append(cmd)
+        yield 'wg0\tprivkey0\tpubkey0\t51820\toff\n'
+        yield 'wg0\tpeer1\t(none)\t(none)\t10.8.0.2/32\t0\t1\t2\toff\n'
+        yield 'wg0\tpeer2\t(none)\t(none)\t10.8.0.3/32\t0\t3\t4\toff\n'
+        yield 'wg1\tprivkey1\tpubkey1\t51821\toff\n'
+        yield 'wg2\tprivkey2\tpubkey2\t51822\toff\n'
+        yield 'wg2\tpeer3\t(none)\t(none)\t10.9.0.2/32\t0\t5\t6\t25\n'
+
+    def fake_run(cmd):
+        commands.append(cmd)
+        return service.subprocess.CompletedProcess(cmd, 0, stdout='wg0 wg1 wg2\n', stderr='')
+
+    monkeypatch.setattr(service, '_stream', fake_stream)
+    monkeypatch.setattr(service, '_run', fake_run)
+
+    stats = Interface.all_stats()
+    assert commands == [['wg', 'show', 'all', 'dump']]
+    assert sorted(stats) == ['wg0', 'wg1', 'wg2']
+    assert sorted(stats['wg0']) == ['peer1', 'peer2']
+    assert stats['wg1'] == {}
+    assert stats['wg2']['peer3'].interface == 'wg2'
+    assert stats['wg2']['peer3'].rx == 5
+    assert stats['wg2']['peer3'].persistent_keepalive == 25
+
+    interfaces = Interface.list(cache_ttl=5)
+    assert [iface.interface for iface in interfaces] == ['wg0', 'wg1', 'wg2']
+    assert all(iface.cache_ttl == 5 for iface in interfaces)
+    assert commands[-1] == ['wg', 'show', 'interfaces']
+
+
+def test_stats_command_rejects_all_over_netlink(monkeypatch):
+    from click.testing import CliRunner
+
+    from wireguard.cli.service import stats
+
+    def fail(cmd):
+        raise AssertionError(f'Unexpected command: {cmd}')
+
+    monkeypatch.setattr(service, '_stream', fail)
+    monkeypatch.setattr(service, '_run', fail)
+
+    result = CliRunner().invoke(stats, ['all', '--netlink'])
+    assert result.exit_code == 2
+    assert '--netlink' in result.output
+
+
+def test_top_talkers():
+    from wireguard.service import top_talkers
+
+    def rows(counters):
+        return [
+            PeerRow.from_fields('wg0', [peer, '(none)', '(none)', '10.8.0.2/32', handshake, rx, tx, 'off'])
+            for peer, (rx, tx, handshake) in counters.items()
+        ]
+
+    previous = {}
+    first = top_talkers(previous, rows({
+        'peer1': (100, 100, '990'),
+        'peer2': (1000, 0, '0'),
+        'peer3': (0, 0, '0'),
+    }), 0, count=2, now=1000)
+
+    # Without a previous snapshot there is nothing to compute rates from
+    assert [talker.rx_rate + talker.tx_rate for talker in first] == [0, 0]
+    assert previous['peer2'] == (1000, 0)
+
+    talkers = top_talkers(previous, rows({
+        'peer1': (300, 300, '995'),
+        'peer2': (1200, 0, '0'),
+        'peer3': (10, 0, '0'),
+    }), 2, count=2, now=1000)
+
+    assert [talker.peer for talker in talkers] == ['peer1', 'peer2']
+    assert talkers[0].rx_rate == 100
+    assert talkers[0].tx_rate == 100
+    assert talkers[0].handshake_age == 5
+    assert talkers[1].rx_rate == 100
+    assert talkers[1].handshake_age is None
+
+    # A reset counter is not reported as a negative rate
+    talkers = top_talkers(previous, rows({'peer1': (0, 0, '995')}), 2, count=2, now=1000)
+    assert talkers[0].rx_rate == 0
+
+    # Peers that are gone are dropped, so a re-added one starts from a fresh baseline
+    assert sorted(previous) == ['peer1']
+    talkers = top_talkers(previous, rows({'peer1': (0, 0, '995'), 'peer2': (5000, 0, '0')}), 2, count=2, now=1000)
+    assert [talker.rx_rate for talker in talkers] == [0, 0]
+
+
+def test_top_command(monkeypatch):
+    from click.testing import CliRunner
+
+    from wireguard.cli.service import top
+
+    commands = []
+
+    def fake_stream(cmd):
+        commands.append(cmd)
+        yield 'privkey\tpubkey\t51820\toff\n'
+        yield 'peer1\t(none)\t1.2.3.4:51820\t10.8.0.2/32\t0\t{0}\t{0}\toff\n'.format(len(commands) * 1000)
+
+    monkeypatch.setattr(service, '_stream', fake_stream)
+
+    result = CliRunner().invoke(top, ['wg0', '--interval', '0', '--refreshes', '2'])
+    assert result.exit_code == 0, result.output
+
+    # One dump per refresh, no other commands
+    assert commands == [['wg', 'show', 'wg0', 'dump']] * 2
+    assert 'peer1' in result.output
+    assert '1.2.3.4:51820' in result.output
+
+
+def test_snapshot_invalidated_during_dump(monkeypatch):
+    import threading
+
+    fake = CountingWg([('peer1', '(none)', '(none)', '10.8.0.2/32', '0', '1', '2', 'off')], delay=0.2)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    first = Interface('wg-race', cache_ttl=60)
+    thread = threading.Thread(target=first.stats)
+    thread.start()
+
+    # The interface changes while the dump is in flight
+    time.sleep(0.05)
+    Interface('wg-race').invalidate()
+    thread.join()
+    assert fake.dumps == 1
+
+    # So the rows from before the change are not served from the cache
+    Interface('wg-race', cache_ttl=60).stats()
+    assert fake.dumps == 2
+    Interface('wg-race', cache_ttl=60).stats()
+    assert fake.dumps == 2
+    Interface('wg-race').invalidate()
+
+
+def test_apply_resolves_host_name_endpoints(monkeypatch):
+    from wireguard import Server
+
+    server = Server('server', '10.8.0.0/24', address='10.8.0.1')
+    named = server.peer('named', address='10.8.0.2', endpoint='vpn.example.com:51820')
+    moved = server.peer('moved', address='10.8.0.3', endpoint='other.example.com:51820')
+
+    fake = FakeWg([
+        (named.public_key, '(none)', '203.0.113.5:51820', '10.8.0.2/32', '0', '0', '0', 'off'),
+        (moved.public_key, '(none)', '203.0.113.5:51820', '10.8.0.3/32', '0', '0', '0', 'off'),
+    ])
+    monkeypatch.setattr(service, '_run', fake)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    lookups = []
+
+    def getaddrinfo(host, port, **kwargs):
+        lookups.append(host)
+        address = '203.0.113.5' if host == 'vpn.example.com' else '198.51.100.7'
+        return [(service.socket.AF_INET, service.socket.SOCK_DGRAM, 17, '', (address, int(port)))]
+
+    monkeypatch.setattr(service.socket, 'getaddrinfo', getaddrinfo)
+
+    # The interface reports the address that the host name resolved to
+    report = Interface('wg0').apply(server, dry_run=True)
+    assert report.unchanged == [named.public_key]
+    assert report.updated == {moved.public_key: ['endpoint']}
+    assert sorted(lookups) == ['other.example.com', 'vpn.example.com']
+
+
+def test_apply_rejects_mismatched_preshared_keys(monkeypatch):
+    from wireguard import Server
+
+    server = Server('server', '10.8.0.0/24', address='10.8.0.1', preshared_key='server-psk')
+    server.peer('peer', address='10.8.0.2', preshared_key='peer-psk')
+
+    fake = FakeWg([])
+    monkeypatch.setattr(service, '_run', fake)
+    monkeypatch.setattr(service, '_stream', fake.stream)
+
+    with pytest.raises(ValueError) as exc:
+        Interface('wg0').apply(server, dry_run=True)
+    assert 'Preshared keys do not match' in str(exc.value)
+
+    # Just as rendering the config does
+    with pytest.raises(ValueError):
+        server.config.local_config
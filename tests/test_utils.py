@@ -1,6 +1,8 @@
 
 import pytest
 
+from subnet import ip_network
+
 from wireguard.utils import (
     ClassedSet,
     IPAddressSet,
@@ -80,3 +82,281 @@ def test_ipnetwork_set_not_ip_network():
     my_set.add('192.168.0.0/24')
 
     assert len(my_set) == 1
+
+
+def test_prefix_trie():
+    from wireguard.utils import PrefixTrie
+
+    trie = PrefixTrie()
+    trie.insert('10.0.0.0/8', 'wide')
+    trie.insert('10.8.0.0/16', 'narrow')
+    trie.insert('10.8.3.77/32', 'host')
+    trie.insert('fd00::/64', 'v6')
+    trie.insert('0.0.0.0/0', 'default')
+    assert len(trie) == 5
+
+    assert trie.lookup('10.8.3.77') == 'host'
+    assert trie.lookup('10.8.3.78') == 'narrow'
+    assert trie.lookup('10.9.0.1') == 'wide'
+    assert trie.lookup('192.168.0.1') == 'default'
+    assert trie.lookup('fd00::1') == 'v6'
+    assert trie.lookup('fd01::1') is None
+    assert [prefixlen for prefixlen, _ in trie.matches('10.8.3.77')] == [32, 16, 8, 0]
+
+    # The most recently inserted value for the same network wins
+    trie.insert('10.8.0.0/16', 'newer')
+    assert trie.lookup('10.8.3.78') == 'newer'
+
+    assert trie.remove('10.8.3.77/32', 'host')
+    assert not trie.remove('10.8.3.77/32', 'host')
+    assert not trie.remove('10.7.0.0/16', 'narrow')
+    assert trie.lookup('10.8.3.77') == 'newer'
+
+    trie.remove('10.8.0.0/16', 'newer')
+    trie.remove('10.8.0.0/16', 'narrow')
+    assert trie.lookup('10.8.3.77') == 'wide'
+    assert len(trie) == 3
+
+
+def test_audit_networks():
+    from wireguard.utils import audit_networks
+
+    conflicts = audit_networks([
+        ('10.0.0.0/8', 'a'),
+        ('10.8.0.0/16', 'b'),
+        ('10.8.0.0/16', 'c'),
+        ('10.9.0.0/16', 'a'),
+        ('192.168.0.0/24', 'd'),
+        ('192.168.0.0/25', 'e'),
+        ('192.168.0.128/25', 'e'),
+        ('fd00::/64', 'a'),
+        ('fd00::1/128', 'b'),
+    ])
+
+    found = sorted((c.kind, str(c.network), c.owner, str(c.other_network), c.other_owner) for c in conflicts)
+    assert found == [
+        ('duplicate', '10.8.0.0/16', 'c', '10.8.0.0/16', 'b'),
+        ('overlap', '10.8.0.0/16', 'b', '10.0.0.0/8', 'a'),
+        ('overlap', '10.8.0.0/16', 'c', '10.0.0.0/8', 'a'),
+        ('overlap', '192.168.0.0/25', 'e', '192.168.0.0/24', 'd'),
+        ('overlap', '192.168.0.128/25', 'e', '192.168.0.0/24', 'd'),
+        ('overlap', 'fd00::1/128', 'b', 'fd00::/64', 'a'),
+        ('shadowed', '192.168.0.0/24', 'd', 'None', None),
+    ]
+
+    assert audit_networks([]) == []
+    assert audit_networks([('10.0.0.0/24', 'a'), ('10.0.1.0/24', 'b')]) == []
+
+
+def test_audit_networks_duplicate_owners():
+    from wireguard.utils import audit_networks
+
+    conflicts = audit_networks([
+        ('10.0.0.0/24', 'a'),
+        ('10.0.0.0/24', 'b'),
+        ('10.0.0.0/25', 'c'),
+    ])
+
+    found = sorted((c.kind, str(c.network), c.owner, str(c.other_network), c.other_owner) for c in conflicts)
+    assert found == [
+        ('duplicate', '10.0.0.0/24', 'b', '10.0.0.0/24', 'a'),
+        ('overlap', '10.0.0.0/25', 'c', '10.0.0.0/24', 'a'),
+        ('overlap', '10.0.0.0/25', 'c', '10.0.0.0/24', 'b'),
+    ]
+
+    # A network only covered by more specific networks of its own owner is harmless
+    assert audit_networks([
+        ('10.0.0.0/24', 'a'),
+        ('10.0.0.0/25', 'a'),
+        ('10.0.0.128/25', 'a'),
+        ('10.0.0.0/24', 'a'),
+    ]) == []
+
+
+def test_ip_network_set_collapse():
+    from wireguard.utils.sets import NonStrictIPNetworkSet
+
+    networks = IPNetworkSet()
+    networks.extend([f'10.8.{idx}.0/24' for idx in range(256)])
+    networks.extend(['10.8.3.0/25', '10.9.0.0/24', '10.9.1.0/24', '10.9.3.0/24'])
+    networks.extend(['fd00::/65', 'fd00:0:0:0:8000::/65', '192.168.1.7/32'])
+
+    collapsed = networks.collapse()
+    assert isinstance(collapsed, IPNetworkSet)
+    assert sorted(str(net) for net in collapsed) == [
+        '10.8.0.0/16',
+        '10.9.0.0/23',
+        '10.9.3.0/24',
+        '192.168.1.7/32',
+        'fd00::/64',
+    ]
+    # The original set is left as it was
+    assert len(networks) == 263
+
+    # Collapsing a range that is not aligned yields the fewest covering networks
+    unaligned = IPNetworkSet()
+    unaligned.extend(['10.0.1.0/24', '10.0.2.0/23', '10.0.4.0/24'])
+    assert sorted(str(net) for net in unaligned.collapse()) == ['10.0.1.0/24', '10.0.2.0/23', '10.0.4.0/24']
+
+    assert not IPNetworkSet().collapse()
+    assert isinstance(NonStrictIPNetworkSet().collapse(), NonStrictIPNetworkSet)
+
+
+def test_ip_network_set_exclude():
+    networks = IPNetworkSet()
+    networks.extend(['0.0.0.0/0', '::/0'])
+
+    remaining = networks.exclude(['192.168.0.0/16', '10.0.0.0/8', 'fd00::/8'])
+    assert sorted(str(net) for net in remaining if net.version == 4) == sorted([
+        '0.0.0.0/5', '8.0.0.0/7', '11.0.0.0/8', '12.0.0.0/6', '16.0.0.0/4', '32.0.0.0/3',
+        '64.0.0.0/2', '128.0.0.0/2', '192.0.0.0/9', '192.128.0.0/11', '192.160.0.0/13',
+        '192.169.0.0/16', '192.170.0.0/15', '192.172.0.0/14', '192.176.0.0/12',
+        '192.192.0.0/10', '193.0.0.0/8', '194.0.0.0/7', '196.0.0.0/6', '200.0.0.0/5',
+        '208.0.0.0/4', '224.0.0.0/3',
+    ])
+    assert len([net for net in remaining if net.version == 6]) == 8
+    assert not any(net.overlaps(excluded) for net in remaining for excluded in [
+        ip_network('192.168.0.0/16'), ip_network('10.0.0.0/8'), ip_network('fd00::/8'),
+    ] if net.version == excluded.version)
+
+    # Adding the exclusions back in covers everything again
+    remaining.extend(['192.168.0.0/16', '10.0.0.0/8', 'fd00::/8'])
+    assert sorted(str(net) for net in remaining.collapse()) == ['0.0.0.0/0', '::/0']
+
+    single = IPNetworkSet()
+    single.add('10.8.0.0/24')
+    assert [str(net) for net in single.exclude('10.8.0.0/25')] == ['10.8.0.128/25']
+    assert [str(net) for net in single.exclude('172.16.0.0/12')] == ['10.8.0.0/24']
+    assert not single.exclude('10.0.0.0/8')
+
+    with pytest.raises(ValueError):
+        single.exclude('not-a-network')
+
+
+def test_classed_set_extend_reports_every_invalid_value():
+    my_set = IPNetworkSet()
+
+    with pytest.raises(ValueError) as exc:
+        my_set.extend(['10.0.0.0/8', 'bogus', '', ['10.1.0.0/16'], '10.0.0.1/8', True])
+
+    message = str(exc.value)
+    assert message.startswith('Could not add 5 value(s) to IPNetworkSet')
+    assert 'bogus' in message
+    assert '10.0.0.1/8' in message
+    # Nothing is added when any of the values are invalid
+    assert not my_set
+
+    with pytest.raises(ValueError) as exc:
+        my_set.extend([f'bogus{idx}' for idx in range(25)])
+    assert str(exc.value).endswith('; and 15 more')
+
+    my_set.extend(['10.0.0.0/8', '10.0.0.0/8', ip_network('10.1.0.0/16')])
+    assert sorted(str(net) for net in my_set) == ['10.0.0.0/8', '10.1.0.0/16']
+
+
+def test_classed_set_extend_calls_add_overrides():
+    from wireguard.utils import CompactIPNetworkSet
+
+    class CountingSet(IPNetworkSet):
+        added = 0
+
+        def add(self, value):
+            self.added += 1
+            super().add(value)
+
+    class CountingCompactSet(CompactIPNetworkSet):
+        added = 0
+
+        def add(self, value):
+            self.added += 1
+            super().add(value)
+
+    for my_set in (CountingSet(), CountingCompactSet()):
+        my_set.extend(['10.0.0.0/8', '10.1.0.0/16', 'fd00::/64'])
+        assert my_set.added == 3
+        assert len(my_set) == 3
+
+        # The values are still all checked before any are added
+        with pytest.raises(ValueError):
+            my_set.extend(['10.2.0.0/16', 'bogus'])
+        assert my_set.added == 3
+
+
+def test_compact_ip_sets():
+    from wireguard.utils import CompactIPAddressSet, CompactIPNetworkSet
+
+    networks = CompactIPNetworkSet(['10.8.0.0/24', 'fd00::/64', '10.0.0.0/8'])
+    networks.add('10.8.0.0/24')
+    networks.add(ip_network('192.168.0.0/16'))
+    networks.extend(['fd00::/64', '172.16.0.0/12'])
+
+    assert len(networks) == 5
+    # Iteration is sorted, IPv4 first
+    assert str(networks) == '10.0.0.0/8,10.8.0.0/24,172.16.0.0/12,192.168.0.0/16,fd00::/64'
+    assert [net.prefixlen for net in networks] == [8, 24, 12, 16, 64]
+    assert '10.8.0.0/24' in networks
+    assert ip_network('fd00::/64') in networks
+    assert '10.8.0.0/25' not in networks
+    assert 'bogus' not in networks
+
+    expected = IPNetworkSet()
+    expected.extend(['10.0.0.0/8', '10.8.0.0/24', '172.16.0.0/12', '192.168.0.0/16', 'fd00::/64'])
+    assert networks == expected
+
+    networks.discard('10.8.0.0/24')
+    networks.discard('10.8.0.0/24')
+    networks.remove('fd00::/64')
+    with pytest.raises(KeyError):
+        networks.remove('fd00::/64')
+    assert len(networks) == 3
+
+    # Values are validated as they are by IPNetworkSet
+    with pytest.raises(ValueError):
+        networks.add('10.0.0.1/8')
+    with pytest.raises(ValueError) as exc:
+        networks.extend(['10.9.0.0/16', 'bogus'])
+    assert 'CompactIPNetworkSet' in str(exc.value)
+    assert len(networks) == 3
+
+    addresses = CompactIPAddressSet()
+    addresses.extend(['10.8.0.2', 'fd00::2', '1.1.1.1', '10.8.0.2'])
+    assert str(addresses) == '1.1.1.1/32,10.8.0.2/32,fd00::2/128'
+    assert '1.1.1.1' in addresses
+    with pytest.raises(ValueError):
+        addresses.add(True)
+
+
+def test_parse_cache():
+    from wireguard.utils import clear_parse_cache, find_ip_and_subnet, parse_cache_info
+
+    clear_parse_cache()
+
+    first = IPNetworkSet()
+    first.extend(['0.0.0.0/0', '10.8.0.0/24'])
+    second = IPNetworkSet()
+    second.extend(['0.0.0.0/0', '10.8.0.0/24'])
+
+    info = parse_cache_info()['network']
+    assert info.misses == 2
+    assert info.hits == 2
+    # The same immutable objects are shared
+    assert {id(net) for net in first} == {id(net) for net in second}
+
+    dns = IPAddressSet()
+    dns.add('1.1.1.1')
+    dns.add('1.1.1.1')
+    assert parse_cache_info()['address'].hits == 1
+
+    ip, net = find_ip_and_subnet('10.8.0.5/24')
+    assert (str(ip), str(net)) == ('10.8.0.5', '10.8.0.0/24')
+    assert find_ip_and_subnet('10.8.0.5/24') == (ip, net)
+    assert find_ip_and_subnet('10.8.0.0/24') == (None, net)
+    assert parse_cache_info()['ip_and_subnet'].hits == 1
+
+    # Invalid values are not cached, and keep raising
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            find_ip_and_subnet('10.8.0.0/33')
+
+    clear_parse_cache()
+    assert parse_cache_info()['network'].currsize == 0
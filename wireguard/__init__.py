@@ -9,6 +9,7 @@ from .constants import (
 )
 from .peer import (
     Peer,
+    RemotePeer,
 )
 from .server import (
     Server,
@@ -24,6 +25,7 @@ __all__ = [
     "Interface",
     "Peer",
     "PORT",
+    "RemotePeer",
     "Server",
     "ServerConfig",
 ]
@@ -4,7 +4,9 @@ wireguard.cli.service
 Interaction with the system's wireguard service
 """
 
-# pylint: disable=too-many-arguments,unnecessary-pass
+# pylint: disable=too-many-arguments,too-many-positional-arguments,unnecessary-pass
+
+import time
 
 import click
 
@@ -15,7 +17,9 @@ try:
 except ImportError:
     HAS_HURRY_FILESIZE = False
 
-from wireguard.service import Interface, InterfacePeer
+from wireguard.exporter import MetricsExporter
+from wireguard.netlink import NetlinkInterface
+from wireguard.service import Interface, InterfacePeer, top_talkers
 
 
 def size(filesize, convert_from_bytes=False):
@@ -28,14 +32,21 @@ def size(filesize, convert_from_bytes=False):
     return str(filesize) + "B"
 
 
-def is_connected_repr(iface_peer, human_readable):
+def is_connected_repr(iface_peer, human_readable, state=None, method=None):
     """Returns a string representation of the peer object including connection state"""
 
     iface = iface_peer.interface
     name = iface_peer.peer
     tx = size(iface_peer.tx, human_readable)  # pylint: disable=invalid-name
     rx = size(iface_peer.rx, human_readable)  # pylint: disable=invalid-name
-    state = iface_peer.is_connected
+    if state is None:
+        state = iface_peer.is_connected
+
+    if method:
+        return (
+            f"<InterfacePeer interface={iface} peer={name} tx={tx} rx={rx} "
+            f"connected={state} method={method}>"
+        )
 
     return f"<InterfacePeer interface={iface} peer={name} tx={tx} rx={rx} connected={state}>"
 
@@ -56,6 +67,38 @@ def cli():
     default=False,
     help="Ping the peer to verify connectivity",
 )
+@click.option(
+    "-s",
+    "--connection-state",
+    is_flag=True,
+    default=False,
+    help="Determine connectivity from the latest handshake, only pinging when unsure",
+)
+@click.option(
+    "--no-probe",
+    is_flag=True,
+    default=False,
+    help="Never ping when determining the connection state",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=int,
+    help="The maximum number of peers to verify connectivity for at once",
+)
+@click.option(
+    "-d",
+    "--deadline",
+    type=float,
+    help="The maximum number of seconds to spend verifying connectivity",
+)
+@click.option(
+    "-n",
+    "--netlink",
+    is_flag=True,
+    default=False,
+    help="Query the interface over netlink instead of running the wg command",
+)
 @click.option(
     "-h",
     "--human-readable",
@@ -63,22 +106,198 @@ def cli():
     default=False,
     help="Render rx/tx bytes in KB/MB/etc, as appropriate",
 )
-def stats(interface, peer=None, verify_connected=False, human_readable=False):
+def stats(
+    interface,
+    peer=None,
+    verify_connected=False,
+    connection_state=False,
+    no_probe=False,
+    concurrency=None,
+    deadline=None,
+    netlink=False,
+    human_readable=False,
+):
     """
-    Display the stats for the given interface
+    Display the stats for the given interface, or "all" interfaces
     """
 
-    iface = Interface(interface)
-    if peer:
-        iface_peer = iface.stats().get(peer, InterfacePeer(interface, peer))
-        if verify_connected:
-            click.echo(is_connected_repr(iface_peer, human_readable))
-        else:
-            click.echo(iface_peer)
+    if interface == "all" and netlink:
+        raise click.UsageError(
+            'The stats of "all" interfaces cannot be queried with --netlink'
+        )
+
+    iface = NetlinkInterface(interface) if netlink else Interface(interface)
+    if interface == "all":
+        # A single `wg show all dump` for every interface on this host
+        peers = [
+            obj for stats in Interface.all_stats().values() for obj in stats.values()
+        ]
+        if peer:
+            peers = [obj for obj in peers if obj.peer == peer]
+    elif peer:
+        peers = [iface.stats().get(peer, InterfacePeer(interface, peer))]
+    else:
+        peers = list(iface.stats().values())
+
+    if connection_state:
+        states = iface.connection_states(
+            peers, probe=not no_probe, concurrency=concurrency, deadline=deadline
+        )
+        for obj in peers:
+            state = states[obj.peer]
+            click.echo(
+                is_connected_repr(obj, human_readable, state.connected, state.method)
+            )
+
+    elif verify_connected:
+        states = iface.verify_connected(
+            peers, concurrency=concurrency, deadline=deadline
+        )
+        for obj in peers:
+            click.echo(is_connected_repr(obj, human_readable, states[obj.peer]))
 
     else:
-        for key, obj in iface.stats().items():  # pylint: disable=unused-variable
-            if verify_connected:
-                click.echo(is_connected_repr(obj, human_readable))
-            else:
-                click.echo(obj)
+        for obj in peers:
+            click.echo(obj)
+
+
+def handshake_age_repr(age):
+    """Returns a short string representation of a handshake age, in seconds"""
+
+    if age is None:
+        return "never"
+    if age < 60:
+        return f"{int(age)}s"
+    if age < 3600:
+        return f"{int(age // 60)}m"
+    return f"{int(age // 3600)}h"
+
+
+def talker_repr(talker, human_readable):
+    """Returns a single line of `service top` output for the given Talker"""
+
+    rx_rate = size(int(talker.rx_rate), human_readable) + "/s"
+    tx_rate = size(int(talker.tx_rate), human_readable) + "/s"
+    return (
+        f"{talker.peer:<44} {rx_rate:>10} {tx_rate:>10} "
+        f"{handshake_age_repr(talker.handshake_age):>9}  {talker.endpoint or ''}"
+    )
+
+
+@cli.command()
+@click.argument("interface")
+@click.option(
+    "-i",
+    "--interval",
+    type=float,
+    default=2,
+    show_default=True,
+    help="How often to refresh, in seconds",
+)
+@click.option(
+    "-c",
+    "--count",
+    type=int,
+    default=10,
+    show_default=True,
+    help="How many of the busiest peers to show",
+)
+@click.option(
+    "-r",
+    "--refreshes",
+    type=int,
+    help="Exit after this many refreshes, rather than running until interrupted",
+)
+@click.option(
+    "-n",
+    "--netlink",
+    is_flag=True,
+    default=False,
+    help="Query the interface over netlink instead of running the wg command",
+)
+@click.option(
+    "-h",
+    "--human-readable",
+    is_flag=True,
+    default=False,
+    help="Render rx/tx rates in KB/MB/etc, as appropriate",
+)
+def top(
+    interface,
+    interval=2,
+    count=10,
+    refreshes=None,
+    netlink=False,
+    human_readable=False,
+):
+    """
+    Continuously display the busiest peers of the given interface
+    """
+
+    iface = NetlinkInterface(interface) if netlink else Interface(interface)
+    previous = {}
+    last = None
+    done = 0
+
+    try:
+        while refreshes is None or done < refreshes:
+            # A single `wg show <interface> dump` per refresh
+            rows = list(iface.iter_stats())
+            now = time.monotonic()
+            talkers = top_talkers(
+                previous, rows, now - last if last is not None else 0, count
+            )
+            last = now
+            done += 1
+
+            if refreshes is None:
+                click.clear()
+            click.echo(f"{interface}: {len(rows)} peers, refreshing every {interval}s")
+            click.echo(
+                f"{'PEER':<44} {'RX/s':>10} {'TX/s':>10} {'HANDSHAKE':>9}  ENDPOINT"
+            )
+            for talker in talkers:
+                click.echo(talker_repr(talker, human_readable))
+
+            if refreshes is None or done < refreshes:
+                time.sleep(interval)
+
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.argument("interfaces", nargs=-1, required=True)
+@click.option("-H", "--host", help="The address to serve the metrics on")
+@click.option("-p", "--port", type=int, help="The port to serve the metrics on")
+@click.option(
+    "-i",
+    "--interval",
+    type=float,
+    help="How often to poll the interfaces' statistics, in seconds",
+)
+@click.option(
+    "-n",
+    "--netlink",
+    is_flag=True,
+    default=False,
+    help="Query the interfaces over netlink instead of running the wg command",
+)
+def exporter(interfaces, host=None, port=None, interval=None, netlink=False):
+    """
+    Serve Prometheus metrics for the given interfaces on /metrics
+    """
+
+    iface_cls = NetlinkInterface if netlink else Interface
+    obj = MetricsExporter(
+        [iface_cls(interface) for interface in interfaces],
+        interval=interval,
+        host=host,
+        port=port,
+    )
+
+    click.echo(f"Serving metrics on http://{obj.host}:{obj.port}/metrics")
+    try:
+        obj.serve_forever()
+    except KeyboardInterrupt:
+        pass
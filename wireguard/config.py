@@ -8,6 +8,7 @@ except ImportError:
     HAS_QRCODE = False
 
 from .utils import (
+    IPNetworkSet,
     value_list_to_comma,
     value_list_to_multiple,
 )
@@ -15,7 +16,6 @@ from .constants import (
     CONFIG_PATH,
 )
 
-
 INTERFACE_KEYS = (
     "address",
     "dns",
@@ -31,6 +31,10 @@ INTERFACE_KEYS = (
     "comments",  # We want this to be the last line/chunk in the output
 )
 
+# Marks the collections of a peer that have not been needed yet, as opposed to being set
+# to None
+_UNALLOCATED = object()
+
 PEER_KEYS = (
     "description",  # We want this to be the first key in the output
     "allowed_ips",
@@ -49,6 +53,10 @@ class Config:  # pylint: disable=too-many-public-methods
 
     _peer = None
 
+    # Render AllowedIPs with overlapping and adjacent networks merged. This is opt-in, by
+    # setting it on a subclass (used through `config_cls`) or on an instance.
+    collapse_allowed_ips = False
+
     def __init__(self, peer):
         # These 2 attributes are the bare minimum allowed to create a remote peer
         if not (hasattr(peer, "allowed_ips") and hasattr(peer, "public_key")):
@@ -56,6 +64,21 @@ class Config:  # pylint: disable=too-many-public-methods
 
         self._peer = peer
 
+    def _collection(self, name):
+        """
+        Returns one of the peer's DNS or hook collections, without allocating it
+
+        A collection that was never used is returned as an empty tuple.
+        """
+
+        try:
+            value = getattr(self._peer, f"_{name}")
+        except AttributeError:
+            # A peer-like object without the lazy slots
+            return getattr(self._peer, name)
+
+        return () if value is _UNALLOCATED else value
+
     @property
     def allowed_ips(self):
         """
@@ -65,7 +88,13 @@ class Config:  # pylint: disable=too-many-public-methods
         if not self._peer.allowed_ips:
             return None
 
-        return value_list_to_comma("AllowedIPs", self._peer.allowed_ips)
+        allowed_ips = self._peer.allowed_ips
+        if self.collapse_allowed_ips:
+            if not isinstance(allowed_ips, IPNetworkSet):
+                allowed_ips = IPNetworkSet(allowed_ips)
+            allowed_ips = allowed_ips.collapse()
+
+        return value_list_to_comma("AllowedIPs", allowed_ips)
 
     @property
     def dns(self):
@@ -73,10 +102,11 @@ class Config:  # pylint: disable=too-many-public-methods
         Returns the DNS settings of the given peer for the config file
         """
 
-        if not self._peer.dns:
+        dns = self._collection("dns")
+        if not dns:
             return None
 
-        return value_list_to_comma("DNS", self._peer.dns)
+        return value_list_to_comma("DNS", dns)
 
     @property
     def pre_up(self):
@@ -84,10 +114,11 @@ class Config:  # pylint: disable=too-many-public-methods
         Returns the PreUp settings of the given peer for the config file
         """
 
-        if self._peer.pre_up is None:
+        pre_up = self._collection("pre_up")
+        if pre_up is None:
             return None
 
-        return value_list_to_multiple("PreUp", self._peer.pre_up)
+        return value_list_to_multiple("PreUp", pre_up)
 
     @property
     def pre_down(self):
@@ -95,10 +126,11 @@ class Config:  # pylint: disable=too-many-public-methods
         Returns the PreDown settings of the given peer for the config file
         """
 
-        if self._peer.pre_down is None:
+        pre_down = self._collection("pre_down")
+        if pre_down is None:
             return None
 
-        return value_list_to_multiple("PreDown", self._peer.pre_down)
+        return value_list_to_multiple("PreDown", pre_down)
 
     @property
     def post_up(self):
@@ -106,10 +138,11 @@ class Config:  # pylint: disable=too-many-public-methods
         Returns the PostUp settings of the given peer for the config file
         """
 
-        if self._peer.post_up is None:
+        post_up = self._collection("post_up")
+        if post_up is None:
             return None
 
-        return value_list_to_multiple("PostUp", self._peer.post_up)
+        return value_list_to_multiple("PostUp", post_up)
 
     @property
     def post_down(self):
@@ -117,10 +150,11 @@ class Config:  # pylint: disable=too-many-public-methods
         Returns the PostDown settings of the given peer for the config file
         """
 
-        if self._peer.post_down is None:
+        post_down = self._collection("post_down")
+        if post_down is None:
             return None
 
-        return value_list_to_multiple("PostDown", self._peer.post_down)
+        return value_list_to_multiple("PostDown", post_down)
 
     @property
     def preshared_key(self):
@@ -258,20 +292,19 @@ class Config:  # pylint: disable=too-many-public-methods
 
         return os.linesep.join(data)
 
-    @property
-    def peers(self):
+    def iter_peers(self):
         """
-        Returns the Peer sections for all connectable peers
+        Yields the Peer section of each connectable peer, one at a time
+
+        Peers are rendered as they are iterated, so a server backed by storage never has
+        to hold the whole section list in memory.
         """
 
         # Guard against potentially having been instantiated with an invalid peer object
         if not isinstance(getattr(self._peer, "peers", None), (list, set)):
-            return ""
+            return
 
-        peers_data = ""
         for peer in self._peer.peers:
-            peers_data += peer.config.remote_config
-
             extras = []
 
             # Need to take special measures when the preshared keys aren't identical
@@ -298,12 +331,15 @@ class Config:  # pylint: disable=too-many-public-methods
             if self.keepalive:
                 extras.append(self.keepalive)
 
-            if extras:
-                peers_data = os.linesep.join((peers_data, *extras, ""))
-            else:
-                peers_data = os.linesep.join((peers_data, ""))
+            yield os.linesep.join((peer.config.remote_config, *extras, ""))
+
+    @property
+    def peers(self):
+        """
+        Returns the Peer sections for all connectable peers
+        """
 
-        return peers_data
+        return "".join(self.iter_peers())
 
     @property
     def remote_config(self):
@@ -430,4 +466,6 @@ class ServerConfig(Config):
             conf_fh.write(f"PostUp = wg addconf %i {peers_file}" + os.linesep)
 
         with open(peers_file, mode="w", encoding="utf-8") as peers_fh:
-            peers_fh.write(self.peers + os.linesep)
+            for section in self.iter_peers():
+                peers_fh.write(section)
+            peers_fh.write(os.linesep)
@@ -7,3 +7,36 @@ KEEPALIVE_MINIMUM = 5
 
 MAX_ADDRESS_RETRIES = 100
 MAX_PRIVKEY_RETRIES = 10  # If we can't get an used privkey in 10 tries, we're screwed
+
+# Connectivity verification of interface peers
+PING_TIMEOUT = 1  # seconds, per probe
+VERIFY_CONCURRENCY = 32
+
+# A handshake more recent than this (in seconds) means the peer is alive. WireGuard
+# re-handshakes every 2 minutes on an active session, so allow for some slack.
+HANDSHAKE_TIMEOUT = 180
+
+# Longest command line to build when batching changes into `wg set` invocations
+MAX_COMMAND_LENGTH = 65536
+
+# Polling of interface statistics by the StatsCollector
+STATS_INTERVAL = 5  # seconds
+STATS_HISTORY = 60  # samples kept per peer
+
+# Prometheus metrics exporter. 9586 is the port commonly used for WireGuard exporters
+EXPORTER_HOST = "127.0.0.1"
+EXPORTER_PORT = 9586
+
+# Parsed addresses/networks kept by each of the parse caches in `wireguard.utils.subnets`
+PARSE_CACHE_SIZE = 4096
+
+# SQLite peer registry: rows fetched per round trip while streaming peers, and seconds
+# to wait on another writer's lock before giving up
+REGISTRY_BATCH_SIZE = 1000
+REGISTRY_TIMEOUT = 30
+
+# Server state journal: records appended before an fsync, the longest time (in seconds)
+# an appended record may wait for one, and records per journal file before compaction
+JOURNAL_SYNC_RECORDS = 100
+JOURNAL_SYNC_INTERVAL = 1
+JOURNAL_COMPACT_RECORDS = 10000
@@ -0,0 +1,329 @@
+"""
+wireguard.events
+
+Peer state-change events, derived from successive dumps of a WireGuard interface
+"""
+
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+from .constants import (
+    HANDSHAKE_TIMEOUT,
+    STATS_INTERVAL,
+)
+from .service import Interface
+
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+HANDSHAKE = "handshake"
+ENDPOINT_CHANGED = "endpoint_changed"
+ALLOWED_IPS_CHANGED = "allowed_ips_changed"
+
+EVENT_TYPES = (
+    CONNECTED,
+    DISCONNECTED,
+    HANDSHAKE,
+    ENDPOINT_CHANGED,
+    ALLOWED_IPS_CHANGED,
+)
+
+# A single change to a peer. `previous` and `current` hold the values that changed:
+# handshake timestamps, endpoints or lists of allowed IPs, depending on the event type.
+# For connected/disconnected events they are the peer's handshake timestamps.
+PeerEvent = namedtuple(
+    "PeerEvent", ["type", "interface", "peer", "timestamp", "previous", "current"]
+)
+
+
+class PeerEventMonitor:  # pylint: disable=too-many-instance-attributes
+    """
+    Watches a WireGuard interface, emitting PeerEvents as its peers change
+
+    A peer is connected while its latest handshake is at most `handshake_timeout` seconds
+    old, and becomes disconnected once it is older than `disconnect_timeout` (which
+    defaults to `handshake_timeout`). A larger `disconnect_timeout` keeps peers that
+    only just missed a handshake from flapping.
+
+    The first poll only records the state of the interface, so no events are emitted
+    for the peers that were already there.
+
+    An exception raised by a callback does not stop the others from being called, nor
+    the polling: it is kept in `last_callback_error`, as polling errors are kept in
+    `last_error`.
+    """
+
+    interface = None
+    interval = None
+    handshake_timeout = None
+    disconnect_timeout = None
+    last_error = None
+    last_callback_error = None
+
+    def __init__(
+        self,
+        interface,
+        interval=None,
+        handshake_timeout=None,
+        disconnect_timeout=None,
+    ):
+        if not interface:
+            raise ValueError("Interface must be supplied")
+
+        if not isinstance(interface, Interface):
+            interface = Interface(interface)
+
+        self.interface = interface
+        self.interval = STATS_INTERVAL if interval is None else interval
+        self.handshake_timeout = (
+            HANDSHAKE_TIMEOUT if handshake_timeout is None else handshake_timeout
+        )
+        self.disconnect_timeout = (
+            self.handshake_timeout if disconnect_timeout is None else disconnect_timeout
+        )
+        if self.disconnect_timeout < self.handshake_timeout:
+            raise ValueError(
+                "disconnect_timeout must be at least as long as handshake_timeout"
+            )
+
+        self._rows = None
+        self._connected = set()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f"<PeerEventMonitor iface={self.interface.interface} interval={self.interval}>"
+
+    def subscribe(self, callback, types=None):
+        """
+        Registers a callback to be called with each PeerEvent, optionally only for the
+        given event types
+        """
+
+        if types is not None:
+            types = frozenset(types)
+            unknown = types.difference(EVENT_TYPES)
+            if unknown:
+                raise ValueError(f"Unknown event types: {', '.join(sorted(unknown))}")
+
+        self._callbacks.append((callback, types))
+
+    def unsubscribe(self, callback):
+        """
+        Removes a previously registered callback
+        """
+
+        self._callbacks = [item for item in self._callbacks if item[0] != callback]
+
+    def _is_connected(self, row, now, was_connected):
+        """
+        Returns whether the peer of the given row is connected, applying the thresholds
+        """
+
+        handshake = int(row.raw_latest_handshake or 0)
+        if not handshake:
+            return False
+
+        timeout = self.disconnect_timeout if was_connected else self.handshake_timeout
+        return now - handshake <= timeout
+
+    def diff(self, rows, now=None):
+        """
+        Returns the PeerEvents between the previously seen rows and the given ones,
+        recording the given rows as the current state
+        """
+
+        if now is None:
+            now = time.time()
+
+        current = {row.peer: row for row in rows}
+        events = []
+
+        with self._lock:
+            previous = self._rows
+            self._rows = current
+
+            if previous is None:
+                self._connected = {
+                    key
+                    for key, row in current.items()
+                    if self._is_connected(row, now, False)
+                }
+                return events
+
+            iface = self.interface.interface
+            connected = set()
+            for key, row in current.items():
+                old = previous.get(key)
+                was_connected = key in self._connected
+                if self._is_connected(row, now, was_connected):
+                    connected.add(key)
+
+                if old is not None:
+                    # Comparing the raw fields avoids decoding anything that did not change
+                    if row.raw_latest_handshake != old.raw_latest_handshake:
+                        events.append(
+                            PeerEvent(
+                                HANDSHAKE,
+                                iface,
+                                key,
+                                now,
+                                old.latest_handshake,
+                                row.latest_handshake,
+                            )
+                        )
+
+                    if row.raw_endpoint != old.raw_endpoint:
+                        events.append(
+                            PeerEvent(
+                                ENDPOINT_CHANGED,
+                                iface,
+                                key,
+                                now,
+                                old.endpoint,
+                                row.endpoint,
+                            )
+                        )
+
+                    if row.raw_allowed_ips != old.raw_allowed_ips:
+                        events.append(
+                            PeerEvent(
+                                ALLOWED_IPS_CHANGED,
+                                iface,
+                                key,
+                                now,
+                                old.allowed_ips,
+                                row.allowed_ips,
+                            )
+                        )
+
+                if key in connected and not was_connected:
+                    events.append(
+                        PeerEvent(
+                            CONNECTED,
+                            iface,
+                            key,
+                            now,
+                            old.latest_handshake if old is not None else None,
+                            row.latest_handshake,
+                        )
+                    )
+                elif was_connected and key not in connected:
+                    events.append(
+                        PeerEvent(
+                            DISCONNECTED,
+                            iface,
+                            key,
+                            now,
+                            old.latest_handshake,
+                            row.latest_handshake,
+                        )
+                    )
+
+            # Connected peers that were removed from the interface are disconnected too
+            for key in self._connected.difference(current):
+                events.append(
+                    PeerEvent(
+                        DISCONNECTED,
+                        iface,
+                        key,
+                        now,
+                        previous[key].latest_handshake,
+                        None,
+                    )
+                )
+
+            self._connected = connected
+
+        return events
+
+    def dispatch(self, events):
+        """
+        Calls the registered callbacks with each of the given events
+        """
+
+        for event in events:
+            for callback, types in list(self._callbacks):
+                if types is None or event.type in types:
+                    try:
+                        callback(event)
+                    except Exception as exc:  # pylint: disable=broad-exception-caught
+                        self.last_callback_error = exc
+
+    def poll(self, now=None):
+        """
+        Takes a single dump of the interface, dispatching and returning any events
+        """
+
+        # A single `wg show <interface> dump`, without decoding unchanged fields
+        events = self.diff(self.interface.iter_stats(), now)
+        self.dispatch(events)
+        return events
+
+    def _run(self):
+        """
+        Polls at a fixed interval until stopped
+        """
+
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                # Eg. a malformed dump, which must not stop the polling for good
+                self.last_error = exc
+
+            next_poll += self.interval
+            self._stop.wait(max(next_poll - time.monotonic(), 0))
+
+    def start(self):
+        """
+        Starts polling in a background thread, dispatching events to the callbacks
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"wireguard-events-{self.interface.interface}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops polling
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    async def events(self):
+        """
+        Polls the interface at the configured interval, yielding each event
+
+        The dumps are taken in the event loop's default executor, so the loop itself
+        is never blocked on the `wg` command. The events are only yielded, not passed to
+        the subscribed callbacks: use `start()` for those.
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            events = await loop.run_in_executor(
+                None, self.diff, self.interface.iter_stats()
+            )
+            for event in events:
+                yield event
+
+            await asyncio.sleep(self.interval)
+
+    def __aiter__(self):
+        return self.events()
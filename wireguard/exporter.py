@@ -0,0 +1,324 @@
+"""
+wireguard.exporter
+
+Prometheus metrics for WireGuard interfaces.
+
+A single background poll of the interfaces renders the metrics, which every scrape is
+then served from, so scrapes never spawn a `wg` command themselves.
+
+NOTE: This functionality requires sufficient privileges to run the wg command on your
+      system. Bind the exporter to a local address unless you intend to expose it.
+"""
+
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .constants import (
+    EXPORTER_HOST,
+    EXPORTER_PORT,
+    STATS_INTERVAL,
+)
+from .service import Interface, StatsCollector
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PEER_METRICS = (
+    (
+        "wireguard_peer_receive_bytes_total",
+        "counter",
+        "Bytes received from the peer",
+    ),
+    (
+        "wireguard_peer_transmit_bytes_total",
+        "counter",
+        "Bytes transmitted to the peer",
+    ),
+    (
+        "wireguard_peer_latest_handshake_seconds",
+        "gauge",
+        "UNIX timestamp of the latest handshake with the peer, 0 if never",
+    ),
+)
+
+INTERFACE_METRICS = (
+    (
+        "wireguard_interface_peers",
+        "gauge",
+        "Number of peers configured on the interface",
+    ),
+    (
+        "wireguard_interface_receive_bytes_total",
+        "counter",
+        "Bytes received from all of the interface's peers",
+    ),
+    (
+        "wireguard_interface_transmit_bytes_total",
+        "counter",
+        "Bytes transmitted to all of the interface's peers",
+    ),
+    (
+        "wireguard_interface_poll_errors_total",
+        "counter",
+        "Number of failed polls of the interface's statistics",
+    ),
+    (
+        "wireguard_interface_last_poll_success",
+        "gauge",
+        "Whether the latest poll of the interface's statistics succeeded (1) or not (0)",
+    ),
+)
+
+EXPORTER_METRICS = (
+    (
+        "wireguard_exporter_last_poll_timestamp_seconds",
+        "gauge",
+        "UNIX timestamp of the latest poll of the interfaces",
+    ),
+    (
+        "wireguard_exporter_poll_duration_seconds",
+        "gauge",
+        "Time taken by the latest poll of the interfaces",
+    ),
+)
+
+
+def _escape(value):
+    """
+    Escapes a label value for the Prometheus text format
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    """
+    Returns the rendered labels for a sample
+    """
+
+    values = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + values + "}"
+
+
+class MetricsExporter:  # pylint: disable=too-many-instance-attributes
+    """
+    Serves the statistics of WireGuard interfaces as Prometheus metrics on `/metrics`
+    """
+
+    interval = None
+    host = None
+    port = None
+    last_error = None
+
+    def __init__(self, interfaces, interval=None, host=None, port=None):
+        if not interfaces:
+            raise ValueError("At least one interface must be supplied")
+
+        if isinstance(interfaces, (str, Interface)):
+            interfaces = [interfaces]
+
+        # History is not needed, only the latest sample of each peer
+        self.collectors = [StatsCollector(iface, size=2) for iface in interfaces]
+        self.errors = {
+            collector.interface.interface: 0 for collector in self.collectors
+        }
+        self.succeeded = {
+            collector.interface.interface: 0 for collector in self.collectors
+        }
+
+        self.interval = STATS_INTERVAL if interval is None else interval
+        self.host = EXPORTER_HOST if host is None else host
+        self.port = EXPORTER_PORT if port is None else port
+
+        self.metrics = b""
+        self.last_poll = None
+        self.poll_duration = None
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+
+    def __repr__(self):
+        ifaces = ",".join(self.errors)
+        return f"<MetricsExporter ifaces={ifaces} host={self.host} port={self.port}>"
+
+    def poll(self):
+        """
+        Polls all the interfaces once, and renders the metrics that scrapes are served
+        """
+
+        start = time.monotonic()
+        for collector in self.collectors:
+            iface = collector.interface.interface
+            try:
+                collector.poll()
+                self.succeeded[iface] = 1
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                # Whatever went wrong (eg. a malformed dump), the polling must go on, and
+                # the stale metrics must not look current
+                self.errors[iface] += 1
+                self.succeeded[iface] = 0
+                self.last_error = exc
+
+        self.last_poll = time.time()
+        self.poll_duration = time.monotonic() - start
+        self.metrics = self.render().encode("utf-8")
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format
+        """
+
+        samples = {name: [] for name, _, _ in PEER_METRICS + INTERFACE_METRICS}
+        for collector in self.collectors:
+            iface = collector.interface.interface
+            totals = collector.totals()
+            peers = collector.peers()
+
+            for key in peers:
+                latest = collector.latest(key)
+                labels = _labels(interface=iface, public_key=key)
+                samples["wireguard_peer_receive_bytes_total"].append(
+                    (labels, latest[1])
+                )
+                samples["wireguard_peer_transmit_bytes_total"].append(
+                    (labels, latest[2])
+                )
+                samples["wireguard_peer_latest_handshake_seconds"].append(
+                    (labels, latest[3])
+                )
+
+            labels = _labels(interface=iface)
+            samples["wireguard_interface_peers"].append((labels, len(peers)))
+            samples["wireguard_interface_receive_bytes_total"].append(
+                (labels, totals["rx"])
+            )
+            samples["wireguard_interface_transmit_bytes_total"].append(
+                (labels, totals["tx"])
+            )
+            samples["wireguard_interface_poll_errors_total"].append(
+                (labels, self.errors[iface])
+            )
+            samples["wireguard_interface_last_poll_success"].append(
+                (labels, self.succeeded[iface])
+            )
+
+        if self.last_poll is not None:
+            samples["wireguard_exporter_last_poll_timestamp_seconds"] = [
+                ("", self.last_poll)
+            ]
+            samples["wireguard_exporter_poll_duration_seconds"] = [
+                ("", self.poll_duration)
+            ]
+
+        lines = []
+        for name, metric_type, description in (
+            PEER_METRICS + INTERFACE_METRICS + EXPORTER_METRICS
+        ):
+            if not samples.get(name):
+                continue
+
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples[name]:
+                lines.append(f"{name}{labels} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def _poll_forever(self):
+        """
+        Polls at a fixed interval until stopped
+        """
+
+        # `start()` has just polled, so the first poll here is one interval later
+        next_poll = time.monotonic()
+        while True:
+            next_poll += self.interval
+            if self._stop.wait(max(next_poll - time.monotonic(), 0)):
+                return
+
+            try:
+                self.poll()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.last_error = exc
+
+    def _handler(self):
+        """
+        Returns the request handler class, bound to this exporter
+        """
+
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """
+            Serves the latest rendered metrics
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Handles GET requests
+                """
+
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = exporter.metrics
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        return MetricsHandler
+
+    def start(self):
+        """
+        Starts polling, and serving the metrics, in background threads
+        """
+
+        if self._server is not None:
+            return
+
+        # Ensure the first scrape already has data to be served
+        self.poll()
+
+        self._stop.clear()
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.port = self._server.server_address[1]
+        self._threads = [
+            threading.Thread(target=self._poll_forever, daemon=True),
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops polling and serving the metrics
+        """
+
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def serve_forever(self):
+        """
+        Serves the metrics until interrupted
+        """
+
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        finally:
+            self.stop()
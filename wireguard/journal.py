@@ -0,0 +1,517 @@
+"""
+wireguard.journal
+
+An append-only journal of the changes to a Server, folded into snapshots
+"""
+
+import json
+import os
+import threading
+import time
+
+from .constants import (
+    JOURNAL_COMPACT_RECORDS,
+    JOURNAL_SYNC_INTERVAL,
+    JOURNAL_SYNC_RECORDS,
+)
+from .registry import (
+    peer_row,
+    row_peer,
+)
+from .server import Server
+from .utils import JSONEncoder
+
+# Journal record types. Each record is a JSON array on a line of its own:
+#   [ "c", settings ]       the server was created with the given settings
+#   [ "a", peer row ]       a peer was added, as a `wireguard.registry` row
+#   [ "r", public key ]     a peer was removed
+#   [ "s", name, value ]    a server attribute was set
+CREATE = "c"
+ADD = "a"
+REMOVE = "r"
+SET = "s"
+
+# The server attributes that are recorded, with the names they are recorded under
+JOURNALED_ATTRIBUTES = {
+    "address": "address",
+    "allowed_ips": "allowed_ips",
+    "comments": "comments",
+    "description": "description",
+    "dns": "dns",
+    "endpoint": "endpoint",
+    "interface": "interface",
+    "ipv4": "address",
+    "ipv6": "address",
+    "keepalive": "keepalive",
+    "mtu": "mtu",
+    "port": "port",
+    "post_down": "post_down",
+    "post_up": "post_up",
+    "pre_down": "pre_down",
+    "pre_up": "pre_up",
+    "preshared_key": "preshared_key",
+    "private_key": "private_key",
+    "save_config": "save_config",
+    "table": "table",
+}
+
+
+def empty_state():
+    """
+    Returns the state of a journal that has no records
+    """
+
+    return {"server": None, "peers": {}}
+
+
+def apply_record(state, record):
+    """
+    Applies a single journal record to a state
+    """
+
+    kind = record[0]
+    if kind == CREATE:
+        state["server"] = dict(record[1])
+        state["peers"] = {}
+    elif kind == ADD:
+        state["peers"][record[1][0]] = record[1]
+    elif kind == REMOVE:
+        state["peers"].pop(record[1], None)
+    elif kind == SET:
+        state["server"][record[1]] = record[2]
+    else:
+        raise ValueError(f"Unknown journal record type: {kind}")
+
+
+class Journal:  # pylint: disable=too-many-instance-attributes
+    """
+    An append-only journal of Server changes, along with a snapshot of the state before them
+
+    Records are written as they happen and fsynced in groups: once `sync_every` records
+    are pending, or the oldest pending one has waited `sync_interval` seconds, even when
+    nothing else is appended. Use `sync()` where a change must be on disk before carrying
+    on.
+
+    The records go to numbered journal files. Once a file holds `compact_every`
+    records, a new one is started, and a background thread folds the snapshot and the
+    older files into a new snapshot. So appending never rewrites the state, and loading
+    it only replays the records since the last compaction.
+    """
+
+    path = None
+    sync_every = None
+    sync_interval = None
+    compact_every = None
+
+    def __init__(self, path, sync_every=None, sync_interval=None, compact_every=None):
+        self.path = path
+        self.sync_every = JOURNAL_SYNC_RECORDS if sync_every is None else sync_every
+        self.sync_interval = (
+            JOURNAL_SYNC_INTERVAL if sync_interval is None else sync_interval
+        )
+        self.compact_every = (
+            JOURNAL_COMPACT_RECORDS if compact_every is None else compact_every
+        )
+
+        self._lock = threading.RLock()
+        self._file = None
+        self._generation = 0
+        self._records = 0
+        self._pending = 0
+        self._synced = time.monotonic()
+        self._compactor = None
+        self._compact_error = None
+        self._flusher = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} path={self.path}>"
+
+    @property
+    def snapshot_path(self):
+        """
+        Returns the path of the snapshot file
+        """
+
+        return f"{self.path}.snapshot"
+
+    def segment_path(self, generation):
+        """
+        Returns the path of the journal file of the given generation
+        """
+
+        return f"{self.path}.journal.{generation}"
+
+    def _segments(self):
+        """
+        Returns the generations of the existing journal files, in order
+        """
+
+        directory, prefix = os.path.split(f"{self.path}.journal.")
+        generations = []
+        for name in os.listdir(directory or "."):
+            if name.startswith(prefix) and name[len(prefix) :].isdigit():
+                generations.append(int(name[len(prefix) :]))
+
+        return sorted(generations)
+
+    def _read_snapshot(self):
+        """
+        Returns the generation and state of the snapshot, if there is one
+        """
+
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as snapshot_fh:
+                data = json.load(snapshot_fh)
+        except FileNotFoundError:
+            return 0, empty_state()
+
+        state = empty_state()
+        state["server"] = data["server"]
+        state["peers"] = {row[0]: row for row in data["peers"]}
+        return data["generation"], state
+
+    def _read_segment(self, generation, repair=False):
+        """
+        Returns the records of a journal file
+
+        A crash can leave the last record partially written. With `repair`, that record
+        is dropped from the file, otherwise any unreadable record is an error.
+        """
+
+        path = self.segment_path(generation)
+        records = []
+        offset = 0
+        with open(path, "rb") as segment_fh:
+            for line in segment_fh:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Truncated record")
+                    records.append(json.loads(line))
+                except ValueError as exc:
+                    if repair and not segment_fh.read():
+                        break
+                    raise ValueError(
+                        f"Unreadable journal record in {path} at offset {offset}"
+                    ) from exc
+                offset += len(line)
+
+        if repair and offset != os.path.getsize(path):
+            os.truncate(path, offset)
+
+        return records
+
+    def _fold(self, before=None):
+        """
+        Returns the state of the snapshot plus the journal files, optionally only the
+        files before the given generation
+        """
+
+        generation, state = self._read_snapshot()
+        segments = [
+            segment
+            for segment in self._segments()
+            if segment >= generation and (before is None or segment < before)
+        ]
+
+        for segment in segments:
+            # Only the file being appended to can have been cut off by a crash
+            repair = before is None and segment == segments[-1]
+            for record in self._read_segment(segment, repair=repair):
+                apply_record(state, record)
+
+        return state
+
+    def _sync_directory(self):
+        """
+        Writes the journal's directory entries to disk, eg. after creating a file in it
+        """
+
+        directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _open(self):
+        path = self.segment_path(self._generation)
+        created = not os.path.exists(path)
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, mode="a", encoding="utf-8")
+        if created:
+            # Otherwise the new file, and the records synced to it, could be lost
+            self._sync_directory()
+
+    def load(self):
+        """
+        Returns the state recorded in the snapshot and journal files, and opens the
+        journal for appending
+
+        The state is a dict of the server's settings ("server", None if it was never
+        recorded) and of its peer rows by public key ("peers").
+        """
+
+        with self._lock:
+            if self._file is not None:
+                raise ValueError("The journal is already open")
+
+            state = self._fold()
+
+            segments = self._segments()
+            snapshot_generation = self._read_snapshot()[0]
+            if segments and segments[-1] >= snapshot_generation:
+                self._generation = segments[-1]
+                self._records = len(self._read_segment(self._generation))
+            else:
+                self._generation = snapshot_generation
+                self._records = 0
+
+            self._open()
+            return state
+
+    def append(self, record):
+        """
+        Appends a record to the journal, syncing the pending records when they are due
+        """
+
+        line = json.dumps(record, cls=JSONEncoder, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                raise ValueError("The journal must be loaded before appending to it")
+
+            self._file.write(line + "\n")
+            self._file.flush()
+            if not self._pending:
+                self._synced = time.monotonic()
+
+            self._pending += 1
+            self._records += 1
+            if (
+                self._pending >= self.sync_every
+                or time.monotonic() - self._synced >= self.sync_interval
+            ):
+                self.sync()
+            elif self._flusher is None:
+                # Sync the records even if no other one is appended in time
+                self._flusher = threading.Timer(
+                    self.sync_interval - (time.monotonic() - self._synced), self.sync
+                )
+                self._flusher.daemon = True
+                self._flusher.start()
+
+            compact = self.compact_every and self._records >= self.compact_every
+
+        if compact:
+            self.compact()
+
+    def sync(self):
+        """
+        Writes the pending records to disk
+        """
+
+        with self._lock:
+            if self._flusher is not None:
+                self._flusher.cancel()
+                self._flusher = None
+
+            if self._file is not None and self._pending:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    def compact(self, wait=False):
+        """
+        Starts a new journal file, and folds the previous ones into a new snapshot in a
+        background thread
+
+        Only one compaction runs at a time. `wait` blocks until it is done, and raises
+        the error of a compaction that failed. Otherwise, that error is raised by
+        `close()`. A failed compaction leaves the previous snapshot and journal files in
+        place, so the next one folds them in again.
+        """
+
+        with self._lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self.sync()
+                self._file.close()
+                self._generation += 1
+                self._records = 0
+                self._open()
+
+                self._compactor = threading.Thread(
+                    target=self._run_compact,
+                    args=(self._generation,),
+                    name=f"wireguard-journal-{os.path.basename(self.path)}",
+                    daemon=True,
+                )
+                self._compactor.start()
+
+            compactor = self._compactor
+
+        if wait:
+            compactor.join()
+            self._raise_compact_error()
+
+    def _run_compact(self, generation):
+        """
+        Compacts in the background thread, keeping any error for `compact()`/`close()`
+        """
+
+        try:
+            self._compact(generation)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            with self._lock:
+                self._compact_error = exc
+
+    def _raise_compact_error(self):
+        """
+        Raises the error of a failed compaction, once
+        """
+
+        with self._lock:
+            error, self._compact_error = self._compact_error, None
+
+        if error is not None:
+            raise error
+
+    def _compact(self, generation):
+        """
+        Writes the snapshot of all the journal files before the given generation, then
+        removes them
+        """
+
+        state = self._fold(before=generation)
+        temporary = f"{self.snapshot_path}.tmp"
+        with open(temporary, mode="w", encoding="utf-8") as snapshot_fh:
+            json.dump(
+                {
+                    "generation": generation,
+                    "server": state["server"],
+                    "peers": list(state["peers"].values()),
+                },
+                snapshot_fh,
+                separators=(",", ":"),
+            )
+            snapshot_fh.flush()
+            os.fsync(snapshot_fh.fileno())
+
+        # Until the rename is on disk, the old snapshot and journal files are still used
+        os.replace(temporary, self.snapshot_path)
+        self._sync_directory()
+
+        for segment in self._segments():
+            if segment < generation:
+                os.remove(self.segment_path(segment))
+
+    def close(self):
+        """
+        Syncs and closes the journal, stopping its timer and waiting for any compaction to
+        finish, then raises the error of a compaction that failed
+        """
+
+        with self._lock:
+            self.sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            compactor = self._compactor
+
+        if compactor is not None:
+            compactor.join()
+
+        self._raise_compact_error()
+
+
+class JournaledServer(Server):
+    """
+    A WireGuard Server that records every change to it in a Journal
+
+    Adding and removing peers through the server, and setting its attributes, are each
+    appended to the journal as a single record. Changes made by mutating a collection in
+    place (eg. `server.dns.add()`, or `server.peers` directly) are not seen, so assign the
+    new value instead.
+
+    Peers are restored as RemotePeers, which have everything this server's config needs.
+    Use `restore()` to create or reload a server.
+    """
+
+    __slots__ = ("journal",)
+
+    def __init__(self, description, subnet, **kwargs):
+        # Nothing is recorded until the server is attached to a journal
+        self.journal = None
+        super().__init__(description, subnet, **kwargs)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in JOURNALED_ATTRIBUTES and self.journal is not None:
+            name = JOURNALED_ATTRIBUTES[name]
+            self.journal.append([SET, name, getattr(self, name)])
+
+    @classmethod
+    def restore(cls, journal, description=None, subnet=None, **kwargs):
+        """
+        Returns the server recorded in the given journal (or journal path)
+
+        When nothing was recorded yet, a server is created with the given arguments, and
+        recorded from then on.
+        """
+
+        if not isinstance(journal, Journal):
+            journal = Journal(journal)
+
+        state = journal.load()
+        if state["server"] is None:
+            server = cls(description, subnet, **kwargs)
+            server.journal = journal
+            journal.append([CREATE, server.settings()])
+            return server
+
+        settings = dict(state["server"])
+        server = cls(settings.pop("description"), settings.pop("subnet"), **settings)
+
+        # The peers were checked to be unique when they were recorded, so they are
+        # attached all at once rather than checked against each other again
+        peers = [row_peer(row) for row in state["peers"].values()]
+        if peers:
+            server.peers.extend(peers)
+            for peer in peers:
+                server.update_routes(peer)
+
+        server.journal = journal
+        return server
+
+    def settings(self):
+        """
+        Returns the recorded attributes of this server, along with its subnets
+        """
+
+        settings = {
+            name: getattr(self, name) for name in set(JOURNALED_ATTRIBUTES.values())
+        }
+        settings["subnet"] = [
+            subnet for subnet in (self.ipv4_subnet, self.ipv6_subnet) if subnet
+        ]
+        return settings
+
+    def add_peer(self, peer, max_address_retries=None, max_privkey_retries=None):
+        """
+        Adds a peer to this server, recording it in the journal
+        """
+
+        super().add_peer(
+            peer,
+            max_address_retries=max_address_retries,
+            max_privkey_retries=max_privkey_retries,
+        )
+        if self.journal is not None:
+            self.journal.append([ADD, peer_row(peer)])
+
+    def remove_peer(self, peer, *, bidirectional=True):
+        """
+        Removes the given peer from this server, recording it in the journal
+        """
+
+        attached = peer in self.peers
+        super().remove_peer(peer, bidirectional=bidirectional)
+        if attached and self.journal is not None:
+            self.journal.append([REMOVE, peer.public_key])
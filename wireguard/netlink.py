@@ -0,0 +1,875 @@
+"""
+wireguard.netlink
+
+A service backend that talks to the WireGuard kernel module over generic netlink, rather
+than spawning the `wg` command for every request.
+
+Select it by using `NetlinkInterface` as the `service_cls` of a Peer/Server.
+
+NOTE: As with `wireguard.service`, this requires sufficient privileges (CAP_NET_ADMIN) on
+      your system. Do NOT grant this capability to the web server user.
+"""
+
+import os
+import socket
+import struct
+import subprocess
+
+from base64 import b64decode, b64encode
+
+from subnet import ip_address, ip_network
+
+from .constants import PORT
+from .service import Interface, PeerRow
+from .utils import split_endpoint
+
+# linux/netlink.h
+NETLINK_GENERIC = 16
+
+NLMSG_NOOP = 0x1
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3FFF
+NLA_ALIGNTO = 4
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+NLA_HEADER = struct.Struct("=HH")
+GENL_HEADER = struct.Struct("=BBH")
+
+# linux/genetlink.h
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# linux/wireguard.h
+WG_GENL_NAME = "wireguard"
+WG_GENL_VERSION = 1
+WG_KEY_LEN = 32
+
+WG_CMD_GET_DEVICE = 0
+WG_CMD_SET_DEVICE = 1
+
+WGDEVICE_F_REPLACE_PEERS = 1 << 0
+
+WGDEVICE_A_IFINDEX = 1
+WGDEVICE_A_IFNAME = 2
+WGDEVICE_A_PRIVATE_KEY = 3
+WGDEVICE_A_PUBLIC_KEY = 4
+WGDEVICE_A_FLAGS = 5
+WGDEVICE_A_LISTEN_PORT = 6
+WGDEVICE_A_FWMARK = 7
+WGDEVICE_A_PEERS = 8
+
+WGPEER_F_REMOVE_ME = 1 << 0
+WGPEER_F_REPLACE_ALLOWEDIPS = 1 << 1
+WGPEER_F_UPDATE_ONLY = 1 << 2
+
+WGPEER_A_PUBLIC_KEY = 1
+WGPEER_A_PRESHARED_KEY = 2
+WGPEER_A_FLAGS = 3
+WGPEER_A_ENDPOINT = 4
+WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL = 5
+WGPEER_A_LAST_HANDSHAKE_TIME = 6
+WGPEER_A_RX_BYTES = 7
+WGPEER_A_TX_BYTES = 8
+WGPEER_A_ALLOWEDIPS = 9
+WGPEER_A_PROTOCOL_VERSION = 10
+
+WGALLOWEDIP_A_FAMILY = 1
+WGALLOWEDIP_A_IPADDR = 2
+WGALLOWEDIP_A_CIDR_MASK = 3
+
+# Mirrors the `wg` tool, which keeps each set-device message within a page
+MAX_MESSAGE_SIZE = 4096
+RECV_BUFFER_SIZE = 65536
+
+EMPTY_KEY = b"\0" * WG_KEY_LEN
+
+# Keys of a config file that only `wg-quick` understands, and are skipped when the file
+# is applied over netlink, as per `wg-quick strip`
+WG_QUICK_KEYS = (
+    "address",
+    "dns",
+    "mtu",
+    "table",
+    "preup",
+    "postup",
+    "predown",
+    "postdown",
+    "saveconfig",
+)
+
+
+class NetlinkError(OSError):
+    """
+    An error reported by the kernel in response to a netlink request
+    """
+
+
+def _align(length):
+    """
+    Returns the length padded to the netlink attribute alignment
+    """
+    return (length + NLA_ALIGNTO - 1) & ~(NLA_ALIGNTO - 1)
+
+
+def encode_attr(attr_type, value):
+    """
+    Encodes a single netlink attribute with the given raw bytes value
+    """
+
+    length = NLA_HEADER.size + len(value)
+    return (
+        NLA_HEADER.pack(length, attr_type) + value + b"\0" * (_align(length) - length)
+    )
+
+
+def encode_nested(attr_type, attrs):
+    """
+    Encodes a nested netlink attribute containing the given encoded attributes
+    """
+    return encode_attr(attr_type | NLA_F_NESTED, b"".join(attrs))
+
+
+def decode_attrs(data):
+    """
+    Yields a tuple of ( attribute type, raw value ) for each attribute in the given data
+    """
+
+    offset = 0
+    while offset + NLA_HEADER.size <= len(data):
+        length, attr_type = NLA_HEADER.unpack_from(data, offset)
+        if length < NLA_HEADER.size or offset + length > len(data):
+            raise ValueError(f"Malformed netlink attribute at offset {offset}")
+
+        yield (
+            attr_type & NLA_TYPE_MASK,
+            data[offset + NLA_HEADER.size : offset + length],
+        )
+        offset += _align(length)
+
+
+def encode_message(msg_type, flags, seq, payload, pid=0):
+    """
+    Encodes a netlink message with the given payload
+    """
+    return (
+        NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type, flags, seq, pid)
+        + payload
+    )
+
+
+def decode_messages(data):
+    """
+    Yields a tuple of ( type, flags, seq, payload ) for each netlink message in the data
+    """
+
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, flags, seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size or offset + length > len(data):
+            raise ValueError(f"Malformed netlink message at offset {offset}")
+
+        yield (msg_type, flags, seq, data[offset + NLMSG_HEADER.size : offset + length])
+        offset += _align(length)
+
+
+def encode_genl(cmd, attrs, version=WG_GENL_VERSION):
+    """
+    Encodes a generic netlink payload: the genl header followed by the attributes
+    """
+    return GENL_HEADER.pack(cmd, version, 0) + b"".join(attrs)
+
+
+def decode_genl(payload):
+    """
+    Returns a tuple of ( command, attributes data ) from a generic netlink payload
+    """
+
+    cmd, _, _ = GENL_HEADER.unpack_from(payload)
+    return (cmd, payload[GENL_HEADER.size :])
+
+
+def _key_to_bytes(key):
+    """
+    Returns the raw bytes of a base64 encoded WireGuard key
+    """
+
+    value = b64decode(key)
+    if len(value) != WG_KEY_LEN:
+        raise ValueError("WireGuard keys must be 32 bytes long")
+    return value
+
+
+def _bytes_to_key(value):
+    """
+    Returns the base64 encoded WireGuard key, or None for an unset key
+    """
+
+    if value == EMPTY_KEY:
+        return None
+    return b64encode(value).decode("ascii")
+
+
+def encode_endpoint(endpoint):
+    """
+    Encodes an endpoint, ie: `host:port` or `[ipv6]:port`, as a sockaddr structure
+
+    An endpoint without a port uses the default WireGuard port.
+    """
+
+    host, port = split_endpoint(endpoint)
+    port = PORT if port is None else int(port)
+    if not host or not 0 < port < 65536:
+        raise ValueError(f"Invalid endpoint: {endpoint}")
+
+    try:
+        address = ip_address(host)
+    except ValueError:
+        # Like the `wg` tool, resolve hostnames once, when configuring the interface
+        try:
+            info = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        except OSError as exc:
+            raise ValueError(f"Could not resolve endpoint: {endpoint}") from exc
+        address = ip_address(info[0][4][0])
+
+    if address.version == 4:
+        return struct.pack("=H", socket.AF_INET) + struct.pack(
+            "!H4s8x", port, address.packed
+        )
+
+    return struct.pack("=H", socket.AF_INET6) + struct.pack(
+        "!HI16sI", port, 0, address.packed, 0
+    )
+
+
+def decode_endpoint(value):
+    """
+    Decodes a sockaddr structure into an endpoint, ie: `host:port` or `[ipv6]:port`
+    """
+
+    (family,) = struct.unpack_from("=H", value)
+    if family == socket.AF_INET:
+        port, packed = struct.unpack_from("!H4s", value, 2)
+        return f"{ip_address(packed)}:{port}"
+
+    if family == socket.AF_INET6:
+        port, _, packed = struct.unpack_from("!HI16s", value, 2)
+        return f"[{ip_address(packed)}]:{port}"
+
+    return None
+
+
+def encode_allowed_ip(value):
+    """
+    Encodes an allowed IP network as a nested netlink attribute
+    """
+
+    net = ip_network(value, strict=False)
+    family = socket.AF_INET if net.version == 4 else socket.AF_INET6
+    return encode_nested(
+        0,
+        (
+            encode_attr(WGALLOWEDIP_A_FAMILY, struct.pack("=H", family)),
+            encode_attr(WGALLOWEDIP_A_IPADDR, net.network_address.packed),
+            encode_attr(WGALLOWEDIP_A_CIDR_MASK, struct.pack("=B", net.prefixlen)),
+        ),
+    )
+
+
+def decode_allowed_ip(data):
+    """
+    Decodes a nested allowed IP attribute into a `network/prefixlen` string
+    """
+
+    address = None
+    cidr = None
+    for attr_type, value in decode_attrs(data):
+        if attr_type == WGALLOWEDIP_A_IPADDR:
+            address = ip_address(value)
+        elif attr_type == WGALLOWEDIP_A_CIDR_MASK:
+            (cidr,) = struct.unpack("=B", value)
+
+    return f"{address}/{cidr}"
+
+
+def encode_peer(peer, allowed_ips=None):
+    """
+    Encodes a peer dict as a nested netlink attribute
+
+    The dict supports the keys: `public_key`, `preshared_key`, `endpoint`,
+    `persistent_keepalive`, `allowed_ips`, `remove`, `replace_allowed_ips` and
+    `update_only`. Passing `allowed_ips` overrides the value in the dict, which is
+    used when a peer must be split across several messages.
+    """
+
+    flags = 0
+    if peer.get("remove"):
+        flags |= WGPEER_F_REMOVE_ME
+    if peer.get("replace_allowed_ips"):
+        flags |= WGPEER_F_REPLACE_ALLOWEDIPS
+    if peer.get("update_only"):
+        flags |= WGPEER_F_UPDATE_ONLY
+
+    attrs = [encode_attr(WGPEER_A_PUBLIC_KEY, _key_to_bytes(peer["public_key"]))]
+    if flags:
+        attrs.append(encode_attr(WGPEER_A_FLAGS, struct.pack("=I", flags)))
+
+    if "preshared_key" in peer:
+        value = peer["preshared_key"]
+        value = _key_to_bytes(value) if value else EMPTY_KEY
+        attrs.append(encode_attr(WGPEER_A_PRESHARED_KEY, value))
+
+    if peer.get("endpoint"):
+        attrs.append(encode_attr(WGPEER_A_ENDPOINT, encode_endpoint(peer["endpoint"])))
+
+    if "persistent_keepalive" in peer:
+        value = int(peer["persistent_keepalive"] or 0)
+        attrs.append(
+            encode_attr(
+                WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL, struct.pack("=H", value)
+            )
+        )
+
+    if allowed_ips is None:
+        allowed_ips = peer.get("allowed_ips") or []
+    if allowed_ips:
+        attrs.append(
+            encode_nested(
+                WGPEER_A_ALLOWEDIPS, [encode_allowed_ip(net) for net in allowed_ips]
+            )
+        )
+
+    return encode_nested(0, attrs)
+
+
+def decode_peer(data):
+    """
+    Decodes a nested peer attribute into a dict of the same shape as `Interface.stats()`
+    row data, with the peer's public key included
+    """
+
+    peer = {
+        "public_key": None,
+        "preshared_key": None,
+        "endpoint": None,
+        "allowed_ips": [],
+        "latest_handshake": 0,
+        "rx": 0,
+        "tx": 0,
+        "persistent_keepalive": False,
+    }
+
+    for attr_type, value in decode_attrs(data):
+        if attr_type == WGPEER_A_PUBLIC_KEY:
+            peer["public_key"] = _bytes_to_key(value)
+        elif attr_type == WGPEER_A_PRESHARED_KEY:
+            peer["preshared_key"] = _bytes_to_key(value)
+        elif attr_type == WGPEER_A_ENDPOINT:
+            peer["endpoint"] = decode_endpoint(value)
+        elif attr_type == WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL:
+            (interval,) = struct.unpack("=H", value)
+            peer["persistent_keepalive"] = interval or False
+        elif attr_type == WGPEER_A_LAST_HANDSHAKE_TIME:
+            peer["latest_handshake"], _ = struct.unpack("=qq", value)
+        elif attr_type == WGPEER_A_RX_BYTES:
+            (peer["rx"],) = struct.unpack("=Q", value)
+        elif attr_type == WGPEER_A_TX_BYTES:
+            (peer["tx"],) = struct.unpack("=Q", value)
+        elif attr_type == WGPEER_A_ALLOWEDIPS:
+            for _, allowed_ip in decode_attrs(value):
+                peer["allowed_ips"].append(decode_allowed_ip(allowed_ip))
+
+    return peer
+
+
+def decode_device(payloads):
+    """
+    Decodes the generic netlink payloads of a get-device dump into a single device dict
+
+    The kernel splits large devices across several messages, and may split a single
+    peer's allowed IPs too, in which case the peer is repeated at the start of the next
+    message. Those are merged back together here.
+    """
+
+    device = {
+        "ifindex": None,
+        "ifname": None,
+        "private_key": None,
+        "public_key": None,
+        "listen_port": None,
+        "fwmark": 0,
+        "peers": [],
+    }
+
+    for payload in payloads:
+        _, data = decode_genl(payload)
+        for attr_type, value in decode_attrs(data):
+            if attr_type == WGDEVICE_A_IFINDEX:
+                (device["ifindex"],) = struct.unpack("=I", value)
+            elif attr_type == WGDEVICE_A_IFNAME:
+                device["ifname"] = value.rstrip(b"\0").decode("utf-8")
+            elif attr_type == WGDEVICE_A_PRIVATE_KEY:
+                device["private_key"] = _bytes_to_key(value)
+            elif attr_type == WGDEVICE_A_PUBLIC_KEY:
+                device["public_key"] = _bytes_to_key(value)
+            elif attr_type == WGDEVICE_A_LISTEN_PORT:
+                (device["listen_port"],) = struct.unpack("=H", value)
+            elif attr_type == WGDEVICE_A_FWMARK:
+                (device["fwmark"],) = struct.unpack("=I", value)
+            elif attr_type == WGDEVICE_A_PEERS:
+                for _, peer_data in decode_attrs(value):
+                    peer = decode_peer(peer_data)
+                    peers = device["peers"]
+                    if peers and peers[-1]["public_key"] == peer["public_key"]:
+                        peers[-1]["allowed_ips"].extend(peer["allowed_ips"])
+                    else:
+                        peers.append(peer)
+
+    return device
+
+
+def _peer_chunks(peer, max_size):
+    """
+    Yields the encoded peer, split into several encodings of the same peer when its
+    allowed IPs would not fit into a single message
+    """
+
+    allowed_ips = list(peer.get("allowed_ips") or [])
+    encoded = encode_peer(peer)
+    if len(encoded) <= max_size or not allowed_ips:
+        yield encoded
+        return
+
+    # Continuation chunks only carry the public key and more allowed IPs
+    current = peer
+    continuation = {"public_key": peer["public_key"]}
+    chunk = []
+    size = len(encode_peer(current, allowed_ips=[])) + NLA_HEADER.size
+    for net in allowed_ips:
+        length = len(encode_allowed_ip(net))
+        if chunk and size + length > max_size:
+            yield encode_peer(current, allowed_ips=chunk)
+            current = continuation
+            chunk = []
+            size = len(encode_peer(current, allowed_ips=[])) + NLA_HEADER.size
+
+        chunk.append(net)
+        size += length
+
+    yield encode_peer(current, allowed_ips=chunk)
+
+
+def encode_set_device(
+    ifname,
+    *,
+    private_key=None,
+    listen_port=None,
+    fwmark=None,
+    replace_peers=False,
+    peers=None,
+    max_size=MAX_MESSAGE_SIZE,
+):  # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Returns the list of generic netlink payloads for a set-device request
+
+    Peers are packed into as few payloads as fit within `max_size`. Only the first payload
+    carries the device level attributes.
+    """
+
+    ifname_attr = encode_attr(WGDEVICE_A_IFNAME, ifname.encode("utf-8") + b"\0")
+    header = [ifname_attr]
+    if private_key is not None:
+        value = _key_to_bytes(private_key) if private_key else EMPTY_KEY
+        header.append(encode_attr(WGDEVICE_A_PRIVATE_KEY, value))
+    if listen_port is not None:
+        header.append(
+            encode_attr(WGDEVICE_A_LISTEN_PORT, struct.pack("=H", int(listen_port)))
+        )
+    if fwmark is not None:
+        header.append(encode_attr(WGDEVICE_A_FWMARK, struct.pack("=I", int(fwmark))))
+    if replace_peers:
+        header.append(
+            encode_attr(WGDEVICE_A_FLAGS, struct.pack("=I", WGDEVICE_F_REPLACE_PEERS))
+        )
+
+    overhead = NLMSG_HEADER.size + GENL_HEADER.size + NLA_HEADER.size
+    payloads = []
+    attrs = header
+    chunk = []
+    size = overhead + sum(len(attr) for attr in attrs)
+
+    for peer in peers or []:
+        for encoded in _peer_chunks(peer, max_size - overhead - len(ifname_attr)):
+            # The device level attributes may need a message to themselves
+            if size + len(encoded) > max_size and (chunk or len(attrs) > 1):
+                if chunk:
+                    attrs = attrs + [encode_nested(WGDEVICE_A_PEERS, chunk)]
+                payloads.append(encode_genl(WG_CMD_SET_DEVICE, attrs))
+                attrs = [ifname_attr]
+                chunk = []
+                size = overhead + len(ifname_attr)
+
+            chunk.append(encoded)
+            size += len(encoded)
+
+    if chunk:
+        attrs = attrs + [encode_nested(WGDEVICE_A_PEERS, chunk)]
+    if chunk or not payloads:
+        payloads.append(encode_genl(WG_CMD_SET_DEVICE, attrs))
+
+    return payloads
+
+
+def parse_config(text):  # pylint: disable=too-many-branches
+    """
+    Parses a WireGuard config file into a tuple of ( interface dict, list of peer dicts )
+    suitable for `encode_set_device()`
+    """
+
+    interface = {}
+    peers = []
+    section = None
+
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1].strip().lower()
+            if section == "peer":
+                peers.append({"allowed_ips": []})
+            continue
+
+        key, sep, value = line.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid line in config: {line}")
+
+        key = key.strip().lower()
+        value = value.strip()
+
+        if section == "interface":
+            if key == "privatekey":
+                interface["private_key"] = value
+            elif key == "listenport":
+                interface["listen_port"] = int(value)
+            elif key == "fwmark":
+                interface["fwmark"] = 0 if value == "off" else int(value, 0)
+            elif key not in WG_QUICK_KEYS:
+                raise ValueError(f"Unknown [Interface] key in config: {key}")
+
+        elif section == "peer":
+            peer = peers[-1]
+            if key == "publickey":
+                peer["public_key"] = value
+            elif key == "presharedkey":
+                peer["preshared_key"] = value
+            elif key == "endpoint":
+                peer["endpoint"] = value
+            elif key == "persistentkeepalive":
+                peer["persistent_keepalive"] = 0 if value == "off" else int(value)
+            elif key == "allowedips":
+                peer["allowed_ips"].extend(
+                    net.strip() for net in value.split(",") if net.strip()
+                )
+            else:
+                raise ValueError(f"Unknown [Peer] key in config: {key}")
+
+        else:
+            raise ValueError(f"Config value outside of a section: {line}")
+
+    for peer in peers:
+        if "public_key" not in peer:
+            raise ValueError("Every [Peer] section requires a PublicKey")
+
+    return (interface, peers)
+
+
+class NetlinkSocket:
+    """
+    A minimal generic netlink request/response client
+
+    Any object with the `send()` and `recv()` methods of a socket may be provided, which
+    allows using this without the kernel, eg: in tests.
+    """
+
+    def __init__(self, sock=None):
+        self._sock = sock
+        self._seq = 0
+        self._families = {}
+
+    @property
+    def sock(self):
+        """
+        Returns the underlying socket, opening it on first use
+        """
+
+        if self._sock is None:
+            # pylint: disable-next=no-member
+            self._sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC
+            )
+            self._sock.bind((0, 0))
+
+        return self._sock
+
+    def close(self):
+        """
+        Closes the underlying socket
+        """
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, msg_type, payload, dump=False):
+        """
+        Sends a request, and returns the list of payloads of the response messages
+
+        Raises NetlinkError if the kernel reports an error for this request.
+        """
+
+        self._seq += 1
+        seq = self._seq
+        flags = NLM_F_REQUEST | (NLM_F_DUMP if dump else NLM_F_ACK)
+        self.sock.send(encode_message(msg_type, flags, seq, payload))
+
+        payloads = []
+        while True:
+            for resp_type, _, resp_seq, resp_payload in decode_messages(
+                self.sock.recv(RECV_BUFFER_SIZE)
+            ):
+                if resp_seq != seq or resp_type == NLMSG_NOOP:
+                    continue
+
+                if resp_type in (NLMSG_ERROR, NLMSG_DONE):
+                    error = 0
+                    if len(resp_payload) >= 4:
+                        (error,) = struct.unpack_from("=i", resp_payload)
+                    if error:
+                        raise NetlinkError(-error, os.strerror(-error))
+                    return payloads
+
+                payloads.append(resp_payload)
+
+    def family_id(self, name):
+        """
+        Returns the (cached) generic netlink family ID for the given family name
+        """
+
+        if name not in self._families:
+            payloads = self.request(
+                GENL_ID_CTRL,
+                encode_genl(
+                    CTRL_CMD_GETFAMILY,
+                    [encode_attr(CTRL_ATTR_FAMILY_NAME, name.encode("utf-8") + b"\0")],
+                    version=1,
+                ),
+            )
+            for payload in payloads:
+                _, data = decode_genl(payload)
+                for attr_type, value in decode_attrs(data):
+                    if attr_type == CTRL_ATTR_FAMILY_ID:
+                        (self._families[name],) = struct.unpack("=H", value)
+
+            if name not in self._families:
+                raise NetlinkError(f"Generic netlink family not found: {name}")
+
+        return self._families[name]
+
+    def get_device(self, ifname):
+        """
+        Returns the decoded WireGuard device dict for the given interface name
+        """
+
+        payload = encode_genl(
+            WG_CMD_GET_DEVICE,
+            [encode_attr(WGDEVICE_A_IFNAME, ifname.encode("utf-8") + b"\0")],
+        )
+        return decode_device(
+            self.request(self.family_id(WG_GENL_NAME), payload, dump=True)
+        )
+
+    def set_device(self, ifname, **kwargs):
+        """
+        Configures the WireGuard device of the given interface name, returning the number
+        of requests that were needed
+
+        Accepts the keyword arguments of `encode_set_device()`.
+        """
+
+        family = self.family_id(WG_GENL_NAME)
+        payloads = encode_set_device(ifname, **kwargs)
+        for payload in payloads:
+            self.request(family, payload)
+
+        return len(payloads)
+
+
+def _dump_value(value, empty="(none)"):
+    """
+    Formats a decoded value in the same way as `wg show <interface> dump`
+    """
+
+    return empty if value in [None, False, "", []] else str(value)
+
+
+def _peer_row(interface, peer):
+    """
+    Returns the PeerRow of a decoded peer dict, as `wg show <interface> dump` has it
+    """
+
+    return PeerRow(
+        interface,
+        peer["public_key"],
+        _dump_value(peer["preshared_key"]),
+        _dump_value(peer["endpoint"]),
+        _dump_value(",".join(peer["allowed_ips"])),
+        str(peer["latest_handshake"]),
+        peer["rx"],
+        peer["tx"],
+        _dump_value(peer["persistent_keepalive"], "off"),
+    )
+
+
+def _format_dump(device):
+    """
+    Formats a device dict in the same way as `wg show <interface> dump`
+    """
+
+    lines = [
+        "\t".join(
+            (
+                _dump_value(device["private_key"]),
+                _dump_value(device["public_key"]),
+                _dump_value(device["listen_port"], "0"),
+                _dump_value(device["fwmark"], "off"),
+            )
+        )
+    ]
+    for peer in device["peers"]:
+        row = _peer_row(None, peer)
+        lines.append("\t".join(str(field) for field in row[1:]))
+
+    return "\n".join(lines) + "\n"
+
+
+class NetlinkInterface(Interface):
+    """
+    A currently configured WireGuard interface, queried and configured over netlink
+
+    Bringing the interface up or down still relies on `wg-quick`.
+    """
+
+    netlink = None
+
+    def __init__(self, interface, sock=None, cache_ttl=None):
+        super().__init__(interface, cache_ttl=cache_ttl)
+        self.netlink = NetlinkSocket(sock)
+
+    def get_device(self):
+        """
+        Returns the decoded state of the WireGuard device
+        """
+        return self.netlink.get_device(self.interface)
+
+    def set_device(self, **kwargs):
+        """
+        Configures the WireGuard device. See `encode_set_device()`
+        """
+        return self.netlink.set_device(self.interface, **kwargs)
+
+    def public_key(self):
+        """
+        Return the interface's public key
+        """
+        return self.get_device()["public_key"]
+
+    def dump(self):
+        """
+        Returns the machine-parsable state of the WireGuard interface, in the same format
+        as `wg show <interface> dump`
+        """
+
+        return subprocess.CompletedProcess(
+            ["wg", "show", self.interface, "dump"],
+            0,
+            stdout=_format_dump(self.get_device()),
+            stderr="",
+        )
+
+    def _iter_rows(self):
+        """
+        Yields a PeerRow for each of the configured peers of the interface
+        """
+
+        for peer in self.get_device()["peers"]:
+            yield _peer_row(self.interface, peer)
+
+    def peers(self):
+        """
+        Returns the peers' public keys for this interface
+        """
+        return [self.peer(row.peer) for row in self.iter_stats()]
+
+    def sync(self, config_file):
+        """
+        Sync the configuration of the WireGuard interface with the given config file,
+        without disrupting the sessions of unchanged peers, as per `wg syncconf`
+        """
+
+        with open(config_file, encoding="utf-8") as conf_fh:
+            interface, peers = parse_config(conf_fh.read())
+
+        wanted = {peer["public_key"] for peer in peers}
+        for peer in peers:
+            peer.setdefault("preshared_key", None)
+            peer.setdefault("persistent_keepalive", 0)
+            peer["replace_allowed_ips"] = True
+
+        for data in self.get_device()["peers"]:
+            if data["public_key"] not in wanted:
+                peers.append({"public_key": data["public_key"], "remove": True})
+
+        interface.setdefault("private_key", "")
+        interface.setdefault("listen_port", 0)
+        interface.setdefault("fwmark", 0)
+
+        try:
+            return self.set_device(peers=peers, **interface)
+        finally:
+            self.invalidate()
+
+    def add(self, config_file):
+        """
+        Add the given config file's directives to the WireGuard interface
+        """
+
+        with open(config_file, encoding="utf-8") as conf_fh:
+            interface, peers = parse_config(conf_fh.read())
+
+        try:
+            return self.set_device(peers=peers, **interface)
+        finally:
+            self.invalidate()
+
+    def _apply_changes(self, changes):
+        """
+        Applies the changes from `diff()` with as few set-device requests as possible,
+        returning the number of requests
+        """
+
+        for change in changes:
+            if "allowed_ips" in change:
+                change["replace_allowed_ips"] = True
+
+        return self.set_device(peers=changes)
@@ -1,4 +1,9 @@
+# pylint: disable=too-many-lines
+
+import itertools
 import json
+import warnings
+import weakref
 
 from subnet import (
     ip_address,
@@ -7,7 +12,10 @@ from subnet import (
     IPv6Address,
 )
 
-from .config import Config
+from .config import (
+    _UNALLOCATED,
+    Config,
+)
 from .constants import (
     INTERFACE,
     KEEPALIVE_MINIMUM,
@@ -19,23 +27,47 @@ from .utils import (
     find_ip_and_subnet,
     public_key as nacl_public_key,
     ClassedSet,
+    extend_error,
     IPAddressSet,
     IPNetworkSet,
     JSONEncoder,
+    split_endpoint,
 )
 
+# The revisions of every PeerSet are drawn from this counter, so that they are unique
+# across sets
+_REVISIONS = itertools.count(1)
 
-class PeerSet(ClassedSet):
+
+class PeerSet(ClassedSet):  # pylint: disable=too-many-public-methods
     """
-    A set of Peer objects
+    A set of Peer objects, keyed by their public keys
+
+    A peer's identity in this set is its public key: membership can be checked by key
+    or by Peer in O(1), and a second peer with the same public key is rejected. A peer's
+    key must not be changed while it is in a set, as with the keys of a dict.
     """
 
+    # The peers by public key, and the weakly referenced ones (see `add_weak()`), along
+    # with the keys of every weakly referenced peer that was not discarded
+    _keys = None
+    _weak = None
+    _weak_keys = None
+    _revision = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._keys = {}
+        self._revision = next(_REVISIONS)
+        if args or kwargs:
+            self.extend(*args, **kwargs)
+
     def _coerce_value(self, value):
         """
         Bomb if a Peer object is not provided or cannot be coerced from a dict
         """
 
-        if isinstance(value, Peer):
+        if isinstance(value, (Peer, RemotePeer)):
             return value
 
         if isinstance(value, dict):
@@ -44,7 +76,260 @@ class PeerSet(ClassedSet):
             except ValueError as exc:
                 raise ValueError("Provided value must be an instance of Peer") from exc
 
-        raise ValueError("Provided value must be an instance of Peer")
+        raise ValueError("Provided value must be an instance of Peer or RemotePeer")
+
+    def _coerce_values(self, values):
+        """
+        Coerces multiple peers, also reporting public keys that are already used
+        """
+
+        coerced, errors = super()._coerce_values(values)
+
+        keys = {}
+        for peer in coerced:
+            key = peer.public_key
+            if keys.setdefault(key, peer) is not peer or self._conflicts(key, peer):
+                errors.append(f"duplicate public key {key}")
+
+        return coerced, errors
+
+    def _conflicts(self, key, peer):
+        """
+        Returns whether another peer with the given key is already in this set
+        """
+
+        existing = self.get(key)
+        return existing is not None and existing is not peer
+
+    def get(self, key, default=None):
+        """
+        Returns the peer with the given public key, or the default
+        """
+
+        peer = self._keys.get(key)
+        if peer is None and self._weak is not None:
+            peer = self._weak.get(key)
+
+        return default if peer is None else peer
+
+    def add(self, value):
+        """
+        Adds a peer to this collection, rejecting a different peer with the same key
+        """
+
+        if not value:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        peer = self._coerce_value(value)
+        key = peer.public_key
+        if self._conflicts(key, peer):
+            raise ValueError(f"A peer with public key {key} is already present")
+
+        if self._weak is not None:
+            self._weak.pop(key, None)
+            self._weak_keys.discard(key)
+
+        set.add(self, peer)
+        self._keys[key] = peer
+        self._revision = next(_REVISIONS)
+
+    def extend(self, values):
+        """
+        Adds multiple peers to this collection, rejecting duplicate public keys
+        """
+
+        if not values:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        if not isinstance(
+            values,
+            (
+                list,
+                set,
+                tuple,
+            ),
+        ):
+            values = [values]
+
+        coerced, errors = self._coerce_values(values)
+        if errors:
+            raise extend_error(self.__class__.__name__, errors)
+
+        for peer in coerced:
+            self.add(peer)
+
+    def add_weak(self, value):
+        """
+        Adds a peer that this collection does not keep alive
+
+        This is for back-references, such as a peer's link to the server it is attached
+        to. The server holds on to the peer, so a strong reference back would create a
+        reference cycle, which only the cyclic garbage collector can free.
+        """
+
+        peer = self._coerce_value(value)
+        key = peer.public_key
+        if self._conflicts(key, peer):
+            raise ValueError(f"A peer with public key {key} is already present")
+
+        if key not in self._keys:
+            if self._weak is None:
+                self._weak = weakref.WeakValueDictionary()
+                self._weak_keys = set()
+            self._weak[key] = peer
+            self._weak_keys.add(key)
+            self._revision = next(_REVISIONS)
+
+    @property
+    def revision(self):
+        """
+        Returns a number that changes whenever peers are added to or discarded from this
+        collection, and that no other collection has
+
+        Weakly referenced peers that are freed do not change it.
+        """
+
+        return self._revision
+
+    def collected(self):
+        """
+        Returns the public keys of the weakly referenced peers that have since been freed
+
+        They silently dropped out of this collection, eg. a client's link to a Server that
+        nothing else referred to anymore.
+        """
+
+        if not self._weak_keys:
+            return []
+
+        return sorted(key for key in self._weak_keys if key not in self._weak)
+
+    def _key_of(self, value):
+        """
+        Returns the public key of a peer, or the given value if it is a key already
+        """
+
+        if isinstance(value, (Peer, RemotePeer)):
+            return value.public_key
+
+        return value
+
+    def __iter__(self):
+        yield from super().__iter__()
+        if self._weak:
+            yield from list(self._weak.values())
+
+    def __len__(self):
+        return super().__len__() + (len(self._weak) if self._weak else 0)
+
+    def __contains__(self, value):
+        try:
+            return self.get(self._key_of(value)) is not None
+        except TypeError:
+            return False
+
+    def discard(self, value):
+        try:
+            key = self._key_of(value)
+            peer = self._keys.pop(key, None)
+        except TypeError:
+            return
+
+        if peer is not None:
+            set.discard(self, peer)
+            self._revision = next(_REVISIONS)
+        elif self._weak is not None:
+            if self._weak.pop(key, None) is not None:
+                self._revision = next(_REVISIONS)
+            self._weak_keys.discard(key)
+
+    def remove(self, value):
+        if value not in self:
+            raise KeyError(value)
+
+        self.discard(value)
+
+    def clear(self):
+        super().clear()
+        self._keys.clear()
+        self._weak = None
+        self._weak_keys = None
+        self._revision = next(_REVISIONS)
+
+    # The remaining `set` mutators would bypass the public key index, so they are all
+    # implemented on top of `add()`/`extend()`/`discard()`
+
+    def pop(self):
+        for peer in self:
+            self.discard(peer)
+            return peer
+
+        raise KeyError("pop from an empty set")
+
+    def update(self, *others):
+        for other in others:
+            other = list(other)
+            if other:
+                self.extend(other)
+
+    def difference_update(self, *others):
+        for other in others:
+            for value in list(other):
+                self.discard(value)
+
+    def intersection_update(self, *others):
+        for other in others:
+            keys = set()
+            for value in other:
+                try:
+                    keys.add(self._key_of(value))
+                except TypeError:
+                    pass
+
+            for peer in list(self):
+                if peer.public_key not in keys:
+                    self.discard(peer)
+
+    def symmetric_difference_update(self, other):
+        added = []
+        for value in list(other):
+            if value in self:
+                self.discard(value)
+            else:
+                added.append(value)
+
+        if added:
+            self.extend(added)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def copy(self):
+        """
+        Returns a PeerSet with the same peers, holding the same peers weakly
+        """
+
+        copied = self.__class__()
+        for peer in self._keys.values():
+            copied.add(peer)
+        if self._weak:
+            for peer in list(self._weak.values()):
+                copied.add_weak(peer)
+
+        return copied
 
     def discard_by_description(self, description):
         """
@@ -128,47 +413,88 @@ class PeerSet(ClassedSet):
         Remove a peer by public key
         """
 
-        for peer in self:
-            if peer.public_key == key:
-                self.remove(peer)
-                return
+        if key not in self:
+            raise KeyError(key)
 
-        raise KeyError(key)
+        self.discard(key)
 
 
-class Peer:  # pylint: disable=too-many-instance-attributes
+class Peer:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     The Peer Class
 
     This is the main type of WireGuard object, representing both a server and a client
+
+    A peer created by (or added to) a Server only refers to that server weakly, so that
+    the two are not in a reference cycle. Keep a reference to the Server for as long as
+    its peers' configs are rendered: once it is freed, it silently drops out of their
+    `peers`, and rendering their config warns that the server's section is missing.
     """
 
-    description = None
-    _comments = None
-    _endpoint = None
-    _interface = None
-    _ipv6_address = None
-    _ipv4_address = None
-    _port = None
-    _private_key = None
-    _public_key = None
-    _keepalive = None
-    allowed_ips = None
-    save_config = None
-    dns = None
-    pre_up = None
-    post_up = None
-    pre_down = None
-    post_down = None
-    _mtu = None
-    _table = None
-
-    _config = None
-    _service = None
-    peers = None
-
-    _config_cls = None
-    _service_cls = None
+    # Slotted, as a server can have a very large number of peers. Subclasses that do not
+    # declare their own `__slots__` still get a `__dict__` for any extra attributes.
+    __slots__ = (
+        "description",
+        "_comments",
+        "_endpoint",
+        "_interface",
+        "_ipv6_address",
+        "_ipv4_address",
+        "_port",
+        "_private_key",
+        "_public_key",
+        "_derived_keys",
+        "preshared_key",
+        "_keepalive",
+        "allowed_ips",
+        "save_config",
+        "_dns",
+        "_pre_up",
+        "_post_up",
+        "_pre_down",
+        "_post_down",
+        "_mtu",
+        "_table",
+        "_service",
+        "peers",
+        "_config_cls",
+        "_service_cls",
+        "__weakref__",
+    )
+
+    def _init_slots(self):  # pylint: disable=attribute-defined-outside-init
+        """
+        Sets the attributes of a Peer to their defaults
+
+        With `__slots__`, there are no class level defaults to fall back on, so this has
+        to happen before anything reads them.
+        """
+
+        self.description = None
+        self._comments = None
+        self._endpoint = None
+        self._interface = None
+        self._ipv6_address = None
+        self._ipv4_address = None
+        self._port = None
+        self._private_key = None
+        self._public_key = None
+        self._derived_keys = None
+        self.preshared_key = None
+        self._keepalive = None
+        self.allowed_ips = None
+        self.save_config = None
+        self._dns = _UNALLOCATED
+        self._pre_up = _UNALLOCATED
+        self._post_up = _UNALLOCATED
+        self._pre_down = _UNALLOCATED
+        self._post_down = _UNALLOCATED
+        self._mtu = None
+        self._table = None
+        self._service = None
+        self.peers = None
+        self._config_cls = None
+        self._service_cls = None
 
     # pylint: disable=too-many-locals,too-many-branches,too-many-statements,too-many-arguments
     def __init__(
@@ -198,13 +524,11 @@ class Peer:  # pylint: disable=too-many-instance-attributes
         service_cls=None,
     ):
 
+        self._init_slots()
+
+        # The DNS servers and hooks are only allocated when used, see their properties
         self.allowed_ips = IPNetworkSet()
-        self.dns = IPAddressSet()
         self.peers = PeerSet()
-        self.pre_up = []
-        self.post_up = []
-        self.pre_down = []
-        self.post_down = []
 
         self.description = description
         self.comments = comments
@@ -346,20 +670,24 @@ class Peer:  # pylint: disable=too-many-instance-attributes
                 }
             )
 
+        # The unused DNS and hook collections are not allocated just to be dumped
+        def collection(value, empty):
+            return empty() if value is _UNALLOCATED else value
+
         yield from {
             "address": self.address,
             "allowed_ips": self.allowed_ips,
             "description": self.description,
-            "dns": self.dns,
+            "dns": collection(self._dns, IPAddressSet),
             "endpoint": self.endpoint,
             "interface": self.interface,
             "keepalive": self.keepalive,
             "mtu": self.mtu,
             "peers": peers,
-            "post_down": self.post_down,
-            "post_up": self.post_up,
-            "pre_down": self.pre_down,
-            "pre_up": self.pre_up,
+            "post_down": collection(self._post_down, list),
+            "post_up": collection(self._post_up, list),
+            "pre_down": collection(self._pre_down, list),
+            "pre_up": collection(self._pre_up, list),
             "preshared_key": self.preshared_key,
             "private_key": self.private_key,
             "public_key": self.public_key,
@@ -388,9 +716,104 @@ class Peer:  # pylint: disable=too-many-instance-attributes
         # Since we don't care if the peer is already gone, we are using `.discard()`
         # instead of `.remove()` here.
         self.peers.discard(peer)
-        if bidirectional:
+        if bidirectional and not isinstance(peer, RemotePeer):
             peer.peers.discard(self)
 
+    @property
+    def dns(self):
+        """
+        Returns the DNS servers set
+        """
+
+        if self._dns is _UNALLOCATED:
+            self._dns = IPAddressSet()
+
+        return self._dns
+
+    @dns.setter
+    def dns(self, value):
+        """
+        Sets the DNS servers set
+        """
+
+        self._dns = value
+
+    @property
+    def pre_up(self):
+        """
+        Returns the PreUp commands list
+        """
+
+        if self._pre_up is _UNALLOCATED:
+            self._pre_up = []
+
+        return self._pre_up
+
+    @pre_up.setter
+    def pre_up(self, value):
+        """
+        Sets the PreUp commands list
+        """
+
+        self._pre_up = value
+
+    @property
+    def post_up(self):
+        """
+        Returns the PostUp commands list
+        """
+
+        if self._post_up is _UNALLOCATED:
+            self._post_up = []
+
+        return self._post_up
+
+    @post_up.setter
+    def post_up(self, value):
+        """
+        Sets the PostUp commands list
+        """
+
+        self._post_up = value
+
+    @property
+    def pre_down(self):
+        """
+        Returns the PreDown commands list
+        """
+
+        if self._pre_down is _UNALLOCATED:
+            self._pre_down = []
+
+        return self._pre_down
+
+    @pre_down.setter
+    def pre_down(self, value):
+        """
+        Sets the PreDown commands list
+        """
+
+        self._pre_down = value
+
+    @property
+    def post_down(self):
+        """
+        Returns the PostDown commands list
+        """
+
+        if self._post_down is _UNALLOCATED:
+            self._post_down = []
+
+        return self._post_down
+
+    @post_down.setter
+    def post_down(self, value):
+        """
+        Sets the PostDown commands list
+        """
+
+        self._post_down = value
+
     @property
     def comments(self):
         """
@@ -601,7 +1024,13 @@ class Peer:  # pylint: disable=too-many-instance-attributes
             return self._public_key
 
         if self._private_key is not None:
-            return nacl_public_key(self._private_key)
+            # Deriving the key is expensive, and it is looked up for every set membership
+            if self._derived_keys is None or self._derived_keys[0] != self._private_key:
+                self._derived_keys = (
+                    self._private_key,
+                    nacl_public_key(self._private_key),
+                )
+            return self._derived_keys[1]
 
         raise AttributeError("Neither public key not private key are set!")
 
@@ -755,10 +1184,19 @@ class Peer:  # pylint: disable=too-many-instance-attributes
         Return the wireguard config file for this peer
         """
 
-        if not isinstance(self._config, self.config_cls.__class__):
-            self._config = self.config_cls(self)
+        collected = self.peers.collected() if isinstance(self.peers, PeerSet) else []
+        if collected:
+            warnings.warn(
+                f"{self!r} was linked to peer(s) that have since been freed, so they are "
+                f"missing from its config: {', '.join(collected)}. Keep a reference to "
+                "the Server while rendering the configs of its peers.",
+                RuntimeWarning,
+                stacklevel=2,
+            )
 
-        return self._config
+        # Not kept on the peer, as the config refers back to the peer. That reference cycle
+        # would leave freeing every peer to the cyclic garbage collector.
+        return self.config_cls(self)
 
     @property
     def service(self):
@@ -792,3 +1230,161 @@ class Peer:  # pylint: disable=too-many-instance-attributes
 
         self.post_up.extend(post_up)
         self.post_down.extend(post_down)
+
+
+class RemotePeer:
+    """
+    A lightweight, immutable record of a peer attached to a Server
+
+    It only holds what a server's config needs to render the peer, without the peer's
+    own peers, hooks, DNS servers or private key. Use `to_peer()` (or
+    `Server.upgrade_peer()`) when the full Peer is needed, eg. to render its own config.
+    """
+
+    __slots__ = (
+        "description",
+        "public_key",
+        "ipv4",
+        "ipv6",
+        "allowed_ips",
+        "preshared_key",
+        "endpoint",
+        "config_cls",
+        "__weakref__",
+    )
+
+    # Attributes of a full Peer that a remote peer never has
+    private_key = None
+    comments = None
+    keepalive = None
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        description,
+        public_key,
+        address,
+        *,
+        allowed_ips=None,
+        preshared_key=None,
+        endpoint=None,
+        config_cls=None,
+    ):
+        if not public_key:
+            raise ValueError("A remote peer must have a public key")
+
+        if not isinstance(address, (list, set, tuple)):
+            address = [address]
+        address = [value for value in address if value]
+        if not address:
+            raise ValueError("A remote peer must have an address")
+
+        ipv4 = None
+        ipv6 = None
+        for value in address:
+            ip, _ = find_ip_and_subnet(value)  # pylint: disable=invalid-name
+            if ip is None:
+                raise ValueError(
+                    f"'{value}' does not appear to be an IPv4 or IPv6 address"
+                )
+
+            if ip.version == 4:
+                if ipv4:
+                    raise ValueError("Cannot set a 2nd IPv4 address.")
+                ipv4 = ip
+            else:
+                if ipv6:
+                    raise ValueError("Cannot set a 2nd IPv6 address.")
+                ipv6 = ip
+
+        # As with a full Peer, the peer's own addresses are always allowed
+        networks = IPNetworkSet()
+        networks.extend([ip_network(ip) for ip in (ipv4, ipv6) if ip is not None])
+        if allowed_ips:
+            networks.extend(allowed_ips)
+
+        for name, value in (
+            ("description", description),
+            ("public_key", public_key),
+            ("ipv4", ipv4),
+            ("ipv6", ipv6),
+            ("allowed_ips", tuple(networks)),
+            ("preshared_key", preshared_key),
+            ("endpoint", endpoint),
+            ("config_cls", Config if config_cls in [None, False] else config_cls),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __repr__(self):
+        """
+        A simplistic representation of this object
+        """
+
+        return f"<{self.__class__.__name__} address={self.address}>"
+
+    @classmethod
+    def from_peer(cls, peer):
+        """
+        Returns the remote peer record of a full Peer
+        """
+
+        return cls(
+            peer.description,
+            peer.public_key,
+            peer.address,
+            allowed_ips=list(peer.allowed_ips),
+            preshared_key=peer.preshared_key,
+            endpoint=peer.endpoint,
+            config_cls=peer.config_cls,
+        )
+
+    @property
+    def address(self):
+        """
+        Returns the address(es) for this peer
+        """
+
+        # pylint: disable-next=no-member
+        return [ip for ip in (self.ipv4, self.ipv6) if ip is not None]
+
+    @property
+    def config(self):
+        """
+        Returns the config for rendering this peer into a server's config file
+        """
+
+        return self.config_cls(self)  # pylint: disable=no-member,not-callable
+
+    def to_peer(self, *, peer_cls=None, **kwargs):
+        """
+        Returns a full Peer with the values of this record
+
+        Any keyword arguments are passed on to the Peer, eg. to set its private key.
+        """
+
+        # The slots are assigned through `object.__setattr__()`, which pylint cannot see
+        # pylint: disable=no-member
+
+        if peer_cls in [None, False]:
+            peer_cls = Peer
+
+        if self.endpoint and "port" not in kwargs:
+            # A Peer's endpoint is rendered with its own port
+            port = split_endpoint(self.endpoint)[1]
+            if port is not None:
+                kwargs["port"] = port
+
+        kwargs.setdefault("allowed_ips", list(self.allowed_ips))
+        kwargs.setdefault("preshared_key", self.preshared_key)
+        kwargs.setdefault("endpoint", self.endpoint)
+        kwargs.setdefault("config_cls", self.config_cls)
+        if "private_key" not in kwargs:
+            kwargs["public_key"] = self.public_key
+
+        return peer_cls(self.description, address=self.address, **kwargs)
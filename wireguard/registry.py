@@ -0,0 +1,646 @@
+"""
+wireguard.registry
+
+A Server whose peers are kept in an SQLite database, rather than in memory
+"""
+
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+from subnet import (
+    ip_address,
+    IPv4Address,
+    IPv6Address,
+)
+
+from .constants import (
+    REGISTRY_BATCH_SIZE,
+    REGISTRY_TIMEOUT,
+)
+from .peer import PeerSet, RemotePeer
+from .server import Server
+from .utils import (
+    extend_error,
+    PrefixTrie,
+)
+
+# The public key is the primary key, so it is indexed already. SQLite treats NULLs as
+# distinct, so the unique address indexes allow any number of IPv4-only or IPv6-only peers.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS peers (
+    public_key TEXT PRIMARY KEY NOT NULL,
+    description TEXT,
+    ipv4 TEXT,
+    ipv6 TEXT,
+    allowed_ips TEXT NOT NULL,
+    preshared_key TEXT,
+    endpoint TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS peers_ipv4 ON peers (ipv4);
+CREATE UNIQUE INDEX IF NOT EXISTS peers_ipv6 ON peers (ipv6);
+CREATE INDEX IF NOT EXISTS peers_description ON peers (description);
+"""
+
+COLUMNS = (
+    "public_key",
+    "description",
+    "ipv4",
+    "ipv6",
+    "allowed_ips",
+    "preshared_key",
+    "endpoint",
+)
+
+_SELECT = f"SELECT {', '.join(COLUMNS)} FROM peers"
+
+
+def peer_row(peer):
+    """
+    Returns the database row of a Peer or RemotePeer
+    """
+
+    return (
+        peer.public_key,
+        peer.description,
+        str(peer.ipv4) if peer.ipv4 else None,
+        str(peer.ipv6) if peer.ipv6 else None,
+        ",".join(str(network) for network in peer.allowed_ips),
+        peer.preshared_key,
+        peer.endpoint,
+    )
+
+
+def row_peer(row):
+    """
+    Returns the RemotePeer of a database row
+    """
+
+    # pylint: disable-next=redefined-outer-name
+    public_key, description, ipv4, ipv6, allowed_ips, preshared_key, endpoint = row
+    return RemotePeer(
+        description,
+        public_key,
+        [ip for ip in (ipv4, ipv6) if ip],
+        allowed_ips=allowed_ips.split(",") if allowed_ips else None,
+        preshared_key=preshared_key,
+        endpoint=endpoint,
+    )
+
+
+class PeerRegistry:
+    """
+    The peers of a single server, stored in an SQLite database
+
+    Every change runs in a transaction. `transaction()` groups several changes (and the
+    checks leading up to them) into one, which other writers to the same database wait
+    on, instead of racing it. A nested transaction is a savepoint, which only undoes its
+    own changes when it fails.
+    """
+
+    path = None
+
+    def __init__(self, path=":memory:", timeout=None):
+        self.path = path
+        self._connection = sqlite3.connect(
+            path,
+            timeout=REGISTRY_TIMEOUT if timeout is None else timeout,
+            isolation_level=None,  # Transactions are managed by `transaction()`
+            check_same_thread=False,
+        )
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._changes = 0
+        self._undo = []
+
+        if path != ":memory:":
+            # Readers do not block the writer, nor the other way around
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} path={self.path}>"
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+
+        self._connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed changes in a single transaction, which may be nested
+        """
+
+        with self._lock:
+            outermost = not self._depth
+            if outermost:
+                # IMMEDIATE takes the write lock up front, so that nothing read within
+                # the transaction can be changed by another writer before it commits
+                changes = self._connection.total_changes
+                begin, commit, rollback = "BEGIN IMMEDIATE", ["COMMIT"], ["ROLLBACK"]
+            else:
+                name = f"nested_{self._depth}"
+                begin = f"SAVEPOINT {name}"
+                commit = [f"RELEASE {name}"]
+                rollback = [f"ROLLBACK TO {name}", f"RELEASE {name}"]
+
+            undo = len(self._undo)
+            self._connection.execute(begin)
+            self._depth += 1
+            try:
+                yield self._connection
+            except BaseException:
+                for statement in rollback:
+                    self._connection.execute(statement)
+                self._run_undo(undo)
+                raise
+            else:
+                for statement in commit:
+                    self._connection.execute(statement)
+            finally:
+                self._depth -= 1
+                if outermost:
+                    self._undo = []
+                    # Only writes change the revision, even when they were rolled back,
+                    # as what was read in the meantime may have been cached
+                    if self._connection.total_changes != changes:
+                        self._changes += 1
+
+    def _run_undo(self, start):
+        """
+        Calls the undo callbacks registered since the given position, latest first
+        """
+
+        callbacks = self._undo[start:]
+        del self._undo[start:]
+        for callback in reversed(callbacks):
+            callback()
+
+    def on_rollback(self, callback):
+        """
+        Registers a callback to undo in-memory state, should the changes made so far in
+        the current transaction be rolled back
+
+        Outside of a transaction, the changes are already committed, so this does nothing.
+        """
+
+        with self._lock:
+            if self._depth:
+                self._undo.append(callback)
+
+    @property
+    def revision(self):
+        """
+        Returns a value that changes whenever the stored peers may have changed
+
+        This covers the changes made through other connections to the same database.
+        """
+
+        with self._lock:
+            (data_version,) = self._connection.execute("PRAGMA data_version").fetchone()
+            return data_version, self._changes
+
+    def insert(self, peers):
+        """
+        Stores the given peers, either all of them or none
+        """
+
+        with self.transaction() as connection:
+            try:
+                connection.executemany(
+                    f"INSERT INTO peers ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                    [peer_row(peer) for peer in peers],
+                )
+            except sqlite3.IntegrityError as exc:
+                raise ValueError(
+                    f"Could not store peers, a public key or address is in use: {exc}"
+                ) from exc
+
+    def delete(self, key):
+        """
+        Removes the peer with the given public key, returning whether it was stored
+        """
+
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "DELETE FROM peers WHERE public_key = ?", (key,)
+            )
+            return cursor.rowcount > 0
+
+    def clear(self):
+        """
+        Removes all the stored peers
+        """
+
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM peers")
+
+    def _fetchone(self, query, params):
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()
+
+    def get(self, key):
+        """
+        Returns the row of the peer with the given public key, or None
+        """
+
+        return self._fetchone(f"{_SELECT} WHERE public_key = ?", (key,))
+
+    def find_address(self, ip):  # pylint: disable=invalid-name
+        """
+        Returns the row of the peer with the given IPv4/IPv6 address, or None
+        """
+
+        if not isinstance(ip, (IPv4Address, IPv6Address)):
+            ip = ip_address(ip)
+
+        column = "ipv4" if ip.version == 4 else "ipv6"
+        return self._fetchone(f"{_SELECT} WHERE {column} = ?", (str(ip),))
+
+    def find_description(self, description):
+        """
+        Returns the row of the first peer with the given description, or None
+        """
+
+        return self._fetchone(
+            f"{_SELECT} WHERE description = ? ORDER BY rowid LIMIT 1", (description,)
+        )
+
+    def count(self):
+        """
+        Returns the number of stored peers
+        """
+
+        return self._fetchone("SELECT COUNT(*) FROM peers", ())[0]
+
+    def addresses(self, version):
+        """
+        Returns the IPv4 or IPv6 addresses of the stored peers
+        """
+
+        column = "ipv4" if version == 4 else "ipv6"
+        with self._lock:
+            cursor = self._connection.execute(
+                f"SELECT {column} FROM peers WHERE {column} IS NOT NULL"
+            )
+            return [ip_address(value) for (value,) in cursor]
+
+    def _stream(self, query, batch_size):
+        cursor = self._connection.cursor()
+        with self._lock:
+            cursor.execute(query)
+
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def rows(self, batch_size=None):
+        """
+        Yields the rows of all the stored peers, in the order they were added
+
+        The rows are read from a cursor a batch at a time, so they are never all in
+        memory at once.
+        """
+
+        return self._stream(
+            f"{_SELECT} ORDER BY rowid", batch_size or REGISTRY_BATCH_SIZE
+        )
+
+    def routes(self, batch_size=None):
+        """
+        Yields the ( public key, allowed IPs ) of all the stored peers, in the order they
+        were added
+        """
+
+        for key, allowed_ips in self._stream(
+            "SELECT public_key, allowed_ips FROM peers ORDER BY rowid",
+            batch_size or REGISTRY_BATCH_SIZE,
+        ):
+            yield key, allowed_ips.split(",") if allowed_ips else []
+
+
+class RegistryPeerSet(PeerSet):
+    """
+    A PeerSet whose peers are kept in a PeerRegistry
+
+    Peers are only loaded from the registry when they are looked up or iterated, as
+    RemotePeers. A peer that was added (or loaded) is handed out again for as long as
+    something else keeps it alive, so the same key keeps mapping to the same object.
+    """
+
+    _registry = None
+    _loaded = None
+
+    def __init__(self, registry, *args, **kwargs):
+        self._registry = registry
+        self._loaded = weakref.WeakValueDictionary()
+        super().__init__(*args, **kwargs)
+
+    def _load(self, row):
+        """
+        Returns the peer of a registry row, reusing the peer already loaded for it
+        """
+
+        peer = self._loaded.get(row[0])
+        if peer is None:
+            peer = row_peer(row)
+            self._loaded[row[0]] = peer
+
+        return peer
+
+    def get(self, key, default=None):
+        """
+        Returns the peer with the given public key, or the default
+        """
+
+        row = self._registry.get(key)
+        if row is None:
+            self._loaded.pop(key, None)
+            return default
+
+        return self._load(row)
+
+    def _store(self, peers):
+        """
+        Stores the given peers in the registry, either all of them or none
+        """
+
+        self._registry.insert(peers)
+        for peer in peers:
+            self._loaded[peer.public_key] = peer
+
+        def undo():
+            for peer in peers:
+                if self._loaded.get(peer.public_key) is peer:
+                    del self._loaded[peer.public_key]
+
+        self._registry.on_rollback(undo)
+
+    def add(self, value):
+        """
+        Adds a peer to this collection, rejecting a different peer with the same key
+        """
+
+        if not value:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        peer = self._coerce_value(value)
+        existing = self.get(peer.public_key)
+        if existing is peer:
+            return
+
+        if existing is not None:
+            raise ValueError(
+                f"A peer with public key {peer.public_key} is already present"
+            )
+
+        self._store([peer])
+
+    def extend(self, values):
+        """
+        Adds multiple peers to this collection in a single transaction, rejecting
+        duplicate public keys
+        """
+
+        if not values:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        if not isinstance(
+            values,
+            (
+                list,
+                set,
+                tuple,
+            ),
+        ):
+            values = [values]
+
+        with self._registry.transaction():
+            coerced, errors = self._coerce_values(values)
+            if errors:
+                raise extend_error(self.__class__.__name__, errors)
+
+            self._store(
+                [
+                    peer
+                    for peer in coerced
+                    if self._loaded.get(peer.public_key) is not peer
+                ]
+            )
+
+    def add_weak(self, value):
+        """
+        Adds a peer, which is never kept alive by this collection anyway
+        """
+
+        self.add(value)
+
+    def __iter__(self):
+        for row in self._registry.rows():
+            yield self._load(row)
+
+    def __len__(self):
+        return self._registry.count()
+
+    def discard(self, value):
+        try:
+            key = self._key_of(value)
+        except TypeError:
+            return
+
+        if isinstance(key, str) and self._registry.delete(key):
+            peer = self._loaded.pop(key, None)
+            if peer is not None:
+                self._registry.on_rollback(lambda: self._loaded.setdefault(key, peer))
+
+    def clear(self):
+        self._registry.clear()
+        loaded = self._loaded
+        self._loaded = weakref.WeakValueDictionary()
+        self._registry.on_rollback(lambda: setattr(self, "_loaded", loaded))
+
+    def copy(self):
+        """
+        Returns an in-memory PeerSet of the stored peers
+        """
+
+        copied = PeerSet()
+        for peer in self:
+            copied.add(peer)
+
+        return copied
+
+    def remove_by_description(self, description):
+        """
+        Remove a peer by description
+        """
+
+        row = self._registry.find_description(description)
+        if row is None:
+            raise KeyError(description)
+
+        self.discard(row[0])
+
+    def remove_by_ip(self, ip):
+        """
+        Remove a peer by ip
+        """
+
+        row = self._registry.find_address(ip)
+        if row is None:
+            raise KeyError(ip)
+
+        self.discard(row[0])
+
+
+class RegistryServer(Server):
+    """
+    A WireGuard Server whose peers are kept in a PeerRegistry
+
+    Finding a peer, or an address in use, is an indexed query, so a server with a large
+    number of peers neither has to be rebuilt in memory, nor render its whole config at
+    once. Adding, upgrading and removing a peer each run in a single transaction, so
+    several processes can safely share the same database.
+
+    Peers come back from the registry as RemotePeers: full Peers are only kept in memory
+    while something else holds on to them.
+    """
+
+    __slots__ = (
+        "registry",
+        "_routes_revision",
+    )
+
+    def __init__(self, description, subnet, *, registry=None, **kwargs):
+        if registry is None:
+            registry = PeerRegistry()
+        elif not isinstance(registry, PeerRegistry):
+            registry = PeerRegistry(registry)
+
+        # Addresses are picked against the registry while the Server is initialized
+        self.registry = registry
+        self._routes_revision = None
+
+        peers = kwargs.pop("peers", None)
+        super().__init__(description, subnet, **kwargs)
+
+        self.peers = RegistryPeerSet(registry)
+        self._routes = None  # Indexed on the first lookup, see `route_lookup()`
+
+        if peers:
+            if not isinstance(peers, (list, set, tuple)):
+                peers = [peers]
+            with registry.transaction():
+                for peer in peers:
+                    self.add_peer(peer)
+
+    def address_exists_ipv4(self, item):
+        """
+        Checks an IPv4 address against the addresses already used by this server and it's peers
+        """
+
+        if not isinstance(item, IPv4Address):
+            item = ip_address(item)
+
+        if item == self.ipv4:
+            return True
+
+        return self.registry.find_address(item) is not None
+
+    def address_exists_ipv6(self, item):
+        """
+        Checks an IPv6 address against the addresses already used by this server and it's peers
+        """
+
+        if not isinstance(item, IPv6Address):
+            item = ip_address(item)
+
+        if item == self.ipv6:
+            return True
+
+        return self.registry.find_address(item) is not None
+
+    @property
+    def peers_addresses_ipv4(self):
+        """
+        Returns all the IPv4 addresses for the peers attached to this server
+        """
+
+        return self.registry.addresses(4)
+
+    @property
+    def peers_addresses_ipv6(self):
+        """
+        Returns all the IPv6 addresses for the peers attached to this server
+        """
+
+        return self.registry.addresses(6)
+
+    def add_peer(self, peer, max_address_retries=None, max_privkey_retries=None):
+        """
+        Adds a peer to this server, in a single transaction with its uniqueness checks
+        """
+
+        with self.registry.transaction():
+            super().add_peer(
+                peer,
+                max_address_retries=max_address_retries,
+                max_privkey_retries=max_privkey_retries,
+            )
+
+    def upgrade_peer(self, peer, **kwargs):
+        """
+        Replaces a RemotePeer of this server with the full Peer, in a single transaction
+        """
+
+        with self.registry.transaction():
+            return super().upgrade_peer(peer, **kwargs)
+
+    def remove_peer(self, peer, *, bidirectional=True):
+        """
+        Removes the given peer from this server
+        """
+
+        with self.registry.transaction():
+            super().remove_peer(peer, bidirectional=bidirectional)
+
+    def update_routes(self, peer):
+        """
+        Marks the routes as out of date, to be indexed again on the next lookup
+        """
+
+        self._routes = None
+
+    def route_lookup(self, ip):  # pylint: disable=invalid-name
+        """
+        Returns the peer that traffic for the given IP would be routed to, or None
+
+        The routes are indexed by public key from the registry, and indexed again after
+        any change to it, including the changes made by other processes.
+        """
+
+        revision = self.registry.revision
+        if self._routes is None or self._routes_revision != revision:
+            routes = PrefixTrie()
+            for key, allowed_ips in self.registry.routes():
+                for network in allowed_ips:
+                    routes.insert(network, key)
+
+            self._routes = routes
+            self._routes_revision = revision
+
+        for _, keys in self._routes.matches(ip):
+            for key in reversed(keys):
+                peer = self.peers.get(key)
+                if peer is not None:
+                    return peer
+
+        return None
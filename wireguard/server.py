@@ -9,9 +9,15 @@ from .constants import (
     MAX_PRIVKEY_RETRIES,
 )
 from .config import ServerConfig
-from .peer import Peer
-from .utils import generate_key, public_key, find_ip_and_subnet
-
+from .peer import Peer, PeerSet, RemotePeer
+from .utils import (
+    audit_networks,
+    generate_key,
+    public_key,
+    find_ip_and_subnet,
+    IPNetworkSet,
+    PrefixTrie,
+)
 
 INHERITABLE_OPTIONS = [
     "dns",
@@ -30,13 +36,29 @@ class Server(Peer):
     While not required to have a server<->client setup, this class simplifies doing so
     """
 
-    ipv4_subnet = None
-    ipv6_subnet = None
+    __slots__ = (
+        "ipv4_subnet",
+        "ipv6_subnet",
+        "_routes",
+        "_routed",
+        "_routed_revision",
+    )
 
     def __init__(
         self, description, subnet, **kwargs
     ):  # pylint: disable=too-many-branches
 
+        self.ipv4_subnet = None
+        self.ipv6_subnet = None
+        self._routes = None
+        self._routed = None
+        self._routed_revision = None
+
+        # Picking addresses from the subnets checks them against the Peer attributes,
+        # before the Peer is initialized
+        self._init_slots()
+        self.peers = PeerSet()
+
         if not isinstance(
             subnet,
             (
@@ -110,6 +132,15 @@ class Server(Peer):
 
         super().__init__(description, **kwargs)
 
+        # Longest-prefix index of the peers' allowed IPs, along with the networks that
+        # are currently indexed for every indexed peer, and the revision of `self.peers`
+        # that they were indexed from
+        self._routes = PrefixTrie()
+        self._routed = {}
+        for peer in self.peers:
+            self.update_routes(peer)
+        self._routed_revision = self.peers.revision
+
     def __repr__(self):
         """
         A simplistic representation of this object
@@ -142,7 +173,7 @@ class Server(Peer):
         if item == self.public_key:
             return True
 
-        return item in self.peers_pubkeys
+        return item in self.peers
 
     def address_exists_ipv4(self, item):
         """
@@ -275,9 +306,12 @@ class Server(Peer):
 
         return private_key
 
-    def peer(self, description, *, peer_cls=None, **kwargs):
+    def peer(self, description, *, peer_cls=None, allowed_ips_exclude=None, **kwargs):
         """
         Returns a peer that is prepopulated with values appropriate for this server
+
+        `allowed_ips_exclude` removes the given network(s) from the `allowed_ips`, eg. to
+        route `0.0.0.0/0` except for a LAN. The peer's own addresses are always allowed.
         """
 
         if peer_cls in [None, False]:
@@ -285,6 +319,16 @@ class Server(Peer):
         elif not callable(peer_cls):
             raise ValueError("Invalid value given for peer_cls")
 
+        if allowed_ips_exclude:
+            if not kwargs.get("allowed_ips"):
+                raise ValueError(
+                    "allowed_ips_exclude requires allowed_ips to exclude from"
+                )
+
+            allowed_ips = IPNetworkSet()
+            allowed_ips.extend(kwargs["allowed_ips"])
+            kwargs["allowed_ips"] = list(allowed_ips.exclude(allowed_ips_exclude))
+
         if "address" not in kwargs:
             kwargs.update({"address": self.unique_address()})
 
@@ -309,8 +353,15 @@ class Server(Peer):
         """
         Adds a peer to this server, checking for a unique IP address + unique private key
         and optionally updating the peer's data to obtain uniqueness
+
+        A RemotePeer is immutable, so it is rejected rather than updated when it is not
+        unique.
         """
 
+        if isinstance(peer, RemotePeer):
+            self._add_remote_peer(peer)
+            return
+
         if self.ipv4_subnet and peer.ipv4:
             if self.address_exists_ipv4(peer.ipv4):
                 try:
@@ -352,5 +403,131 @@ class Server(Peer):
                     "Could not add peer to this server. It is not unique."
                 ) from exc
 
-        peer.peers.add(self)  # This server needs to be a peer of the new peer
+        # This server needs to be a peer of the new peer, but the peer must not keep it
+        # alive, or every peer would be in a reference cycle with the server
+        peer.peers.add_weak(self)
+        revision = self.peers.revision
         self.peers.add(peer)  # The peer needs to be attached to this server
+        self._track_routes(peer, revision)
+
+    def _add_remote_peer(self, peer):
+        """
+        Adds a RemotePeer to this server, which it does not link back to
+        """
+
+        exists = self.pubkey_exists(peer.public_key)
+        if self.ipv4_subnet and peer.ipv4:
+            exists = exists or self.address_exists_ipv4(peer.ipv4)
+        if self.ipv6_subnet and peer.ipv6:
+            exists = exists or self.address_exists_ipv6(peer.ipv6)
+
+        if exists:
+            raise ValueError("Could not add peer to this server. It is not unique.")
+
+        revision = self.peers.revision
+        self.peers.add(peer)
+        self._track_routes(peer, revision)
+
+    # pylint: disable-next=redefined-outer-name
+    def remote_peer(self, description, public_key, *, address=None, **kwargs):
+        """
+        Returns a RemotePeer attached to this server, with an unused address if none is
+        given
+
+        This is much lighter than `peer()` for servers with a large number of peers, as
+        long as the full Peer is not needed on this side.
+        """
+
+        if address is None:
+            address = self.unique_address()
+
+        peer = RemotePeer(description, public_key, address, **kwargs)
+        self.add_peer(peer)
+        return peer
+
+    def upgrade_peer(self, peer, **kwargs):
+        """
+        Replaces a RemotePeer of this server with the full Peer, which is returned
+
+        Any keyword arguments are passed on to `RemotePeer.to_peer()`.
+        """
+
+        if self.peers.get(peer.public_key) is not peer:
+            raise KeyError(peer)
+
+        full_peer = peer.to_peer(**kwargs)
+        self.remove_peer(peer)
+        self.add_peer(full_peer, max_address_retries=False, max_privkey_retries=False)
+        return full_peer
+
+    def remove_peer(self, peer, *, bidirectional=True):
+        """
+        Removes the given peer from this server, along with its routes
+        """
+
+        revision = self.peers.revision
+        super().remove_peer(peer, bidirectional=bidirectional)
+        self._track_routes(peer, revision)
+
+    def _track_routes(self, peer, revision):
+        """
+        Updates the routes of a peer that this server just added or removed, given the
+        revision of `self.peers` before, keeping the index in sync if it was
+        """
+
+        self.update_routes(peer)
+        if self._routed_revision == revision:
+            self._routed_revision = self.peers.revision
+
+    def update_routes(self, peer):
+        """
+        Brings the routes of the given peer up to date with its allowed IPs
+
+        Peers added or removed through this server are kept up to date automatically, but
+        this must be called after changing the allowed IPs of a peer that was already added.
+        """
+
+        attached = self.peers.get(peer.public_key) is peer
+        current = frozenset(peer.allowed_ips) if attached else frozenset()
+        previous = self._routed.pop(peer, frozenset())
+
+        for network in previous - current:
+            self._routes.remove(network, peer)
+        for network in current - previous:
+            self._routes.insert(network, peer)
+
+        if attached:
+            self._routed[peer] = current
+
+    def audit_allowed_ips(self):
+        """
+        Returns the AllowedIPsConflicts between the allowed IPs of this server's peers
+
+        WireGuard does not complain about these: the peer with the most specific (or the
+        most recently configured) allowed IP silently takes the traffic.
+        """
+
+        return audit_networks(
+            (network, peer) for peer in self.peers for network in peer.allowed_ips
+        )
+
+    def route_lookup(self, ip):  # pylint: disable=invalid-name
+        """
+        Returns the peer that traffic for the given IP would be routed to, or None
+
+        As with WireGuard itself, the peer with the longest matching allowed IP wins.
+        """
+
+        # Pick up peers that were added to, or removed from, `self.peers` directly
+        revision = self.peers.revision
+        if self._routed_revision != revision:
+            for peer in set(self._routed).symmetric_difference(self.peers):
+                self.update_routes(peer)
+            self._routed_revision = revision
+
+        for _, peers in self._routes.matches(ip):
+            for peer in reversed(peers):
+                if self.peers.get(peer.public_key) is peer:
+                    return peer
+
+        return None
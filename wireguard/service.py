@@ -8,12 +8,33 @@ NOTE: This functionality requires sufficient privileges to run the wg command
       the web server user. If you do, it is at your own risk.
 """
 
+# pylint: disable=too-many-lines
+
+import heapq
+import os
 import platform
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from subnet import ip_interface
+from subnet import ip_address, ip_interface
 
+from .constants import (
+    HANDSHAKE_TIMEOUT,
+    MAX_COMMAND_LENGTH,
+    PING_TIMEOUT,
+    PORT,
+    STATS_HISTORY,
+    STATS_INTERVAL,
+    VERIFY_CONCURRENCY,
+)
+from .utils.config import split_endpoint
 from .utils.sets import NonStrictIPNetworkSet
 
 
@@ -24,22 +45,189 @@ def _run(cmd):
     return subprocess.run(cmd, text=True, check=True, capture_output=True)
 
 
-class InterfacePeer:
+def _stream(cmd):
     """
-    A peer that is currently configured on the WireGuard interface
+    Run a system command, yielding its output line by line as it is produced
+
+    Raises CalledProcessError once the output is exhausted, if the command failed.
     """
 
-    interface = None
-    peer = None
+    with subprocess.Popen(
+        cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as proc:
+        try:
+            yield from proc.stdout
+        except GeneratorExit:
+            proc.kill()
+            raise
+
+        stderr = proc.stderr.read()
+        if proc.wait():
+            raise subprocess.CalledProcessError(
+                proc.returncode, cmd, output=None, stderr=stderr
+            )
+
+
+# The connection state of an interface peer, and the method that decided it: one of
+# "handshake", "traffic" or "ping", or "unknown" for a peer that was left ambiguous and
+# was not pinged (probing was off, it has no address, or the deadline ran out), which
+# is not considered connected
+ConnectionState = namedtuple("ConnectionState", ["connected", "method"])
+
+_PeerRow = namedtuple(
+    "_PeerRow",
+    [
+        "interface",
+        "peer",
+        "raw_preshared_key",
+        "raw_endpoint",
+        "raw_allowed_ips",
+        "raw_latest_handshake",
+        "rx",
+        "tx",
+        "raw_persistent_keepalive",
+    ],
+)
+
+
+class PeerRow(_PeerRow):
+    """
+    A lightweight row of `wg show <interface> dump` output for a single peer
+
+    Only the rx/tx counters are decoded up front. The other fields are decoded from the
+    raw values each time they are accessed.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_fields(cls, interface, fields):
+        """
+        Returns a row from the split fields of a peer's dump line
+        """
+
+        return cls(
+            interface,
+            fields[0],
+            fields[1],
+            fields[2],
+            fields[3],
+            fields[4],
+            int(fields[5]),
+            int(fields[6]),
+            fields[7],
+        )
+
+    @property
+    def preshared_key(self):
+        """
+        Returns the preshared key, or None
+        """
+        return None if self.raw_preshared_key == "(none)" else self.raw_preshared_key
+
+    @property
+    def endpoint(self):
+        """
+        Returns the endpoint, or None
+        """
+        return None if self.raw_endpoint == "(none)" else self.raw_endpoint
+
+    @property
+    def allowed_ips(self):
+        """
+        Returns the allowed IPs as a NonStrictIPNetworkSet, or None
+        """
+
+        if self.raw_allowed_ips == "(none)":
+            return None
+
+        value = NonStrictIPNetworkSet()
+        value.extend(self.raw_allowed_ips.split(","))
+        return value
+
+    @property
+    def latest_handshake(self):
+        """
+        Returns the time of the latest handshake, or None if there has never been one
+        """
+
+        if self.raw_latest_handshake in ["", "0"]:
+            return None
+        return datetime.fromtimestamp(int(self.raw_latest_handshake), tz=timezone.utc)
+
+    @property
+    def persistent_keepalive(self):
+        """
+        Returns the persistent keepalive interval, or False when it is off
+        """
+
+        if self.raw_persistent_keepalive == "off":
+            return False
+        return int(self.raw_persistent_keepalive)
+
+    def to_interface_peer(self):
+        """
+        Returns the full InterfacePeer for this row
+        """
+
+        return InterfacePeer(
+            self.interface,
+            self.peer,
+            preshared_key=self.preshared_key,
+            endpoint=self.endpoint,
+            allowed_ips=(
+                None if self.raw_allowed_ips == "(none)" else self.raw_allowed_ips
+            ),
+            latest_handshake=self.raw_latest_handshake or 0,
+            rx=self.rx,
+            tx=self.tx,
+            persistent_keepalive=self.persistent_keepalive,
+        )
+
+
+# A peer's throughput between two snapshots, as reported by `top_talkers()`
+Talker = namedtuple(
+    "Talker", ["peer", "rx_rate", "tx_rate", "handshake_age", "endpoint"]
+)
 
-    ip_address = None
-    preshared_key = None
-    endpoint = None
-    allowed_ips = []
-    latest_handshake = None
-    rx = 0
-    tx = 0
-    persistent_keepalive = False
+# The outcome of `Interface.apply()`: the public keys of the peers that were added,
+# removed, left unchanged, a dict of { public key: [changed fields] } for the updated
+# peers, and the number of invocations that were needed to apply the changes
+ApplyReport = namedtuple(
+    "ApplyReport", ["added", "removed", "updated", "unchanged", "invocations"]
+)
+
+# The fields of a peer that `Interface.apply()` manages, as named by `wg set`
+APPLY_FIELDS = (
+    "allowed_ips",
+    "endpoint",
+    "persistent_keepalive",
+    "preshared_key",
+)
+
+
+class InterfacePeer:  # pylint: disable=too-many-instance-attributes
+    """
+    A peer that is currently configured on the WireGuard interface
+
+    The counters are stored as ints, while the allowed IPs, the IP address derived from
+    them and the latest handshake time are only decoded when first accessed.
+    """
+
+    __slots__ = (
+        "interface",
+        "peer",
+        "preshared_key",
+        "endpoint",
+        "rx",
+        "tx",
+        "persistent_keepalive",
+        "_ip_address",
+        "_allowed_ips",
+        "_raw_allowed_ips",
+        "_handshake",
+        "_latest_handshake",
+    )
 
     def __init__(self, interface, peer, **data):
         if not interface:
@@ -50,12 +238,116 @@ class InterfacePeer:
         self.interface = interface
         self.peer = peer
 
+        self.preshared_key = None
+        self.endpoint = None
+        self.rx = 0  # pylint: disable=invalid-name
+        self.tx = 0  # pylint: disable=invalid-name
+        self.persistent_keepalive = False
+        self._ip_address = None
+        self._allowed_ips = None
+        self._raw_allowed_ips = None
+        self._handshake = None
+        self._latest_handshake = None
+
         if data:
             self.load(data)
 
     def __repr__(self):
         return f"<InterfacePeer iface={self.interface} peer={self.peer} tx={self.tx} rx={self.rx}>"
 
+    def _subnets(self):
+        """
+        Returns the raw allowed IPs as a sequence
+        """
+
+        if self._raw_allowed_ips is None:
+            return ()
+        if isinstance(self._raw_allowed_ips, str):
+            return self._raw_allowed_ips.split(",")
+        return self._raw_allowed_ips
+
+    @property
+    def allowed_ips(self):
+        """
+        Returns the allowed IPs of this peer, decoding them on first access
+        """
+
+        if self._allowed_ips is None:
+            value = NonStrictIPNetworkSet()
+            subnets = self._subnets()
+            if subnets:
+                value.extend(list(subnets))
+            self._allowed_ips = value
+
+        return self._allowed_ips
+
+    @allowed_ips.setter
+    def allowed_ips(self, value):
+        """
+        Sets the allowed IPs, from a comma separated string or a list of networks
+        """
+
+        self._raw_allowed_ips = value
+        self._allowed_ips = None
+
+    @property
+    def ip_address(self):
+        """
+        Returns the IP address of this peer. Unless explicitly set, it is derived from the
+        allowed IPs when they consist of a single network.
+        """
+
+        if self._ip_address is None:
+            subnets = self._subnets()
+            if len(subnets) == 1:
+                self._ip_address = ip_interface(subnets[0]).ip
+
+        return self._ip_address
+
+    @ip_address.setter
+    def ip_address(self, value):
+        """
+        Sets the IP address of this peer
+        """
+
+        self._ip_address = value
+
+    @property
+    def handshake_timestamp(self):
+        """
+        Returns the UNIX timestamp of the latest handshake, or None when it is unknown
+        """
+        return self._handshake
+
+    @property
+    def latest_handshake(self):
+        """
+        Returns the time of the latest handshake, decoding it on first access
+        """
+
+        if self._latest_handshake is None and self._handshake is not None:
+            self._latest_handshake = datetime.fromtimestamp(
+                self._handshake, tz=timezone.utc
+            )
+
+        return self._latest_handshake
+
+    @latest_handshake.setter
+    def latest_handshake(self, value):
+        """
+        Sets the time of the latest handshake, from a datetime or a UNIX timestamp
+        """
+
+        if value is None:
+            self._handshake = None
+            self._latest_handshake = None
+        elif isinstance(value, datetime):
+            self._handshake = int(value.timestamp())
+            self._latest_handshake = value
+        else:
+            self._handshake = int(value)
+            self._latest_handshake = None
+
     @property
     def is_connected(self):
         """
@@ -70,6 +362,60 @@ class InterfacePeer:
                 pass
         return False
 
+    def handshake_age(self, now=None):
+        """
+        Returns the number of seconds since the latest handshake with this peer, or None
+        if no handshake has ever occurred
+        """
+
+        if not self._handshake or self._handshake <= 0:
+            return None
+
+        now = time.time() if now is None else now.timestamp()
+        return max(now - self._handshake, 0)
+
+    def passive_connection_state(self, previous=None, handshake_timeout=None, now=None):
+        """
+        Classifies the connection state of this peer without sending any traffic
+
+        A recent handshake, or bytes received since the `previous` snapshot of this peer,
+        means that it is connected. A peer that has never completed a handshake is not.
+        Returns None when the state cannot be determined from the data alone.
+        """
+
+        if handshake_timeout is None:
+            handshake_timeout = HANDSHAKE_TIMEOUT
+
+        age = self.handshake_age(now)
+        if age is None:
+            return ConnectionState(False, "handshake")
+
+        if age <= handshake_timeout:
+            return ConnectionState(True, "handshake")
+
+        if previous is not None and int(self.rx) > int(previous.rx):
+            return ConnectionState(True, "traffic")
+
+        return None
+
+    def connection_state(
+        self, previous=None, handshake_timeout=None, probe=True, now=None
+    ):
+        """
+        Returns the ConnectionState of this peer, only pinging it when the handshake age and
+        traffic counters are inconclusive. With `probe=False`, an inconclusive peer is
+        considered to not be connected.
+        """
+
+        state = self.passive_connection_state(previous, handshake_timeout, now)
+        if state is not None:
+            return state
+
+        if probe:
+            return ConnectionState(self.is_connected, "ping")
+
+        return ConnectionState(False, "handshake")
+
     def load(self, data):
         """
         Load this object with the provided data
@@ -82,42 +428,49 @@ class InterfacePeer:
             if key in ["interface", "peer", "load"] or key.startswith("_"):
                 continue
 
-            if key == "latest_handshake":
-                if not isinstance(value, datetime):
-                    value = datetime.fromtimestamp(int(value)).replace(
-                        tzinfo=timezone.utc
-                    )
+            if key in ["rx", "tx"]:
+                value = int(value)
 
-            elif key == "allowed_ips":
-                if value is None:
-                    continue
+            elif key == "persistent_keepalive":
+                value = False if value in [None, False, "off"] else int(value)
 
-                if not isinstance(value, (list, set, tuple)):
-                    subnets = value.split(",")
-                else:
-                    subnets = value
+            elif key == "allowed_ips" and value is None:
+                continue
 
-                value = NonStrictIPNetworkSet()
-                value.extend(subnets)
+            try:
+                setattr(self, key, value)
+            except AttributeError as exc:
+                raise ValueError(f"Unknown InterfacePeer field: {key}") from exc
 
-                if "ip_address" not in data and len(subnets) == 1:
-                    self.ip_address = ip_interface(subnets[0]).ip
 
-            setattr(self, key, value)
+# Snapshots of interfaces' peers, shared by all the Interface objects that have opted into
+# caching them: { ( Interface class, interface name ): ( monotonic time, [PeerRow] ) }
+_SNAPSHOTS = {}
+_SNAPSHOT_LOCKS = {}
+# Bumped by every invalidation, so a dump started before it is not cached after it
+_SNAPSHOT_GENERATIONS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
 
 
 class Interface:
     """
     A currently configured WireGuard interface on this host
+
+    Passing a `cache_ttl` (in seconds) shares a snapshot of the interface's peers between
+    all the callers of `iter_stats()`, `stats()` and `peers()` within that time, for every
+    Interface of the same name that opted into caching. Callers that arrive while the
+    snapshot is being taken wait for it, rather than running `wg` again.
     """
 
     interface = None
+    cache_ttl = None
 
-    def __init__(self, interface):
+    def __init__(self, interface, cache_ttl=None):
         if not interface:
             raise ValueError("Interface must be supplied")
 
         self.interface = interface
+        self.cache_ttl = cache_ttl
 
     def __repr__(self):
         return f"<Interface iface={self.interface}>"
@@ -146,13 +499,16 @@ class Interface:
         Stops the WireGuard interface
         """
 
-        return _run(
-            [
-                "wg-quick",
-                "down",
-                self.interface,
-            ]
-        )
+        try:
+            return _run(
+                [
+                    "wg-quick",
+                    "down",
+                    self.interface,
+                ]
+            )
+        finally:
+            self.invalidate()
 
     def restart(self):
         """
@@ -167,41 +523,89 @@ class Interface:
         Starts the WireGuard interface
         """
 
-        return _run(
-            [
-                "wg-quick",
-                "up",
-                self.interface,
-            ]
-        )
+        try:
+            return _run(
+                [
+                    "wg-quick",
+                    "up",
+                    self.interface,
+                ]
+            )
+        finally:
+            self.invalidate()
 
     def sync(self, config_file):
         """
         Sync the configuration of the WireGuard interface with the given config file
         """
 
-        return _run(
-            [
-                "wg",
-                "syncconf",
-                self.interface,
-                config_file,
-            ]
-        )
+        try:
+            return _run(
+                [
+                    "wg",
+                    "syncconf",
+                    self.interface,
+                    config_file,
+                ]
+            )
+        finally:
+            self.invalidate()
 
     def add(self, config_file):
         """
         Add the given config file's directives to the WireGuard interface
         """
 
-        return _run(
-            [
-                "wg",
-                "addconf",
-                self.interface,
-                config_file,
-            ]
-        )
+        try:
+            return _run(
+                [
+                    "wg",
+                    "addconf",
+                    self.interface,
+                    config_file,
+                ]
+            )
+        finally:
+            self.invalidate()
+
+    def invalidate(self):
+        """
+        Discards the cached snapshot of this interface's peers, if any
+        """
+
+        key = (self.__class__, self.interface)
+        with _SNAPSHOTS_LOCK:
+            _SNAPSHOTS.pop(key, None)
+            _SNAPSHOT_GENERATIONS[key] = _SNAPSHOT_GENERATIONS.get(key, 0) + 1
+
+    def snapshot(self):
+        """
+        Returns the list of PeerRows of this interface, from the cached snapshot while it
+        is fresh
+        """
+
+        if not self.cache_ttl:
+            return list(self._iter_rows())
+
+        key = (self.__class__, self.interface)
+        with _SNAPSHOTS_LOCK:
+            lock = _SNAPSHOT_LOCKS.setdefault(key, threading.Lock())
+
+        with lock:
+            cached = _SNAPSHOTS.get(key)
+            if cached is None or time.monotonic() - cached[0] > self.cache_ttl:
+                with _SNAPSHOTS_LOCK:
+                    generation = _SNAPSHOT_GENERATIONS.get(key, 0)
+
+                cached = (time.monotonic(), list(self._iter_rows()))
+
+                # The interface changed while it was being dumped, so these rows may
+                # predate the change: they are returned, but not served to anyone else
+                with _SNAPSHOTS_LOCK:
+                    if _SNAPSHOT_GENERATIONS.get(key, 0) == generation:
+                        _SNAPSHOTS[key] = cached
+
+        return cached[1]
 
     def peer(self, peer):
         """
@@ -221,46 +625,95 @@ class Interface:
         """
         return self.show("dump")
 
+    def iter_stats(self):
+        """
+        Yields a PeerRow for each of the configured peers of the interface, as the output
+        of `wg show <interface> dump` is read, or from the cached snapshot
+        """
+
+        if self.cache_ttl:
+            yield from self.snapshot()
+        else:
+            yield from self._iter_rows()
+
+    def _iter_rows(self):
+        """
+        Yields a PeerRow for each of the configured peers of the interface, as the output
+        of `wg show <interface> dump` is read
+        """
+
+        for line in _stream(["wg", "show", self.interface, "dump"]):
+            fields = line.split()
+
+            # The interface's own line only has 4 fields
+            if len(fields) == 4 or not fields:
+                continue
+
+            try:
+                yield PeerRow.from_fields(self.interface, fields)
+            except (IndexError, ValueError):
+                print("Failed to parse:")
+                print(line)
+
     def stats(self):
         """
         Returns statistics about the configured peers for the interface
         """
 
-        public_key = self.public_key()
-        output = self.dump()
         peers = {}
-        for line in output.stdout.split("\n"):
-            if public_key in line:
+        for row in self.iter_stats():
+            peers.update({row.peer: row.to_interface_peer()})
+
+        return peers
+
+    @classmethod
+    def list(cls, **kwargs):
+        """
+        Returns an Interface for each of the WireGuard interfaces on this host
+        """
+
+        output = _run(["wg", "show", "interfaces"])
+        return [cls(name, **kwargs) for name in output.stdout.split()]
+
+    @classmethod
+    def all_stats(cls):
+        """
+        Returns the statistics of the configured peers of every WireGuard interface on
+        this host, from a single `wg show all dump`, as a dict of
+        { interface name: { public key: InterfacePeer } }
+        """
+
+        stats = {}
+        for line in _stream(["wg", "show", "all", "dump"]):
+            fields = line.split()
+            if not fields:
                 continue
-            peerstat = line.split()
+
+            peers = stats.setdefault(fields[0], {})
+
+            # Each interface's own line only has 5 fields, including the interface name
+            if len(fields) == 5:
+                continue
+
             try:
-                peer = self.peer(peerstat[0])
-                data = {
-                    "preshared_key": peerstat[1] if peerstat[1] != "(none)" else None,
-                    "endpoint": peerstat[2] if peerstat[2] != "(none)" else None,
-                    "allowed_ips": peerstat[3] if peerstat[3] != "(none)" else None,
-                    "latest_handshake": peerstat[4] if peerstat[4] else None,
-                    "rx": peerstat[5],
-                    "tx": peerstat[6],
-                    "persistent_keepalive": (
-                        peerstat[7] if peerstat[7] != "off" else False
-                    ),
-                }
-            except IndexError:
+                row = PeerRow.from_fields(fields[0], fields[1:])
+            except (IndexError, ValueError):
                 print("Failed to parse:")
                 print(line)
                 continue
 
-            peer.load(data)
-            peers.update({peer.peer: peer})
+            peers.update({row.peer: row.to_interface_peer()})
 
-        return peers
+        return stats
 
     def peers(self):
         """
         Returns the peers' public keys for this interface
         """
 
+        if self.cache_ttl:
+            return [self.peer(row.peer) for row in self.snapshot()]
+
         output = self.show("peers")
         peers = []
         for line in output.stdout.split("\n"):
@@ -268,6 +721,407 @@ class Interface:
 
         return peers
 
+    def diff(self, server):
+        """
+        Compares the peers of the given Server with the peers currently configured on
+        this interface
+
+        Returns a tuple of ( ApplyReport, list of changes ), where each change is a dict
+        of the peer's `public_key` plus either `remove`, or the fields to be set.
+        """
+
+        # Never diff against a cached snapshot, as it may predate the latest changes
+        live = {row.peer: row.to_interface_peer() for row in self._iter_rows()}
+        desired = _desired_peers(server)
+        resolved = {}
+
+        added = []
+        removed = []
+        updated = {}
+        unchanged = []
+        changes = []
+
+        for key, fields in desired.items():
+            if key not in live:
+                added.append(key)
+                change = {field: value for field, value in fields.items() if value}
+                changes.append(dict(change, public_key=key))
+                continue
+
+            changed = _changed_fields(fields, _live_peer_fields(live[key]), resolved)
+            if changed:
+                updated[key] = sorted(changed)
+                changes.append(dict(changed, public_key=key))
+            else:
+                unchanged.append(key)
+
+        for key in live:
+            if key not in desired:
+                removed.append(key)
+                changes.append({"public_key": key, "remove": True})
+
+        return (ApplyReport(added, removed, updated, unchanged, 0), changes)
+
+    def apply(self, server, dry_run=False):
+        """
+        Applies the peers of the given Server to this interface, only touching the peers
+        that have been added, removed, or changed since the last time
+
+        Returns an ApplyReport of what was (or, for a `dry_run`, would be) changed.
+        """
+
+        report, changes = self.diff(server)
+        if dry_run or not changes:
+            return report
+
+        try:
+            return report._replace(invocations=self._apply_changes(changes))
+        finally:
+            self.invalidate()
+
+    def _apply_changes(self, changes):
+        """
+        Applies the changes from `diff()` with as few `wg set` invocations as possible,
+        returning the number of invocations
+        """
+
+        base = ["wg", "set", self.interface]
+        base_length = sum(len(arg) + 1 for arg in base)
+
+        with tempfile.TemporaryDirectory() as key_dir:
+            commands = []
+            cmd = list(base)
+            length = base_length
+            for idx, change in enumerate(changes):
+                args = _set_peer_args(change, key_dir, idx)
+                args_length = sum(len(arg) + 1 for arg in args)
+                if len(cmd) > len(base) and length + args_length > MAX_COMMAND_LENGTH:
+                    commands.append(cmd)
+                    cmd = list(base)
+                    length = base_length
+
+                cmd.extend(args)
+                length += args_length
+
+            commands.append(cmd)
+            for cmd in commands:
+                _run(cmd)
+
+        return len(commands)
+
+    def verify_connected(self, peers=None, concurrency=None, deadline=None):
+        """
+        Concurrently verifies the connectivity of many peers of this interface
+
+        `peers` may be any iterable of InterfacePeer objects, or the dict returned by
+        `stats()`. When not provided, the current stats of the interface are used.
+
+        At most `concurrency` probes are in flight at once. When a `deadline` (in
+        seconds) is given, any peer whose probe has not completed by then is considered
+        to not be connected.
+
+        Returns a dict of { public key: connected }
+        """
+
+        if peers is None:
+            peers = self.stats()
+
+        if isinstance(peers, dict):
+            peers = peers.values()
+
+        peers = list(peers)
+        results = {peer.peer: False for peer in peers}
+        results.update(self._probe(peers, concurrency, deadline))
+        return results
+
+    @staticmethod
+    def _probe(peers, concurrency=None, deadline=None):
+        """
+        Concurrently pings the given peers, returning { public key: connected } for the
+        peers whose probe completed by the deadline
+        """
+
+        if concurrency is None:
+            concurrency = VERIFY_CONCURRENCY
+        elif concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+
+        results = {}
+        probes = {}
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for peer in peers:
+                if peer.ip_address:
+                    probes[executor.submit(_is_connected, peer)] = peer.peer
+
+            done, not_done = wait(probes, timeout=deadline)
+            for future in not_done:
+                future.cancel()
+
+            for future in done:
+                if not future.cancelled() and future.exception() is None:
+                    results[probes[future]] = future.result()
+
+        finally:
+            # Don't wait on probes still running past the deadline, they are bounded
+            # by the ping timeout anyway.
+            executor.shutdown(wait=False)
+
+        return results
+
+    def connection_states(
+        self,
+        peers=None,
+        *,
+        previous=None,
+        handshake_timeout=None,
+        probe=True,
+        concurrency=None,
+        deadline=None,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Determines the connection state of many peers of this interface
+
+        Peers are first classified from their latest handshake and, when `previous`
+        stats (as returned by `stats()`) are given, from the bytes received since then.
+        Only the remaining, ambiguous, peers are probed, concurrently, as per
+        `verify_connected()`.
+
+        Returns a dict of { public key: ConnectionState }
+        """
+
+        if peers is None:
+            peers = self.stats()
+
+        if isinstance(peers, dict):
+            peers = peers.values()
+
+        if previous is None:
+            previous = {}
+
+        now = datetime.now(timezone.utc)
+        states = {}
+        ambiguous = []
+        for peer in peers:
+            state = peer.passive_connection_state(
+                previous.get(peer.peer), handshake_timeout, now
+            )
+            if state is not None:
+                states[peer.peer] = state
+            else:
+                states[peer.peer] = ConnectionState(False, "unknown")
+                if probe:
+                    ambiguous.append(peer)
+
+        if ambiguous:
+            results = self._probe(ambiguous, concurrency, deadline)
+            for key, connected in results.items():
+                states[key] = ConnectionState(connected, "ping")
+
+        return states
+
+
+def top_talkers(previous, rows, elapsed, count=10, now=None):
+    """
+    Returns the Talkers with the highest combined rx + tx rates, highest first
+
+    `previous` is a dict of { public key: ( rx, tx ) } from the previous snapshot, which is
+    replaced in place with the counters of `rows`, the PeerRows of the current snapshot,
+    so the peers that are gone are dropped from it.
+    `elapsed` is the number of seconds between both snapshots. Only the top `count`
+    peers are ordered, rather than sorting all of them.
+    """
+
+    if now is None:
+        now = time.time()
+
+    talkers = []
+    current = {}
+    for row in rows:
+        prev_rx, prev_tx = previous.get(row.peer, (row.rx, row.tx))
+        current[row.peer] = (row.rx, row.tx)
+
+        # Counters going backwards means the peer was re-added to the interface
+        rx_rate = max(row.rx - prev_rx, 0) / elapsed if elapsed > 0 else 0.0
+        tx_rate = max(row.tx - prev_tx, 0) / elapsed if elapsed > 0 else 0.0
+
+        handshake = int(row.raw_latest_handshake or 0)
+        talkers.append(
+            Talker(
+                row.peer,
+                rx_rate,
+                tx_rate,
+                max(now - handshake, 0) if handshake > 0 else None,
+                row.endpoint,
+            )
+        )
+
+    previous.clear()
+    previous.update(current)
+
+    return heapq.nlargest(
+        count, talkers, key=lambda talker: talker.rx_rate + talker.tx_rate
+    )
+
+
+def _desired_peers(server):
+    """
+    Returns a dict of { public key: fields } for the peers of the given Server, with the
+    values that the server's config file would set for them
+    """
+
+    peers = {}
+    for peer in server.peers:
+        # The same rule as rendering the config: a key set on only one side is used for
+        # both, and two different keys are an error
+        preshared_key = peer.preshared_key or server.preshared_key
+        if peer.preshared_key and server.preshared_key:
+            if peer.preshared_key != server.preshared_key:
+                raise ValueError(f"Preshared keys do not match for {server} and {peer}")
+
+        peers[peer.public_key] = {
+            "allowed_ips": sorted(str(net) for net in peer.allowed_ips),
+            "endpoint": peer.endpoint,
+            "persistent_keepalive": server.keepalive or 0,
+            "preshared_key": preshared_key,
+        }
+
+    return peers
+
+
+def _changed_fields(desired, current, resolved):
+    """
+    Returns the fields of a peer that have to be set for it to match the desired ones
+    """
+
+    changed = {}
+    for field in APPLY_FIELDS:
+        # A roaming peer's endpoint is learnt by the interface, so is only managed when
+        # one is explicitly configured
+        if field == "endpoint" and (
+            desired[field] is None
+            or _endpoint_matches(desired[field], current[field], resolved)
+        ):
+            continue
+
+        if desired[field] != current[field]:
+            changed[field] = desired[field]
+
+    return changed
+
+
+def _resolve(host, port, resolved):
+    """
+    Returns the addresses that a host name resolves to, once per host and port
+    """
+
+    if (host, port) not in resolved:
+        addresses = set()
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        except OSError:
+            infos = []
+
+        for info in infos:
+            try:
+                addresses.add(ip_address(info[4][0]))
+            except ValueError:
+                continue
+
+        resolved[(host, port)] = addresses
+
+    return resolved[(host, port)]
+
+
+def _endpoint_matches(desired, live, resolved):
+    """
+    Returns whether a configured endpoint is the one the interface reports
+
+    The interface always reports the address an endpoint resolved to, so a host name is
+    resolved to compare it.
+    """
+
+    if desired == live:
+        return True
+
+    if not live:
+        return False
+
+    host, port = split_endpoint(desired)
+    live_host, live_port = split_endpoint(live)
+    if (port or str(PORT)) != live_port:
+        return False
+
+    try:
+        live_ip = ip_address(live_host)
+    except ValueError:
+        return False
+
+    try:
+        return ip_address(host) == live_ip
+    except ValueError:
+        return live_ip in _resolve(host, port, resolved)
+
+
+def _live_peer_fields(iface_peer):
+    """
+    Returns the fields of the given InterfacePeer, normalized for comparison with the
+    results of `_desired_peers()`
+    """
+
+    return {
+        "allowed_ips": sorted(str(net) for net in iface_peer.allowed_ips),
+        "endpoint": iface_peer.endpoint,
+        "persistent_keepalive": int(iface_peer.persistent_keepalive or 0),
+        "preshared_key": iface_peer.preshared_key,
+    }
+
+
+def _set_peer_args(change, key_dir, idx):
+    """
+    Returns the `wg set` arguments for a single peer change
+
+    `wg set` only reads preshared keys from files, so they are written into `key_dir`.
+    """
+
+    args = ["peer", change["public_key"]]
+    if change.get("remove"):
+        args.append("remove")
+        return args
+
+    if "preshared_key" in change:
+        key_file = os.devnull
+        if change["preshared_key"]:
+            key_file = os.path.join(key_dir, f"psk{idx}")
+            with open(
+                os.open(key_file, os.O_WRONLY | os.O_CREAT, 0o600),
+                mode="w",
+                encoding="utf-8",
+            ) as key_fh:
+                key_fh.write(change["preshared_key"])
+        args.extend(["preshared-key", key_file])
+
+    if change.get("endpoint"):
+        args.extend(["endpoint", change["endpoint"]])
+
+    if "persistent_keepalive" in change:
+        args.extend(
+            ["persistent-keepalive", str(change["persistent_keepalive"] or "off")]
+        )
+
+    if "allowed_ips" in change:
+        args.extend(["allowed-ips", ",".join(change["allowed_ips"])])
+
+    return args
+
+
+def _is_connected(peer):
+    """
+    Returns the connection state of the given InterfacePeer, for use by worker threads
+    """
+    return bool(peer.is_connected)
+
 
 def ping(host):
     """
@@ -281,6 +1135,289 @@ def ping(host):
     param = "-n" if platform.system().lower() == "windows" else "-c"
 
     # Building the command. Ex: "ping -c 1 google.com"
-    command = ["ping", param, "1", "-W", "1", host]
+    command = ["ping", param, "1", "-W", str(PING_TIMEOUT), host]
 
     return _run(command)
+
+
+class PeerHistory:
+    """
+    A fixed size ring buffer of ( timestamp, rx, tx, latest handshake ) samples for a peer
+
+    Samples are kept in compact arrays, so memory use is bounded by the size of the buffer.
+    """
+
+    __slots__ = ("size", "count", "index", "timestamps", "rx", "tx", "handshakes")
+
+    def __init__(self, size=None):
+        if size is None:
+            size = STATS_HISTORY
+        if size < 2:
+            raise ValueError("History size must be at least 2 samples")
+
+        self.size = size
+        self.count = 0
+        self.index = 0
+        self.timestamps = array("d", [0.0]) * size
+        self.rx = array("Q", [0]) * size
+        self.tx = array("Q", [0]) * size
+        self.handshakes = array("q", [0]) * size
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, rx, tx, handshake):
+        """
+        Adds a sample, overwriting the oldest one once the buffer is full
+        """
+
+        idx = self.index
+        self.timestamps[idx] = timestamp
+        self.rx[idx] = rx
+        self.tx[idx] = tx
+        self.handshakes[idx] = handshake
+
+        self.index = (idx + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def latest(self):
+        """
+        Returns the most recent ( timestamp, rx, tx, handshake ) sample, or None
+        """
+
+        if not self.count:
+            return None
+
+        idx = (self.index - 1) % self.size
+        return (self.timestamps[idx], self.rx[idx], self.tx[idx], self.handshakes[idx])
+
+    def samples(self):
+        """
+        Returns the list of ( timestamp, rx, tx, handshake ) samples, oldest first
+        """
+
+        start = (self.index - self.count) % self.size
+        samples = []
+        for offset in range(self.count):
+            idx = (start + offset) % self.size
+            samples.append(
+                (self.timestamps[idx], self.rx[idx], self.tx[idx], self.handshakes[idx])
+            )
+        return samples
+
+    def rates(self):
+        """
+        Returns the list of ( rx, tx ) rates, in bytes per second, between consecutive
+        samples. Intervals over which the counters were reset are skipped.
+        """
+
+        rates = []
+        samples = self.samples()
+        for prev, curr in zip(samples, samples[1:]):
+            elapsed = curr[0] - prev[0]
+            if elapsed <= 0 or curr[1] < prev[1] or curr[2] < prev[2]:
+                continue
+            rates.append(((curr[1] - prev[1]) / elapsed, (curr[2] - prev[2]) / elapsed))
+        return rates
+
+    def throughput(self, window=None):
+        """
+        Returns the average ( rx, tx ) rates, in bytes per second, over the last `window`
+        seconds, or over the whole buffer
+        """
+
+        samples = self.samples()
+        if window is not None and samples:
+            cutoff = samples[-1][0] - window
+            samples = [sample for sample in samples if sample[0] >= cutoff]
+
+        elapsed = 0.0
+        rx = tx = 0  # pylint: disable=invalid-name
+        for prev, curr in zip(samples, samples[1:]):
+            if curr[0] <= prev[0] or curr[1] < prev[1] or curr[2] < prev[2]:
+                continue
+            elapsed += curr[0] - prev[0]
+            rx += curr[1] - prev[1]  # pylint: disable=invalid-name
+            tx += curr[2] - prev[2]  # pylint: disable=invalid-name
+
+        if not elapsed:
+            return (0.0, 0.0)
+        return (rx / elapsed, tx / elapsed)
+
+
+def _percentile(values, percentile):
+    """
+    Returns the nearest-rank percentile of the given sorted values
+    """
+
+    if not values:
+        return 0.0
+    rank = max(int(-(-percentile * len(values) // 100)), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class StatsCollector:  # pylint: disable=too-many-instance-attributes
+    """
+    Polls the statistics of a WireGuard interface at a fixed interval, keeping a bounded
+    history of each peer's counters to derive throughput from
+
+    Peers that are no longer configured on the interface are dropped from the history.
+    """
+
+    interface = None
+    interval = None
+    size = None
+    last_error = None
+
+    def __init__(self, interface, interval=None, size=None):
+        if not interface:
+            raise ValueError("Interface must be supplied")
+
+        if not isinstance(interface, Interface):
+            interface = Interface(interface)
+
+        self.interface = interface
+        self.interval = STATS_INTERVAL if interval is None else interval
+        self.size = STATS_HISTORY if size is None else size
+
+        self._history = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f"<StatsCollector iface={self.interface.interface} interval={self.interval}>"
+
+    def poll(self, timestamp=None):
+        """
+        Takes a single sample of the interface's statistics
+        """
+
+        # Only the counters are needed, so skip decoding the rest of each peer's data
+        rows = list(self.interface.iter_stats())
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            seen = set()
+            for row in rows:
+                seen.add(row.peer)
+                if row.peer not in self._history:
+                    self._history[row.peer] = PeerHistory(self.size)
+
+                self._history[row.peer].append(
+                    timestamp, row.rx, row.tx, int(row.raw_latest_handshake or 0)
+                )
+
+            for key in list(self._history):
+                if key not in seen:
+                    del self._history[key]
+
+    def _run(self):
+        """
+        Polls at a fixed interval until stopped
+        """
+
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                # Eg. a malformed dump, which must not stop the polling for good
+                self.last_error = exc
+
+            next_poll += self.interval
+            self._stop.wait(max(next_poll - time.monotonic(), 0))
+
+    def start(self):
+        """
+        Starts polling in a background thread
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"wireguard-stats-{self.interface.interface}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops polling
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def peers(self):
+        """
+        Returns the public keys of the peers being tracked
+        """
+
+        with self._lock:
+            return list(self._history)
+
+    def latest(self, peer):
+        """
+        Returns the most recent ( timestamp, rx, tx, handshake ) sample of the given peer
+        """
+
+        with self._lock:
+            return self._history[peer].latest()
+
+    def samples(self, peer):
+        """
+        Returns the ( timestamp, rx, tx, handshake ) samples of the given peer, oldest first
+        """
+
+        with self._lock:
+            return self._history[peer].samples()
+
+    def throughput(self, peer, window=None):
+        """
+        Returns the average ( rx, tx ) rates, in bytes per second, of the given peer
+        """
+
+        with self._lock:
+            return self._history[peer].throughput(window)
+
+    def percentiles(self, peer, percentiles=(50, 90, 99)):
+        """
+        Returns the given percentiles of the rx and tx rates of the given peer, as a dict
+        of { "rx": { percentile: rate }, "tx": { percentile: rate } }
+        """
+
+        with self._lock:
+            rates = self._history[peer].rates()
+
+        rx_rates = sorted(rate[0] for rate in rates)
+        tx_rates = sorted(rate[1] for rate in rates)
+        return {
+            "rx": {pct: _percentile(rx_rates, pct) for pct in percentiles},
+            "tx": {pct: _percentile(tx_rates, pct) for pct in percentiles},
+        }
+
+    def totals(self, window=None):
+        """
+        Returns a dict of the interface's latest cumulative `rx`/`tx` bytes, and the
+        summed `rx_rate`/`tx_rate` of all of its peers
+        """
+
+        totals = {"rx": 0, "tx": 0, "rx_rate": 0.0, "tx_rate": 0.0}
+        with self._lock:
+            for history in self._history.values():
+                _, rx, tx, _ = history.latest()  # pylint: disable=invalid-name
+                rx_rate, tx_rate = history.throughput(window)
+                totals["rx"] += rx
+                totals["tx"] += tx
+                totals["rx_rate"] += rx_rate
+                totals["tx_rate"] += tx_rate
+
+        return totals
@@ -1,4 +1,13 @@
+from .audit import (
+    AllowedIPsConflict,
+    audit_networks,
+)
+from .compact import (
+    CompactIPAddressSet,
+    CompactIPNetworkSet,
+)
 from .config import (
+    split_endpoint,
     value_list_to_comma,
     value_list_to_multiple,
 )
@@ -11,21 +20,40 @@ from .keys import (
 )
 from .sets import (
     ClassedSet,
+    extend_error,
     IPAddressSet,
     IPNetworkSet,
 )
 from .subnets import (
+    clear_parse_cache,
     find_ip_and_subnet,
+    parse_address,
+    parse_cache_info,
+    parse_network,
+)
+from .trie import (
+    PrefixTrie,
 )
 
 __all__ = [
+    "AllowedIPsConflict",
     "ClassedSet",
+    "CompactIPAddressSet",
+    "CompactIPNetworkSet",
     "IPAddressSet",
     "IPNetworkSet",
     "JSONEncoder",
+    "PrefixTrie",
+    "audit_networks",
+    "clear_parse_cache",
+    "extend_error",
     "find_ip_and_subnet",
     "generate_key",
+    "parse_address",
+    "parse_cache_info",
+    "parse_network",
     "public_key",
+    "split_endpoint",
     "value_list_to_comma",
     "value_list_to_multiple",
 ]
@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+from subnet import (
+    ip_network,
+    IPv4Network,
+    IPv6Network,
+)
+
+DUPLICATE = "duplicate"
+OVERLAP = "overlap"
+SHADOWED = "shadowed"
+
+# A single problem found by `audit_networks()`
+#   duplicate: `network` is assigned to both `owner` and `other_owner`
+#   overlap:   `network` of `owner` is inside `other_network` of `other_owner`, and takes
+#              that part of its traffic
+#   shadowed:  `network` of `owner` is entirely covered by more specific networks, so
+#              it never matches any traffic
+AllowedIPsConflict = namedtuple(
+    "AllowedIPsConflict",
+    ["kind", "network", "owner", "other_network", "other_owner"],
+)
+
+
+def _others(owners, owner):
+    """
+    Yields the ( network, owner ) pairs that do not belong to the given owner
+    """
+
+    for other_network, other_owner in owners:
+        if other_owner is not owner:
+            yield other_network, other_owner
+
+
+def _owns(owners, owner):
+    """
+    Returns whether the given owner is among the ( network, owner ) pairs
+    """
+
+    return any(other_owner is owner for _, other_owner in owners)
+
+
+def audit_networks(assignments):
+    """
+    Returns the AllowedIPsConflicts among ( network, owner ) assignments
+
+    Networks are converted to integer intervals, sorted and swept once, which takes
+    O(n log n) rather than comparing every pair. CIDR networks never partially overlap:
+    each one is either nested in another, or disjoint from it. So the sweep only needs a
+    stack of the networks enclosing the current one, which is at most 33 (IPv4) or 129
+    (IPv6) deep.
+    """
+
+    intervals = []
+    for network, owner in assignments:
+        if not isinstance(network, (IPv4Network, IPv6Network)):
+            network = ip_network(network)
+
+        start = int(network.network_address)
+        intervals.append(
+            (network.version, start, start + network.num_addresses - 1, network, owner)
+        )
+
+    # Wider networks sort before the networks they contain
+    intervals.sort(key=lambda item: (item[0], item[1], -item[2]))
+
+    conflicts = []
+    # Each entry is [ ( version, start, end ), [ ( network, owner ) ] of every owner of
+    # the network, number of addresses covered by its direct children, whether any of
+    # those children belong to other owners ]
+    stack = []
+
+    def close(entry):
+        (_, start, end), owners, covered, foreign = entry
+        # A network that is only covered by its own owner's networks loses no traffic
+        if covered == end - start + 1 and foreign:
+            for network, owner in owners:
+                conflicts.append(
+                    AllowedIPsConflict(SHADOWED, network, owner, None, None)
+                )
+
+    for version, start, end, network, owner in intervals:
+        while stack and (stack[-1][0][0] != version or stack[-1][0][2] < start):
+            close(stack.pop())
+
+        duplicate = None
+        if stack and stack[-1][0] == (version, start, end):
+            # Every owner of a duplicate network is kept, as the networks nested in it
+            # overlap with each of them
+            duplicate = stack.pop()
+            conflicts.extend(
+                AllowedIPsConflict(DUPLICATE, network, owner, *other)
+                for other in _others(duplicate[1], owner)
+            )
+
+            if _owns(duplicate[1], owner):
+                stack.append(duplicate)
+                continue
+
+        for _, owners, _, _ in stack:
+            conflicts.extend(
+                AllowedIPsConflict(OVERLAP, network, owner, *other)
+                for other in _others(owners, owner)
+            )
+
+        entry = duplicate
+        if entry is None:
+            entry = [(version, start, end), [], 0, False]
+            if stack:
+                stack[-1][2] += end - start + 1
+
+        if stack and not _owns(stack[-1][1], owner):
+            stack[-1][3] = True
+
+        entry[1].append((network, owner))
+        stack.append(entry)
+
+    while stack:
+        close(stack.pop())
+
+    return conflicts
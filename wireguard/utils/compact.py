@@ -0,0 +1,246 @@
+from array import array
+from bisect import bisect_left
+
+from subnet import (
+    IPv4Address,
+    IPv6Address,
+    IPv4Network,
+    IPv6Network,
+)
+
+from .sets import (
+    extend_error,
+    IPAddressSet,
+    IPNetworkSet,
+)
+
+
+class CompactSet:
+    """
+    A compact, sorted set of IP addresses/networks, stored as integers
+
+    IPv4 values are kept in an `array` of 64 bit integers, and IPv6 values in a sorted
+    list of Python integers, instead of a `set` of objects. For IPv4, that is 8 bytes per
+    value, against roughly 120 bytes in an IPAddressSet and 590 in an IPNetworkSet (see
+    `benchmarks/compact_ip_sets.py`). The address/network objects are only created when
+    iterating.
+
+    Values are validated exactly as the (always empty) ClassedSet in `_coercer` does it.
+    """
+
+    __slots__ = ("_ipv4", "_ipv6")
+
+    _coercer = None
+
+    def __init__(self, values=None):
+        self._ipv4 = array("Q")
+        self._ipv6 = []
+
+        if values:
+            self.extend(values)
+
+    def _pack(self, value):
+        """
+        Returns the storage for the given coerced value, and its integer key there
+        """
+
+        raise NotImplementedError(
+            "CompactSet must be not be used directly. Inherit from it, "
+            "with appropriate packing logic implemented in the child class"
+        )
+
+    def _unpack(self, version, key):
+        """
+        Returns the address/network object of the given integer key
+        """
+
+        raise NotImplementedError(
+            "CompactSet must be not be used directly. Inherit from it, "
+            "with appropriate unpacking logic implemented in the child class"
+        )
+
+    def _coerce_value(self, value):
+        """
+        Coerces a value, as the matching ClassedSet would
+        """
+
+        return self._coercer._coerce_value(value)  # pylint: disable=protected-access
+
+    def add(self, value):
+        """
+        Adds a value to this collection, maintaining uniqueness
+        """
+
+        if not value:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        if isinstance(
+            value,
+            (
+                list,
+                set,
+                tuple,
+            ),
+        ):
+            raise ValueError("Provided value must not be a list")
+
+        storage, key = self._pack(self._coerce_value(value))
+        idx = bisect_left(storage, key)
+        if idx == len(storage) or storage[idx] != key:
+            storage.insert(idx, key)
+
+    def extend(self, values):
+        """
+        Adds multiple values to this collection, maintaining uniqueness
+
+        Either all of the values are added, or a single ValueError lists every value
+        that could not be. Subclasses that override `add()` have it called for each value.
+        """
+
+        if not values:
+            raise ValueError(f"Cannot add an empty value to {self.__class__.__name__}")
+
+        if not isinstance(
+            values,
+            (
+                list,
+                set,
+                tuple,
+            ),
+        ):
+            values = [values]
+
+        # pylint: disable-next=protected-access
+        coerced, errors = self._coercer._coerce_values(values)
+        if errors:
+            raise extend_error(self.__class__.__name__, errors)
+
+        if type(self).add is not CompactSet.add:
+            for value in coerced:
+                self.add(value)
+            return
+
+        ipv4 = set(self._ipv4)
+        ipv6 = set(self._ipv6)
+        for value in coerced:
+            storage, key = self._pack(value)
+            (ipv4 if storage is self._ipv4 else ipv6).add(key)
+
+        # Sorting once is cheaper than inserting each value in place
+        self._ipv4 = array("Q", sorted(ipv4))
+        self._ipv6 = sorted(ipv6)
+
+    def _find(self, value):
+        """
+        Returns the storage and index of the given value, or ( None, None )
+        """
+
+        try:
+            storage, key = self._pack(self._coerce_value(value))
+        except ValueError:
+            return None, None
+
+        idx = bisect_left(storage, key)
+        if idx < len(storage) and storage[idx] == key:
+            return storage, idx
+
+        return None, None
+
+    def discard(self, value):
+        """
+        Removes a value from this collection, if present
+        """
+
+        storage, idx = self._find(value)
+        if storage is not None:
+            del storage[idx]
+
+    def remove(self, value):
+        """
+        Removes a value from this collection, raising KeyError if it is not present
+        """
+
+        storage, idx = self._find(value)
+        if storage is None:
+            raise KeyError(value)
+
+        del storage[idx]
+
+    def __contains__(self, value):
+        return self._find(value)[0] is not None
+
+    def __len__(self):
+        return len(self._ipv4) + len(self._ipv6)
+
+    def __iter__(self):
+        for key in self._ipv4:
+            yield self._unpack(4, key)
+        for key in self._ipv6:
+            yield self._unpack(6, key)
+
+    def __eq__(self, other):
+        if isinstance(other, CompactSet):
+            return set(self) == set(other)
+        if isinstance(other, (set, frozenset)):
+            return set(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({[str(value) for value in self]!r})"
+
+
+class CompactIPAddressSet(CompactSet):
+    """
+    A compact set of IPv4Address/IPv6Address objects
+    """
+
+    __slots__ = ()
+
+    _coercer = IPAddressSet()
+
+    def _pack(self, value):
+        if value.version == 4:
+            return self._ipv4, int(value)
+        return self._ipv6, int(value)
+
+    def _unpack(self, version, key):
+        if version == 4:
+            return IPv4Address(key)
+        return IPv6Address(key)
+
+    def __str__(self):
+        string_values = []
+        for ip in self:  # pylint: disable=invalid-name
+            string_values.append(f"{ip}/{ip.max_prefixlen}")
+        return ",".join(string_values)
+
+
+class CompactIPNetworkSet(CompactSet):
+    """
+    A compact set of IPv4Network/IPv6Network objects
+
+    Each network is stored as the integer ( network address << 8 | prefixlen ).
+    """
+
+    __slots__ = ()
+
+    _coercer = IPNetworkSet()
+
+    def _pack(self, value):
+        key = int(value.network_address) << 8 | value.prefixlen
+        if value.version == 4:
+            return self._ipv4, key
+        return self._ipv6, key
+
+    def _unpack(self, version, key):
+        if version == 4:
+            return IPv4Network((key >> 8, key & 0xFF))
+        return IPv6Network((key >> 8, key & 0xFF))
+
+    def __str__(self):
+        string_values = []
+        for net in self:
+            string_values.append(f"{str(net.network_address)}/{net.prefixlen}")
+        return ",".join(string_values)
@@ -40,3 +40,25 @@ def value_list_to_multiple(ini_key, values, key_value_separator=" = "):
         data.append(f"{ini_key}{key_value_separator}{value}")
 
     return os.linesep.join(data)
+
+
+def split_endpoint(endpoint):
+    """
+    Returns the ( host, port ) of an endpoint, with a port of None when it has none
+
+    Handles host names, IPv4 addresses and bracketed IPv6 addresses (`[::1]:51820`). A
+    bare IPv6 address has no port.
+    """
+
+    if endpoint.startswith("["):
+        host, _, port = endpoint[1:].partition("]")
+        port = port[1:] if port.startswith(":") else None
+    elif endpoint.count(":") == 1:
+        host, _, port = endpoint.partition(":")
+    else:
+        host, port = endpoint, None
+
+    if not port or not port.isdigit():
+        port = None
+
+    return host, port
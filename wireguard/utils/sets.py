@@ -7,6 +7,29 @@ from subnet import (
     IPv6Network,
 )
 
+from .subnets import (
+    parse_address,
+    parse_network,
+)
+
+# How many of the invalid values are listed in the error raised by `extend()`
+MAX_REPORTED_ERRORS = 10
+
+_NETWORK_CLASSES = {4: IPv4Network, 6: IPv6Network}
+_MAX_PREFIXLEN = {4: 32, 6: 128}
+
+
+def extend_error(name, errors):
+    """
+    Returns the ValueError for values that could not be added to a collection
+    """
+
+    shown = "; ".join(errors[:MAX_REPORTED_ERRORS])
+    if len(errors) > MAX_REPORTED_ERRORS:
+        shown += f"; and {len(errors) - MAX_REPORTED_ERRORS} more"
+
+    return ValueError(f"Could not add {len(errors)} value(s) to {name}: {shown}")
+
 
 class ClassedSet(set):
     """
@@ -43,6 +66,10 @@ class ClassedSet(set):
     def extend(self, values):
         """
         Adds multiple values to this collection, maintaining uniqueness
+
+        Every value is coerced before any of them are added, so either all of them are
+        added, or a single ValueError lists every value that could not be. Subclasses
+        that override `add()` have it called for each value.
         """
 
         if not values:
@@ -58,8 +85,102 @@ class ClassedSet(set):
         ):
             values = [values]
 
+        coerced, errors = self._coerce_values(values)
+        if errors:
+            raise extend_error(self.__class__.__name__, errors)
+
+        if type(self).add is not ClassedSet.add:
+            for value in coerced:
+                self.add(value)
+            return
+
+        super().update(coerced)
+
+    def _coerce_values(self, values):
+        """
+        Returns ( coerced values, errors ) for multiple values, rather than stopping at
+        the first invalid one
+
+        Strings are usually repeated (eg. the same DNS servers or AllowedIPs across
+        peers), so each distinct string is only coerced once.
+        """
+
+        coerced = []
+        errors = []
+        parsed = {}
         for value in values:
-            self.add(value)
+            if isinstance(value, str) and value in parsed:
+                coerced.append(parsed[value])
+                continue
+
+            if not value:
+                errors.append(f"empty value {value!r}")
+                continue
+
+            if isinstance(
+                value,
+                (
+                    list,
+                    set,
+                    tuple,
+                ),
+            ):
+                errors.append(f"nested list {value!r}")
+                continue
+
+            try:
+                result = self._coerce_value(value)
+            except ValueError as exc:
+                errors.append(str(exc))
+                continue
+
+            if isinstance(value, str):
+                parsed[value] = result
+            coerced.append(result)
+
+        return coerced, errors
+
+
+def _merged_ranges(networks):
+    """
+    Returns sorted ( version, start, end ) integer ranges covering the given networks,
+    with overlapping and adjacent ranges merged
+    """
+
+    ranges = sorted(
+        (
+            net.version,
+            int(net.network_address),
+            int(net.network_address) + net.num_addresses - 1,
+        )
+        for net in networks
+    )
+
+    merged = []
+    for version, start, end in ranges:
+        if merged and merged[-1][0] == version and start <= merged[-1][2] + 1:
+            if end > merged[-1][2]:
+                merged[-1][2] = end
+        else:
+            merged.append([version, start, end])
+
+    return merged
+
+
+def _range_networks(version, start, end):
+    """
+    Yields the fewest networks covering exactly the integer range from start to end
+    """
+
+    network_cls = _NETWORK_CLASSES[version]
+    max_prefixlen = _MAX_PREFIXLEN[version]
+    while start <= end:
+        # The largest block that is aligned on `start`, without going past `end`
+        bits = (start & -start).bit_length() - 1 if start else max_prefixlen
+        bits = min(bits, (end - start + 1).bit_length() - 1)
+
+        yield network_cls((start, max_prefixlen - bits))
+        start += 1 << bits
 
 
 class IPAddressSet(ClassedSet):
@@ -79,7 +200,11 @@ class IPAddressSet(ClassedSet):
 
         if not isinstance(value, (IPv4Address, IPv6Address)):
             try:
-                value = ip_address(value)
+                value = (
+                    parse_address(value)
+                    if isinstance(value, str)
+                    else ip_address(value)
+                )
             except (TypeError, ValueError) as exc:
                 raise ValueError(
                     f"Could not convert to IP Address: {type(value)}({value})"
@@ -116,7 +241,10 @@ class IPNetworkSet(ClassedSet):
 
         if not isinstance(value, (IPv4Network, IPv6Network)):
             try:
-                value = ip_network(value, strict=self._ip_network_strict)
+                if isinstance(value, str):
+                    value = parse_network(value, self._ip_network_strict)
+                else:
+                    value = ip_network(value, strict=self._ip_network_strict)
             except (TypeError, ValueError) as exc:
                 raise ValueError(
                     f"Could not convert to IP Network: {type(value)}({value})"
@@ -124,6 +252,71 @@ class IPNetworkSet(ClassedSet):
 
         return value
 
+    def collapse(self):
+        """
+        Returns a new set of the fewest networks covering exactly the same addresses
+
+        Overlapping, contained and adjacent networks are merged, so routing to the
+        collapsed set is identical to routing to this one.
+        """
+
+        collapsed = self.__class__()
+        for version, start, end in _merged_ranges(self):
+            for net in _range_networks(version, start, end):
+                super(IPNetworkSet, collapsed).add(net)
+
+        return collapsed
+
+    def exclude(self, values):
+        """
+        Returns a new set of the fewest networks covering this set's addresses, minus
+        those of the given network(s)
+
+        For instance, `0.0.0.0/0` excluding `192.168.0.0/16` gives the networks to route
+        everything except that LAN.
+        """
+
+        if not isinstance(
+            values,
+            (
+                list,
+                set,
+                tuple,
+            ),
+        ):
+            values = [values]
+
+        excluded = _merged_ranges(self._coerce_value(value) for value in values)
+
+        remaining = self.__class__()
+        idx = 0
+        for version, start, end in _merged_ranges(self):
+            # Skip the exclusions that are entirely before this range
+            while idx < len(excluded) and (
+                excluded[idx][0],
+                excluded[idx][2],
+            ) < (version, start):
+                idx += 1
+
+            current = idx
+            while (
+                current < len(excluded)
+                and excluded[current][0] == version
+                and excluded[current][1] <= end
+            ):
+                if excluded[current][1] > start:
+                    for net in _range_networks(
+                        version, start, excluded[current][1] - 1
+                    ):
+                        super(IPNetworkSet, remaining).add(net)
+                start = max(start, excluded[current][2] + 1)
+                current += 1
+
+            for net in _range_networks(version, start, end):
+                super(IPNetworkSet, remaining).add(net)
+
+        return remaining
+
     def __str__(self):
         string_values = []
         for net in self:
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from subnet import (
     ip_address,
     ip_network,
@@ -7,6 +9,72 @@ from subnet import (
     IPv6Network,
 )
 
+from ..constants import PARSE_CACHE_SIZE
+
+# The same strings get parsed over and over: server subnets, common DNS servers, shared
+# AllowedIPs like `0.0.0.0/0`, etc. The parsed objects are immutable, so they can safely
+# be shared between every peer that uses them.
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE, typed=True)
+def parse_address(value):
+    """
+    Returns the IPv4Address/IPv6Address of a value, caching the most recent ones
+    """
+
+    return ip_address(value)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE, typed=True)
+def parse_network(value, strict=True):
+    """
+    Returns the IPv4Network/IPv6Network of a value, caching the most recent ones
+    """
+
+    return ip_network(value, strict=strict)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _find_ip_and_subnet_str(value):
+    """
+    Returns the ( IP, subnet ) of a string, see `find_ip_and_subnet()`
+    """
+
+    if "/" not in value:
+        return (parse_address(value), None)
+
+    # Parsing non-strictly up front avoids failing, then parsing again, when the user
+    # provides a subnet with host bits set. `ip_address` does not allow the subnet to be
+    # included, so it is chopped out to obtain the desired IP.
+    net = parse_network(value, False)
+    ip = parse_address(value.split("/")[0])  # pylint: disable=invalid-name
+    if ip == net.network_address:
+        return (None, net)
+
+    return (ip, net)
+
+
+def parse_cache_info():
+    """
+    Returns the hits, misses and size of each of the parse caches
+    """
+
+    return {
+        "address": parse_address.cache_info(),
+        "network": parse_network.cache_info(),
+        "ip_and_subnet": _find_ip_and_subnet_str.cache_info(),
+    }
+
+
+def clear_parse_cache():
+    """
+    Empties the parse caches, resetting their counters
+    """
+
+    parse_address.cache_clear()
+    parse_network.cache_clear()
+    _find_ip_and_subnet_str.cache_clear()
+
 
 def find_ip_and_subnet(value):
     """
@@ -22,6 +90,8 @@ def find_ip_and_subnet(value):
         return (None, value)
     if isinstance(value, (IPv4Address, IPv6Address)):
         return (value, None)
+    if isinstance(value, str):
+        return _find_ip_and_subnet_str(value)
 
     # pylint: disable=invalid-name
     ip = None
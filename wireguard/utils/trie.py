@@ -0,0 +1,142 @@
+from subnet import (
+    ip_address,
+    ip_network,
+    IPv4Address,
+    IPv6Address,
+    IPv4Network,
+    IPv6Network,
+)
+
+# Each trie node is a list of [ zero child, one child, values ]
+_ZERO = 0
+_ONE = 1
+_VALUES = 2
+
+
+class PrefixTrie:
+    """
+    A binary trie of IPv4/IPv6 networks, for longest-prefix matching of addresses
+
+    Every network maps to one or more values. Looking up an address only walks the
+    bits of the address that are covered by a network in the trie, so it takes at most
+    32 (IPv4) or 128 (IPv6) steps, no matter how many networks are stored.
+    """
+
+    __slots__ = ("_roots", "_size")
+
+    def __init__(self):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self._size = 0
+
+    def __len__(self):
+        """
+        Returns the number of ( network, value ) pairs in this trie
+        """
+
+        return self._size
+
+    @staticmethod
+    def _bits(value, prefixlen, max_prefixlen):
+        """
+        Yields the first `prefixlen` bits of an integer address, most significant first
+        """
+
+        for shift in range(max_prefixlen - 1, max_prefixlen - prefixlen - 1, -1):
+            yield (value >> shift) & 1
+
+    def insert(self, network, value):
+        """
+        Maps the given network to a value, in addition to any values it already has
+        """
+
+        if not isinstance(network, (IPv4Network, IPv6Network)):
+            network = ip_network(network)
+
+        node = self._roots[network.version]
+        for bit in self._bits(
+            int(network.network_address), network.prefixlen, network.max_prefixlen
+        ):
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+
+        if node[_VALUES] is None:
+            node[_VALUES] = []
+
+        if value not in node[_VALUES]:
+            node[_VALUES].append(value)
+            self._size += 1
+
+    def remove(self, network, value):
+        """
+        Removes the mapping of the given network to a value, returning whether it existed
+        """
+
+        if not isinstance(network, (IPv4Network, IPv6Network)):
+            network = ip_network(network)
+
+        node = self._roots[network.version]
+        path = []
+        for bit in self._bits(
+            int(network.network_address), network.prefixlen, network.max_prefixlen
+        ):
+            if node[bit] is None:
+                return False
+            path.append((node, bit))
+            node = node[bit]
+
+        if not node[_VALUES] or value not in node[_VALUES]:
+            return False
+
+        node[_VALUES].remove(value)
+        self._size -= 1
+        if not node[_VALUES]:
+            node[_VALUES] = None
+
+        # Prune the branches that no longer lead to any values
+        while path and node[_ZERO] is None and node[_ONE] is None and not node[_VALUES]:
+            parent, bit = path.pop()
+            parent[bit] = None
+            node = parent
+
+        return True
+
+    def matches(self, address):
+        """
+        Yields the ( prefixlen, values ) of every network containing the given address,
+        longest prefix first
+        """
+
+        if not isinstance(address, (IPv4Address, IPv6Address)):
+            address = ip_address(address)
+
+        node = self._roots[address.version]
+        found = []
+        if node[_VALUES]:
+            found.append((0, node[_VALUES]))
+
+        prefixlen = 0
+        for bit in self._bits(
+            int(address), address.max_prefixlen, address.max_prefixlen
+        ):
+            node = node[bit]
+            if node is None:
+                break
+
+            prefixlen += 1
+            if node[_VALUES]:
+                found.append((prefixlen, node[_VALUES]))
+
+        yield from reversed(found)
+
+    def lookup(self, address):
+        """
+        Returns the value of the longest network containing the given address, or None
+
+        When the same network maps to several values, the most recently inserted wins.
+        """
+
+        for _, values in self.matches(address):
+            return values[-1]
+
+        return None